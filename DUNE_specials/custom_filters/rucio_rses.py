@@ -1,7 +1,7 @@
-import os
-from metacat.filters import MetaCatFilter
+import os, threading
+from metacat.filters import MetaCatBatchFilter, filter_cache
 
-class RucioReplicas(MetaCatFilter):
+class RucioReplicas(MetaCatBatchFilter):
     """
     Inputs: single file set
     
@@ -11,33 +11,38 @@ class RucioReplicas(MetaCatFilter):
     
     Configuration:
         rucio_config:   path to Rucio client configuration file. If unspecified, standard Rucio config file lookup procedure will be used.
+        concurrency:    number of batches of 1000 files to look up in Rucio concurrently, default 1
+        cache:          optional replica list cache configuration: {"capacity":..., "ttl":..., "sqlite":<path>}, see metacat.filters.filter_cache()
     """
 
     def __init__(self, config):
-        MetaCatFilter.__init__(self, config)
+        MetaCatBatchFilter.__init__(self, config, batch_size=1000,         # Rucio can not handle more than 1000 dids at a time
+                concurrency=config.get("concurrency", 1), cache=filter_cache(config.get("cache")))
         self.RucioConfig = config.get("rucio_config")
-
-    def filter(self, inputs, *params, **ignore):
-
-        from rucio.client.replicaclient import ReplicaClient
-        if self.RucioConfig is not None:
-            os.environ["RUCIO_CONFIG"] = self.RucioConfig
-        client = ReplicaClient()
-
-        for chunk in inputs[0].chunked(1000):               # Rucio can not handle more than 1000 dids at a time
-            chunk_files = {f.did(): f for f in chunk}
-            dids = [{"scope":f.Namespace, "name":f.Name} for f in chunk]
-            for f in chunk_files.values():
-                f.Metadata["rucio.rses"] = []
-
-            replicas = client.list_replicas(dids, all_states=False, ignore_availability=False, resolve_archives=False)
-
-            for r in replicas:
-                did = "%(scope)s:%(name)s" % r
-                f = chunk_files[did]
-                f.Metadata["rucio.rses"] = list(r["rses"].keys())
-
-            yield from chunk_files.values()
+        self.Clients = threading.local()        # batches may be processed in different threads
+
+    def client(self):
+        client = getattr(self.Clients, "client", None)
+        if client is None:
+            from rucio.client.replicaclient import ReplicaClient
+            if self.RucioConfig is not None:
+                os.environ["RUCIO_CONFIG"] = self.RucioConfig
+            client = self.Clients.client = ReplicaClient()
+        return client
+
+    def list_rses(self, dids):
+        # dids: list of "scope:name" strings
+        # returns {did: [rse, ...]}
+        replicas = self.client().list_replicas([dict(zip(("scope", "name"), did.split(":", 1))) for did in dids],
+                all_states=False, ignore_availability=False, resolve_archives=False)
+        return {"%(scope)s:%(name)s" % r: list(r["rses"].keys()) for r in replicas}
+
+    def filter_batch(self, batch, *params, **ignore):
+        chunk_files = {f.did(): f for f in batch}
+        rses = self.cached_lookup(chunk_files.keys(), self.list_rses)
+        for did, f in chunk_files.items():
+            f.Metadata["rucio.rses"] = rses.get(did, [])
+        return list(chunk_files.values())
 
 def create_filters(config):
     return {
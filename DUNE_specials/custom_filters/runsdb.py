@@ -1,4 +1,4 @@
-from metacat.filters import MetaCatFilter
+from metacat.filters import MetaCatFilter, filter_cache
 from wsdbtools import ConnectionPool
 import re
 
@@ -23,13 +23,14 @@ class RunsDB(MetaCatFilter):
         table:          table name
         columns:        list of columns to add values from
         meta_prefix:    metadata parameter category to use to add metadata values
+        cache:          optional run record cache configuration: {"capacity":..., "ttl":..., "sqlite":<path>}, see metacat.filters.filter_cache()
     """
     
     def __init__(self, config):
         self.Config = config
         show_config = config.copy()
         show_config["connection"] = self.hide(show_config["connection"], "user", "password")
-        MetaCatFilter.__init__(self, show_config)
+        MetaCatFilter.__init__(self, show_config, cache=filter_cache(config.get("cache")))
         self.Connection = self.Config["connection"]
         self.ConnPool = ConnectionPool(postgres=self.Connection, max_idle_connections=1)
         self.TableName = self.Config["table"]
@@ -49,28 +50,29 @@ class RunsDB(MetaCatFilter):
 
         colnames = ("," + ",".join(self.IncludeColumns)) if self.IncludeColumns else ""
 
-        for chunk in inputs[0].chunked():
-            by_run = {}
-            for f in chunk:
-                if "core.runs" in f.Metadata:
-                    for runnum in f.Metadata["core.runs"]:
-                        by_run.setdefault(runnum,[]).append(f)
-            run_nums = list(by_run.keys())
+        def lookup(keys):
+            # keys: [(runnum, daqinterface_commit, mode), ...]
             cursor.execute(f"""
                 select runnum {colnames}
                     from {self.TableName}
                     where runnum = any(%s)
                         and (%s is null or daqinterface_commit=%s)
                         and (%s is null or mode=%s)
-            """, (run_nums, daqinterface_commit, daqinterface_commit, mode, mode))
-            tup = cursor.fetchone()
-            while tup:
-                runnum, rest = tup[0], tup[1:]
+            """, ([runnum for runnum, _, _ in keys], daqinterface_commit, daqinterface_commit, mode, mode))
+            return {(tup[0], daqinterface_commit, mode): tup[1:] for tup in cursor.fetchall()}
+
+        for chunk in inputs[0].chunked():
+            by_run = {}
+            for f in chunk:
+                if "core.runs" in f.Metadata:
+                    for runnum in f.Metadata["core.runs"]:
+                        by_run.setdefault(runnum,[]).append(f)
+            runs = self.cached_lookup([(runnum, daqinterface_commit, mode) for runnum in by_run], lookup)
+            for (runnum, _, _), rest in runs.items():
                 for f in by_run[runnum]:
                     for column, value in zip(self.IncludeColumns, rest):
                         f.Metadata[f"{self.MetaPrefix}.{column}"] = value
                     yield f
-                tup = cursor.fetchone()
 
 def create_filters(config):
     return {
@@ -38,7 +38,8 @@ class MetaCatDaemon(Logged):
 
         self.UserNamespaceTemplate = daemon_config.get("user_namespace_template", "")
         self.FerryUpdateInterval = daemon_config.get("ferry_update_interval", 1 * 3600)
-        self.CountsUpdateInterval = daemon_config.get("counts_update_interval", 1 * 3600)
+        self.CountsUpdateInterval = daemon_config.get("counts_update_interval", 60)          # apply logged file count changes
+        self.CountsRecountInterval = daemon_config.get("counts_recount_interval", 24 * 3600) # recalculate file counts from scratch
         self.VO = daemon_config["vo"]
 
         role_pattern_txt = daemon_config.get("role_pattern", "")
@@ -60,12 +61,8 @@ class MetaCatDaemon(Logged):
 
         self.Queue = TaskQueue(5, delegate=self)
         self.Queue.append(self.ferry_update, interval=self.FerryUpdateInterval, after=time.time())
-        self.Queue.append(
-            self.update_dataset_file_counts, interval=self.CountsUpdateInterval, after=0
-        )  # self.CountsUpdateInterval//3)
-        self.Queue.append(
-            self.update_namespace_file_counts, interval=self.CountsUpdateInterval, after=0
-        )  # 2*self.CountsUpdateInterval//3)
+        self.Queue.append(self.update_file_counts, interval=self.CountsUpdateInterval, after=0)
+        self.Queue.append(self.recount_files, interval=self.CountsRecountInterval, after=0)
         self.debug("tasks enqueued")
 
     def db(self):
@@ -75,24 +72,22 @@ class MetaCatDaemon(Logged):
         return ConnectionWithTransactions(db)
 
     @log_exceptions
-    def update_dataset_file_counts(self):
+    def update_file_counts(self):
+        # file counts are changed incrementally by the database triggers, the changes are applied here
         db = self.db()
-        counts = DBDataset.file_count_by_dataset(db)
-        for ds in DBDataset.list(db):
-            ds.FileCount = counts.get((ds.Namespace, ds.Name), 0)
-            ds.save()
+        ndatasets = DBDataset.update_file_counts(db)
+        nnamespaces = DBNamespace.update_file_counts(db)
         db.close()
-        self.log("Dataset file counts updated")
+        self.debug(f"File counts updated for {ndatasets} datasets and {nnamespaces} namespaces")
 
     @log_exceptions
-    def update_namespace_file_counts(self):
+    def recount_files(self):
+        # consistency check
         db = self.db()
-        counts = DBFile.file_count_by_namespace(db)
-        for ns in DBNamespace.list(db):
-            ns.FileCount = counts.get(ns.Name, 0)
-            ns.save()
+        ndatasets = DBDataset.update_file_counts(db, recount=True)
+        nnamespaces = DBNamespace.update_file_counts(db, recount=True)
         db.close()
-        self.log("Namespace file counts updated")
+        self.log(f"Files recounted. Corrected counts for {ndatasets} datasets and {nnamespaces} namespaces")
 
 
     def do_auth(self):
@@ -0,0 +1,66 @@
+import time
+from threading import RLock
+from collections import OrderedDict
+
+class AuthCache(object):
+    #
+    # In-process LRU cache with TTL for verified tokens and users resolved from them.
+    # An entry may have its own expiration time, e.g. token expiration, earlier than the TTL
+    #
+
+    def __init__(self, capacity=10000, ttl=60):
+        self.Capacity = capacity
+        self.TTL = ttl
+        self.Entries = OrderedDict()        # key -> (expiration, value)
+        self.Lock = RLock()
+        self.Hits = self.Misses = self.Invalidations = 0
+
+    @property
+    def enabled(self):
+        return bool(self.Capacity and self.TTL)
+
+    def get(self, key):
+        now = time.time()
+        with self.Lock:
+            entry = self.Entries.get(key)
+            if entry is not None:
+                expiration, value = entry
+                if expiration > now:
+                    self.Entries.move_to_end(key)
+                    self.Hits += 1
+                    return value
+                del self.Entries[key]
+            self.Misses += 1
+            return None
+
+    def put(self, key, value, expiration=None):
+        if not self.enabled:
+            return
+        expiration = min(time.time() + self.TTL, expiration or float("inf"))
+        with self.Lock:
+            self.Entries[key] = (expiration, value)
+            self.Entries.move_to_end(key)
+            while len(self.Entries) > self.Capacity:
+                self.Entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        # removes one entry or, if key is None, all entries
+        with self.Lock:
+            if key is None:
+                self.Entries.clear()
+            else:
+                self.Entries.pop(key, None)
+            self.Invalidations += 1
+
+    def stats(self):
+        with self.Lock:
+            lookups = self.Hits + self.Misses
+            return dict(
+                size = len(self.Entries),
+                capacity = self.Capacity,
+                ttl = self.TTL,
+                hits = self.Hits,
+                misses = self.Misses,
+                hit_rate = self.Hits/lookups if lookups else 0.0,
+                invalidations = self.Invalidations
+            )
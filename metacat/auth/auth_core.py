@@ -8,6 +8,7 @@ from metacat.common import (digest_server,
 )
 
 from metacat.auth import BaseDBUser as DBUser
+from .auth_cache import AuthCache
 import psycopg2, json, time, secrets, traceback, hashlib, pprint, os, yaml
 
 class AuthenticationCore(object):
@@ -40,6 +41,16 @@ class AuthenticationCore(object):
             self.TokenSecret = h.digest()
         self.TokenExpiration = self.DefaultTokenExpiration
 
+        # authentication:
+        #   cache:
+        #       capacity: 10000     # tokens and users, each
+        #       ttl: 60             # seconds, 0 to disable caching
+        cache_config = self.AuthConfig.get("cache", {})
+        capacity = cache_config.get("capacity", 10000)
+        ttl = cache_config.get("ttl", 60)
+        self.TokenCache = AuthCache(capacity, ttl)       # encoded token -> verified SignedToken
+        self.UserCache = AuthCache(capacity, ttl)        # username -> user without DB connection
+
     def connstr(self, cfg):
         cs = "host=%(host)s port=%(port)s dbname=%(dbname)s user=%(user)s" % cfg
         if cfg.get("password"):
@@ -60,7 +71,36 @@ class AuthenticationCore(object):
         db = self.user_db()
         return DBUser.get(db, username)
 
+    def cached_user(self, username, db=None):
+        # user for a request authenticated with a verified token. Authentication methods use get_user() instead
+        # to see current authentication info. The user is bound to db, default: user database
+        user = self.UserCache.get(username)
+        if user is None:
+            user = self.get_user(username) if db is None else DBUser.get(db, username)
+            if user is None:
+                return None
+            self.UserCache.put(username, self._user_copy(user, None))
+            return user
+        return self._user_copy(user, db if db is not None else self.user_db())
+
+    @staticmethod
+    def _user_copy(user, db):
+        u = DBUser(db, user.Username, user.Name, user.EMail, user.Flags, json.loads(json.dumps(user.AuthInfo)), user.AUID)
+        u.RoleNames = None if user.RoleNames is None else list(user.RoleNames)
+        return u
+
+    def invalidate_user(self, username=None):
+        # to be called when user flags, authentication info or roles change. username=None invalidates all users
+        self.UserCache.invalidate(username)
+
+    def cache_stats(self):
+        return dict(tokens = self.TokenCache.stats(), users = self.UserCache.stats())
+
     def verify_token(self, encoded_token):
+        cache_key = to_bytes(encoded_token).strip()
+        token = self.TokenCache.get(cache_key)
+        if token is not None:
+            return token, None
         try:    
             token = SignedToken.from_bytes(encoded_token)
             #print("verify_token: token:", token.Payload)
@@ -80,6 +120,7 @@ class AuthenticationCore(object):
             return None, str(e)
         else:
             #print("verify_token: token:", token, "  subject:", token.subject)
+            self.TokenCache.put(cache_key, token, token.expiration)
             return token, None
 
     def generate_token(self, user, payload={}, expiration=None):
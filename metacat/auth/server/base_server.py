@@ -1,14 +1,13 @@
 # common functionality for Auth, GUI and Data servers
 
 from webpie import WPApp, Response, WPHandler
-from wsdbtools import ConnectionPool
 from metacat.util import to_str, to_bytes
 from metacat.auth import BaseDBUser, AuthenticationCore
 from metacat.common import (
     SignedToken, SignedTokenExpiredError, SignedTokenImmatureError, SignedTokenUnacceptedAlgorithmError, 
-    SignedTokenSignatureVerificationError
+    SignedTokenSignatureVerificationError, DBConnectionPool
 )
-import psycopg2, json, time, secrets, traceback, hashlib, pprint, os, yaml
+import psycopg2, json, time, secrets, traceback, hashlib, pprint, os, yaml, threading
 from urllib.parse import quote_plus, unquote_plus
 
 class BaseApp(WPApp):
@@ -18,10 +17,12 @@ class BaseApp(WPApp):
         self.Cfg = cfg
         
         db_config = cfg["database"]
-        self.DB = ConnectionPool(postgres=db_config, max_idle_connections=1, idle_timeout=5)
+        self.DB = self.connection_pool(db_config)
+        self.RequestConnection = db_config.get("pool", {}).get("connection_per_request", True)
+        self.RequestScope = threading.local()          # connection leased for the request being processed by the thread
 
         if "user_database" in cfg:
-            self.UserDB = ConnectionPool(postgres=cfg["user_database"], max_idle_connections=1, idle_timeout=5)
+            self.UserDB = self.connection_pool(cfg["user_database"])
         else:
             self.UserDB = self.DB
 
@@ -34,8 +35,62 @@ class BaseApp(WPApp):
         if cfg.get("password"):
             cs += " password=%(password)s" % cfg
         return cs
-        
-            
+
+    def connection_pool(self, db_config):
+        # database:
+        #   host, port, ...
+        #   schema: ...
+        #   pool:
+        #       min_connections: 1          # opened at startup
+        #       max_connections: 20
+        #       max_idle_connections: ...   # default: max_connections
+        #       idle_timeout: 300
+        #       max_wait: 30                # seconds to wait for a connection when all are in use
+        #       health_check_interval: 30
+        #       prewarm: true
+        #       connection_per_request: true
+        #   session:                        # settings for each connection
+        #       statement_timeout: 10min
+        #       work_mem: 64MB
+        pool_config = db_config.get("pool", {})
+        pool = DBConnectionPool(self.connstr(db_config),
+                    min_connections = pool_config.get("min_connections", 1),
+                    max_connections = pool_config.get("max_connections", 20),
+                    max_idle_connections = pool_config.get("max_idle_connections"),
+                    idle_timeout = pool_config.get("idle_timeout", 300),
+                    max_wait = pool_config.get("max_wait", 30),
+                    health_check_interval = pool_config.get("health_check_interval", 30),
+                    schema = db_config.get("schema"),
+                    session_settings = db_config.get("session", {})
+        )
+        if pool_config.get("prewarm", True):
+            try:    pool.prewarm()
+            except Exception as e:
+                # the pool will open connections when they are needed
+                print("Error prewarming database connection pool:", e)
+        return pool
+
+    def __call__(self, environ, start_response):
+        # handler calls made while processing the request share one connection lease. Response generators
+        # keep the lease until they are done
+        self.RequestScope.InRequest = True
+        try:
+            return WPApp.__call__(self, environ, start_response)
+        finally:
+            self.RequestScope.InRequest = False
+            self.RequestScope.Connection = None
+
+    def connect(self):
+        if not self.RequestConnection or not getattr(self.RequestScope, "InRequest", False):
+            # outside of a request, e.g. in a thread running query branches, lease a separate connection
+            return self.DB.connect()
+        conn = getattr(self.RequestScope, "Connection", None)
+        if conn is None:
+            conn = self.RequestScope.Connection = self.DB.connect()
+        return conn
+
+    db = connect        # for compatibility
+
     def init(self):
         #print("ScriptHome:", self.ScriptHome)
         self.initJinjaEnvironment(tempdirs=[self.ScriptHome, self.ScriptHome + "/templates"])
@@ -44,12 +99,9 @@ class BaseApp(WPApp):
         self.AuthCore = AuthenticationCore(config)
         return self.AuthCore
 
-    def connect(self):
-        return self.DB.connect()
-        
-    db = connect        # for compatibility
-    
     def user_db(self):
+        if self.UserDB is self.DB:
+            return self.connect()
         return self.UserDB.connect()
         
     def auth_config(self, method, group=None):
@@ -104,7 +156,7 @@ class BaseHandler(WPHandler):
     def authenticated_user(self):
         username, error = self.authenticated_username()
         if username:
-            user = self.AuthCore.get_user(username)
+            user = self.AuthCore.cached_user(username)
             if user is not None:
                 return user, None
             error = f"user {username} not found"
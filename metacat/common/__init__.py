@@ -11,3 +11,4 @@ from .password_hash import password_hash, PasswordHashAlgorithm, password_digest
 from .auth_client import TokenAuthClientMixin, AuthenticationError
 from .attributes import FileAttributes, DatasetAttributes
 from .transaction import ConnectionWithTransactions, Transaction
+from .connection_pool import DBConnectionPool, PooledConnection, PoolTimeoutError
@@ -8,3 +8,29 @@ DatasetAttributes = [
     "creator", "created_timestamp", "namespace", "name",
     "description", "frozen", "monotonic", "file_count"
 ]
+
+# column types of the attributes, used to bind the values compared with them in SQL
+FileAttributeTypes = {
+    "creator":              "text",
+    "created_timestamp":    "timestamptz",
+    "name":                 "text",
+    "namespace":            "text",
+    "size":                 "bigint",
+    "retired":              "boolean",
+    "retired_by":           "text",
+    "retired_timestamp":    "timestamptz",
+    "updated_by":           "text",
+    "updated_timestamp":    "timestamptz",
+    "checksums":            "jsonb"
+}
+
+DatasetAttributeTypes = {
+    "creator":              "text",
+    "created_timestamp":    "timestamptz",
+    "namespace":            "text",
+    "name":                 "text",
+    "description":          "text",
+    "frozen":               "boolean",
+    "monotonic":            "boolean",
+    "file_count":           "bigint"
+}
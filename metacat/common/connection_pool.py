@@ -0,0 +1,272 @@
+import time, threading
+from .transaction import ConnectionWithTransactions, Transaction
+
+#
+# Pool of Postgres connections. psycopg2 is imported only when a connection is opened
+#
+# Connections are leased with DBConnectionPool.connect(). The leased connection is returned to the pool when the
+# PooledConnection object and all the cursors and transactions created from it are garbage collected, or when
+# it is closed explicitly, so a generator streaming query results keeps its connection until it is done
+#
+
+# psycopg2.extensions.TRANSACTION_STATUS_* values
+_STATUS_IDLE = 0
+_STATUS_INTRANS = 2
+_STATUS_INERROR = 3
+
+class PoolTimeoutError(Exception):
+
+    def __init__(self, waited, max_connections):
+        self.Waited = waited
+        self.MaxConnections = max_connections
+
+    def __str__(self):
+        return "Timed out waiting for a database connection after %.1f seconds, all %d connections in use" % (
+            self.Waited, self.MaxConnections)
+
+
+class _LeasedCursor(object):
+    # psycopg2 cursor, which keeps the connection leased while the cursor is in use
+
+    def __init__(self, lease, cursor):
+        self.__dict__["Lease"] = lease
+        self.__dict__["Cursor"] = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.Cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.Cursor, name, value)
+
+    def __iter__(self):
+        yield from self.Cursor
+
+    def __enter__(self):
+        self.Cursor.__enter__()
+        return self
+
+    def __exit__(self, *params):
+        return self.Cursor.__exit__(*params)
+
+
+class PooledConnection(ConnectionWithTransactions):
+
+    def __init__(self, pool, conn):
+        ConnectionWithTransactions.__init__(self, conn)
+        self.Pool = pool
+        self.LeasedAt = time.time()
+
+    def cursor(self, *params, **args):
+        if self.Connection is None:
+            raise RuntimeError("Connection returned to the pool")
+        return _LeasedCursor(self, self.Connection.cursor(*params, **args))
+
+    def transaction(self, **args):
+        return Transaction(self, **args)
+
+    def close(self):
+        # returns the connection to the pool
+        conn, self.Connection = self.Connection, None
+        if conn is not None:
+            self.Pool.release(conn, time.time() - self.LeasedAt)
+
+    def __del__(self):
+        self.close()
+
+
+class DBConnectionPool(object):
+
+    def __init__(self, connstr, min_connections=1, max_connections=20, max_idle_connections=None, idle_timeout=300,
+                max_wait=30, health_check_interval=30, schema=None, session_settings={}, connect=None):
+        #
+        # min_connections:          number of connections opened by prewarm() and kept open while idle
+        # max_connections:          maximum number of open connections, idle and leased. connect() waits for a connection
+        #                           to be released when the pool is at the maximum, up to max_wait seconds
+        # max_idle_connections:     maximum number of idle connections kept open, default: max_connections
+        # idle_timeout:             idle connections above min_connections are closed after idle_timeout seconds
+        # health_check_interval:    connections idle longer than this are checked before they are leased
+        # schema, session_settings: search_path and other settings, e.g. statement_timeout, work_mem,
+        #                           set once for each new connection
+        # connect:                  function to open new raw connection, default: psycopg2.connect
+        #
+        self.ConnStr = connstr
+        self.MinConnections = min_connections
+        self.MaxConnections = max(max_connections, min_connections, 1)
+        self.MaxIdleConnections = self.MaxConnections if max_idle_connections is None \
+                else max(max_idle_connections, min_connections)
+        self.IdleTimeout = idle_timeout
+        self.MaxWait = max_wait
+        self.HealthCheckInterval = health_check_interval
+        self.Schema = schema
+        self.SessionSettings = dict(session_settings or {})
+        self.ConnectFunction = connect
+
+        self.Lock = threading.Condition()
+        self.Idle = []                  # [(connection, released at)], most recently released last
+        self.NConnections = 0           # open connections, idle and leased, including those being opened
+
+        self.Leases = 0
+        self.Waits = 0
+        self.Timeouts = 0
+        self.TotalWaitTime = self.MaxWaitTime = 0.0
+        self.Released = 0
+        self.TotalLeaseTime = self.MaxLeaseTime = 0.0
+        self.Created = 0
+        self.Closed = 0
+        self.HealthCheckFailures = 0
+
+    def open(self):
+        if self.ConnectFunction is not None:
+            conn = self.ConnectFunction(self.ConnStr)
+        else:
+            import psycopg2
+            conn = psycopg2.connect(self.ConnStr)
+        c = conn.cursor()
+        if self.Schema:
+            c.execute("select set_config('search_path', %s, false)", (self.Schema,))
+        for name, value in self.SessionSettings.items():
+            c.execute("select set_config(%s, %s, false)", (name, str(value)))
+        conn.commit()
+        with self.Lock:
+            self.Created += 1
+        return conn
+
+    def close_connection(self, conn):
+        try:    conn.close()
+        except: pass
+        with self.Lock:
+            self.Closed += 1
+
+    def healthy(self, conn):
+        try:
+            if conn.closed:
+                return False
+            c = conn.cursor()
+            c.execute("select 1")
+            c.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def prewarm(self):
+        # opens connections up to min_connections. Returns number of connections opened
+        with self.Lock:
+            n = max(0, self.MinConnections - self.NConnections)
+            self.NConnections += n
+        opened = 0
+        try:
+            for _ in range(n):
+                conn = self.open()
+                with self.Lock:
+                    self.Idle.append((conn, time.time()))
+                    self.Lock.notify()
+                opened += 1
+        finally:
+            if opened < n:
+                with self.Lock:
+                    self.NConnections -= n - opened
+                    self.Lock.notify_all()
+        return opened
+
+    def connect(self):
+        t0 = time.time()
+        conn = None
+        waited = False
+        with self.Lock:
+            while True:
+                if self.Idle:
+                    conn, released_at = self.Idle.pop()
+                    break
+                if self.NConnections < self.MaxConnections:
+                    self.NConnections += 1          # reserve the slot and open new connection outside of the lock
+                    break
+                waited = True
+                remaining = self.MaxWait - (time.time() - t0)
+                if remaining <= 0:
+                    self.Timeouts += 1
+                    raise PoolTimeoutError(time.time() - t0, self.MaxConnections)
+                self.Lock.wait(remaining)
+            wait_time = time.time() - t0
+            self.Leases += 1
+            if waited:
+                self.Waits += 1
+            self.TotalWaitTime += wait_time
+            self.MaxWaitTime = max(self.MaxWaitTime, wait_time)
+
+        if conn is not None and (conn.closed or
+                    time.time() - released_at > self.HealthCheckInterval and not self.healthy(conn)):
+            with self.Lock:
+                self.HealthCheckFailures += 1
+            self.close_connection(conn)
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self.open()
+            except:
+                with self.Lock:
+                    self.NConnections -= 1
+                    self.Lock.notify()
+                raise
+        return PooledConnection(self, conn)
+
+    def release(self, conn, lease_time):
+        # rolls back the transaction left open by the request, e.g. by a failed or abandoned operation,
+        # so that it is not committed implicitly together with the work of the next lease.
+        # The work to be kept must be committed explicitly, see Transaction and transactioned()
+        reusable = False
+        try:
+            if not conn.closed:
+                if conn.get_transaction_status() in (_STATUS_INTRANS, _STATUS_INERROR):
+                    conn.rollback()
+                reusable = conn.get_transaction_status() == _STATUS_IDLE
+        except Exception:
+            reusable = False
+        now = time.time()
+        to_close = [] if reusable else [conn]
+        with self.Lock:
+            self.Released += 1
+            self.TotalLeaseTime += lease_time
+            self.MaxLeaseTime = max(self.MaxLeaseTime, lease_time)
+            if reusable and len(self.Idle) < self.MaxIdleConnections:
+                self.Idle.append((conn, now))
+            else:
+                if reusable:
+                    to_close.append(conn)
+                self.NConnections -= 1
+            while self.Idle and self.NConnections > self.MinConnections and now - self.Idle[0][1] > self.IdleTimeout:
+                expired, _ = self.Idle.pop(0)
+                to_close.append(expired)
+                self.NConnections -= 1
+            self.Lock.notify()
+        for c in to_close:
+            self.close_connection(c)
+
+    def stats(self):
+        with self.Lock:
+            idle = len(self.Idle)
+            return dict(
+                connections = self.NConnections,
+                idle = idle,
+                leased = self.NConnections - idle,
+                min_connections = self.MinConnections,
+                max_connections = self.MaxConnections,
+                max_idle_connections = self.MaxIdleConnections,
+                leases = self.Leases,
+                waits = self.Waits,
+                timeouts = self.Timeouts,
+                wait_time = dict(
+                    total = self.TotalWaitTime,
+                    max = self.MaxWaitTime,
+                    average = self.TotalWaitTime/self.Leases if self.Leases else 0.0
+                ),
+                lease_time = dict(
+                    total = self.TotalLeaseTime,
+                    max = self.MaxLeaseTime,
+                    average = self.TotalLeaseTime/self.Released if self.Released else 0.0
+                ),
+                created = self.Created,
+                closed = self.Closed,
+                health_check_failures = self.HealthCheckFailures
+            )
@@ -136,11 +136,14 @@ class DBManyToMany(object):
         cols, vals = zip(*col_vals)
         cols = ",".join(cols)
         vals = ",".join([f"'{v}'" for v in vals])
+        commit = c is None          # otherwise the caller commits, see set()
         if c is None: c = self.DB.cursor()
         c.execute(f"""
             insert into {self.Table}({cols}) values({vals})
                 on conflict({cols}) do nothing
         """)
+        if commit:
+            c.execute("commit")
         return self
         
     def contains(self, *vals, c=None):
@@ -161,12 +164,15 @@ class DBManyToMany(object):
 
     def remove(self, *vals, c=None, all=False):
         assert all or len(vals) == len(self.VarColumns)
+        commit = c is None          # otherwise the caller commits, see set()
         if c is None: c = self.DB.cursor()
         where = self.Where
         if not all:
             col_vals = list(zip(self.ReferenceColumns, vals))
             where += " and " + " and ".join(["%s='%s'" % (k,v) for k, v in col_vals])
         c.execute(f"delete from {self.Table} {where}")
+        if commit:
+            c.execute("commit")
         return self
         
     def set(self, lst, c=None):
@@ -1,5 +1,6 @@
 from .trees import Ascender, Node
-from .attributes import FileAttributes, DatasetAttributes
+from .attributes import FileAttributes, DatasetAttributes, FileAttributeTypes, DatasetAttributeTypes
+from datetime import datetime, timezone
 
 #FileAttributes = [      # file attributes which can be used in queries
 #    "creator", "created_timestamp", "name", "namespace", "size"
@@ -69,6 +70,7 @@ class _MetaRegularizer(Ascender):
 class MetaExpressionDNF(object):
     
     ObjectAttributes = []
+    ObjectAttributeTypes = {}
     
     def __init__(self, exp):
         #
@@ -97,29 +99,39 @@ class MetaExpressionDNF(object):
     def regularize(exp):
         return _MetaRegularizer()(exp)
 
-    def sql_and(self, and_terms, table_name, meta_column_name="metadata"):
-        
-        def sql_literal(v):
-            if isinstance(v, str):       
-                v = "'%s'" % (v,)
+    def sql_and(self, and_terms, table_name, meta_column_name="metadata", params=None):
+        # literals are bound as parameters in params (SQLParams), jsonpath expressions are bound as jsonpath parameters
+
+        def json_literal(v):
+            if isinstance(v, str):       v = '"%s"' % (v,)
             elif isinstance(v, bool):    v = "true" if v else "false"
             elif v is None:              v = "null"
             else:   v = str(v)
             return v
             
-        def json_literal(v):
-            if isinstance(v, str):       v = '"%s"' % (v,)
-            else:   v = sql_literal(v)
+        def bind(v):
+            return params.bind(v)
+
+        def bind_list(values):
+            return params.bind(list(values))
+
+        def bind_jsonpath(path):
+            return params.bind(path, "jsonpath")
+
+        def attribute_value(name, v):
+            # date constants are numeric timestamps
+            if self.ObjectAttributeTypes.get(name) == "timestamptz" and isinstance(v, (int, float)) \
+                        and not isinstance(v, bool):
+                v = datetime.fromtimestamp(v, timezone.utc)
             return v
-            
-        def pg_type(v):
-            if isinstance(v, bool):   pgtype='boolean'
-            elif isinstance(v, str):   pgtype='text'
-            elif isinstance(v, int):   pgtype='bigint'
-            elif isinstance(v, float):   pgtype='double precision'
-            else:
-                raise ValueError("Unrecognized literal type: %s %s" % (v, type(v)))
-            return pgtype
+
+        def bind_attribute(name, v):
+            # the value is compared with the column, so it is bound with the column type
+            return params.bind(attribute_value(name, v), self.ObjectAttributeTypes.get(name))
+
+        def bind_attribute_list(name, values):
+            typ = self.ObjectAttributeTypes.get(name)
+            return params.bind([attribute_value(name, v) for v in values], typ and typ + "[]")
             
         contains_items = []
         parts = []
@@ -139,7 +151,7 @@ class MetaExpressionDNF(object):
 
             if op in ("present", "not_present"):
                 aname = exp["name"]
-                term = f"{table_name}.{meta_column_name} ? '{aname}'"
+                term = f"{table_name}.{meta_column_name} ? {bind(aname)}"
                 if op == "not_present":
                     negate = not negate
 
@@ -181,19 +193,15 @@ class MetaExpressionDNF(object):
                     if typ == "date_constant":
                         high = float(high + 3600*24 - 0.0001)
                     if arg.T == "object_attribute":
-                        low = sql_literal(low)
-                        high = sql_literal(high)
-                    else:
-                        low = json_literal(low)
-                        high = json_literal(high)
-                    if arg.T == "object_attribute":
-                        term = f"{table_name}.{aname} between {low} and {high}"
+                        term = f"{table_name}.{aname} between {bind_attribute(aname, low)} and {bind_attribute(aname, high)}"
                     elif arg.T in ("subscript", "scalar", "array_any"):
-                        term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? (@ >= {low} && @ <= {high})'"
+                        low, high = json_literal(low), json_literal(high)
+                        path = bind_jsonpath(f'$."{aname}"{subscript} ? (@ >= {low} && @ <= {high})')
+                        term = f"{table_name}.{meta_column_name} @? {path}"
                     elif arg.T == "array_length":
                         n = "not" if negate else ""
                         negate = False
-                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> '{aname}') {n} between {low} and {high}"
+                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> {bind(aname)}) {n} between {bind(low)} and {bind(high)}"
                         
                 if op == "not_in_range":
                     assert len(args) == 1
@@ -201,53 +209,43 @@ class MetaExpressionDNF(object):
                     if typ == "date_constant":
                         high = float(high + 3600*24 - 0.0001)
                     if arg.T == "object_attribute":
-                        low = sql_literal(low)
-                        high = sql_literal(high)
-                    else:
-                        low = json_literal(low)
-                        high = json_literal(high)
-                    if arg.T == "object_attribute":
-                        term = f"not ({table_name}.{aname} between {low} and {high})"
+                        term = f"not ({table_name}.{aname} between {bind_attribute(aname, low)} and {bind_attribute(aname, high)})"
                     elif arg.T in ("subscript", "scalar", "array_any"):
-                        term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? (@ < {low} || @ > {high})'"
+                        low, high = json_literal(low), json_literal(high)
+                        path = bind_jsonpath(f'$."{aname}"{subscript} ? (@ < {low} || @ > {high})')
+                        term = f"{table_name}.{meta_column_name} @? {path}"
                     elif arg.T == "array_length":
                         n = "" if negate else "not"
                         negate = False
-                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> '{aname}') {n} between {low} and {high}"
+                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> {bind(aname)}) {n} between {bind(low)} and {bind(high)}"
                         
                 elif op == "in_set":
                     if arg.T == "object_attribute":
-                        values = [sql_literal(v) for v in exp["set"]]
-                        value_list = ",".join(values)
-                        term = f"{table_name}.{aname} in ({value_list})"
+                        term = f"{table_name}.{aname} = any({bind_attribute_list(aname, exp['set'])})"
                     elif arg.T == "array_length":
-                        values = [sql_literal(v) for v in exp["set"]]
-                        value_list = ",".join(values)
                         n = "not" if negate else ""
                         negate = False
-                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> '{aname}') {n} in ({value_list})"
+                        term = f"{n} (jsonb_array_length({table_name}.{meta_column_name} -> {bind(aname)}) = any({bind_list(exp['set'])}))"
                     else:           # arg.T in ("array_any", "subscript","scalar")
                         values = [json_literal(x) for x in exp["set"]]
                         or_parts = [f"@ == {v}" for v in values]
                         predicate = " || ".join(or_parts)
-                        term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? ({predicate})'"
+                        path = bind_jsonpath(f'$."{aname}"{subscript} ? ({predicate})')
+                        term = f"{table_name}.{meta_column_name} @? {path}"
                         
                 elif op == "not_in_set":
                     if arg.T == "object_attribute":
-                        values = [sql_literal(v) for v in exp["set"]]
-                        value_list = ",".join(values)
-                        term = f"not ({table_name}.{aname} in ({value_list}))"
+                        term = f"not ({table_name}.{aname} = any({bind_attribute_list(aname, exp['set'])}))"
                     elif arg.T == "array_length":
-                        values = [sql_literal(v) for v in exp["set"]]
-                        value_list = ",".join(values)
                         n = "" if negate else "not"
                         negate = False
-                        term = f"not(jsonb_array_length({table_name}.{meta_column_name} -> '{aname}') {n} in ({value_list}))"
+                        term = f"not({n} (jsonb_array_length({table_name}.{meta_column_name} -> {bind(aname)}) = any({bind_list(exp['set'])})))"
                     else:           # arg.T in ("array_any", "subscript","scalar")
                         values = [json_literal(x) for x in exp["set"]]
                         and_parts = [f"@ != {v}" for v in values]
                         predicate = " && ".join(and_parts)
-                        term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? ({predicate})'"
+                        path = bind_jsonpath(f'$."{aname}"{subscript} ? ({predicate})')
+                        term = f"{table_name}.{meta_column_name} @? {path}"
                         
                 elif op == "cmp_op":
                     cmp_op = exp["op"]
@@ -255,21 +253,21 @@ class MetaExpressionDNF(object):
                     sql_cmp_op = "=" if cmp_op == "==" else cmp_op
                     value = args[1]
                     value_type, value = value.T, value["value"]
-                    sql_value = sql_literal(value)
-                    value = json_literal(value)
                     
                     if arg.T == "object_attribute":
-                        term = f"{table_name}.{aname} {sql_cmp_op} {sql_value}"
+                        term = f"{table_name}.{aname} {sql_cmp_op} {bind_attribute(aname, value)}"
                     elif arg.T == "array_length":
-                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> '{aname}') {sql_cmp_op} {value}"
+                        term = f"jsonb_array_length({table_name}.{meta_column_name} -> {bind(aname)}) {sql_cmp_op} {bind(value)}"
                     elif value_type == "date_constant":
                         assert cmp_op in ("<", "<=", ">", ">=", "=", "==", "!=")
                         if cmp_op in ("=", "=="):
                             v1 = value + 3600*24
-                            term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? (@ < {v1} && @ >= {value})'"
+                            path = bind_jsonpath(f'$."{aname}"{subscript} ? (@ < {v1} && @ >= {value})')
+                            term = f"{table_name}.{meta_column_name} @? {path}"
                         elif cmp_op == "!=":
                             v1 = value + 3600*24
-                            term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? (@ >= {v1} || @ < {value})'"
+                            path = bind_jsonpath(f'$."{aname}"{subscript} ? (@ >= {v1} || @ < {value})')
+                            term = f"{table_name}.{meta_column_name} @? {path}"
                         else:
                             if cmp_op == ">":
                                 value += 3600*24
@@ -277,8 +275,10 @@ class MetaExpressionDNF(object):
                             elif cmp_op == "<=":
                                 value += 3600*24
                                 cmp_op = "<"
-                            term = f"{table_name}.{meta_column_name} @@ '$.\"{aname}\"{subscript} {cmp_op} {value}'"
+                            path = bind_jsonpath(f'$."{aname}"{subscript} {cmp_op} {value}')
+                            term = f"{table_name}.{meta_column_name} @@ {path}"
                     elif cmp_op in ("~", "~*", "!~", "!~*"):
+                        value = json_literal(value)
                         negate_predicate = False
                         if cmp_op.startswith('!'):
                             cmp_op = cmp_op[1:]
@@ -290,10 +290,13 @@ class MetaExpressionDNF(object):
                         predicate = f"@ like_regex {value} {flags}"
                         if negate_predicate: 
                             predicate = f"!({predicate})"
-                        term = f"{table_name}.{meta_column_name} @? '$.\"{aname}\"{subscript} ? ({predicate})'"
+                        path = bind_jsonpath(f'$."{aname}"{subscript} ? ({predicate})')
+                        term = f"{table_name}.{meta_column_name} @? {path}"
                     else:
                         # scalar, subscript, array_any
-                        term = f"{table_name}.{meta_column_name} @@ '$.\"{aname}\"{subscript} {cmp_op} {value}'"
+                        value = json_literal(value)
+                        path = bind_jsonpath(f'$."{aname}"{subscript} {cmp_op} {value}')
+                        term = f"{table_name}.{meta_column_name} @@ {path}"
                     
             if negate:  term = f"not ({term})"
             parts.append(term)
@@ -303,13 +306,15 @@ class MetaExpressionDNF(object):
         
         return parts
 
-    def sql(self, table_name, meta_column_name="metadata"):
+    def sql(self, table_name, meta_column_name="metadata", params=None):
+        # params: SQLParams object to bind the literals to
         if not self.DNF:
             return None
         else:
+            assert params is not None, "SQLParams object is required"
             out = []
             for i, or_part in enumerate(self.DNF):
-                and_parts = self.sql_and(or_part, table_name, meta_column_name)
+                and_parts = self.sql_and(or_part, table_name, meta_column_name, params)
                 for j, and_part in enumerate(and_parts):
                     #print("and_part:", and_part)
                     if i == 0:
@@ -324,10 +329,12 @@ class MetaExpressionDNF(object):
 
 class FileMetaExpressionDNF(MetaExpressionDNF):
     ObjectAttributes = FileAttributes
+    ObjectAttributeTypes = FileAttributeTypes
     
 
 class DatasetMetaExpressionDNF(MetaExpressionDNF):
     ObjectAttributes = DatasetAttributes
+    ObjectAttributeTypes = DatasetAttributeTypes
     
 
     
\ No newline at end of file
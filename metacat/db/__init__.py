@@ -4,10 +4,11 @@ from .dbobjects2 import (
 
 from .common import (
     AlreadyExistsError, NotFoundError, IntegrityError, MetaValidationError, DatasetCircularDependencyDetected,
-    parse_name, alias, make_list_if_short
+    parse_name, alias, alias_scope, make_list_if_short
 )
 
 from .param_category import DBParamCategory
+from .authorization import NamespaceAuthorizationIndex
 
 import os.path as os_path
 
@@ -0,0 +1,79 @@
+import time
+from threading import RLock
+from collections import OrderedDict
+from .dbobjects2 import DBNamespace
+
+class NamespaceAuthorizationIndex(object):
+    #
+    # Process-wide index of namespaces writable by each user, i.e. owned by the user directly or through a role.
+    # The set for a user is loaded with one query. Because other server processes can change namespace ownership
+    # and role membership too, the sets expire after TTL seconds.
+    #
+
+    def __init__(self, capacity=10000, ttl=60):
+        self.Capacity = capacity
+        self.TTL = ttl
+        self.Users = OrderedDict()          # username -> (expiration, set of namespace names)
+        self.Namespaces = {}                # namespace name -> expiration, for namespaces known to exist
+        self.Lock = RLock()
+        self.Hits = self.Misses = self.Invalidations = 0
+
+    def writable_namespaces(self, db, username):
+        now = time.time()
+        with self.Lock:
+            entry = self.Users.get(username)
+            if entry is not None:
+                expiration, names = entry
+                if expiration > now:
+                    self.Users.move_to_end(username)
+                    self.Hits += 1
+                    return names
+                del self.Users[username]
+            self.Misses += 1
+        names = frozenset(DBNamespace.names_owned_by_user(db, username))
+        if self.Capacity and self.TTL:
+            with self.Lock:
+                self.Users[username] = (now + self.TTL, names)
+                while len(self.Users) > self.Capacity:
+                    self.Users.popitem(last=False)
+        return names
+
+    def namespace_exists(self, db, namespace):
+        now = time.time()
+        with self.Lock:
+            if self.Namespaces.get(namespace, 0) > now:
+                return True
+        exists = DBNamespace.exists(db, namespace)
+        if exists and self.TTL:
+            with self.Lock:
+                if len(self.Namespaces) >= self.Capacity:
+                    self.Namespaces.clear()
+                self.Namespaces[namespace] = now + self.TTL
+        return exists
+
+    def authorized(self, db, user, namespace):
+        # raises KeyError if the namespace does not exist
+        if namespace in self.writable_namespaces(db, user.Username):
+            return True
+        if not self.namespace_exists(db, namespace):
+            raise KeyError("Namespace %s does not exist" % (namespace,))
+        return user.is_admin()
+
+    def invalidate(self):
+        # to be called when namespaces are created or their ownership or role membership change
+        with self.Lock:
+            self.Users.clear()
+            self.Namespaces.clear()
+            self.Invalidations += 1
+
+    def stats(self):
+        with self.Lock:
+            return dict(
+                users = len(self.Users),
+                namespaces = len(self.Namespaces),
+                capacity = self.Capacity,
+                ttl = self.TTL,
+                hits = self.Hits,
+                misses = self.Misses,
+                invalidations = self.Invalidations
+            )
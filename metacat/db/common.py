@@ -1,4 +1,4 @@
-import itertools, io, csv, json
+import itertools, io, csv, json, threading, queue
 from psycopg2 import IntegrityError
 
 Debug = False
@@ -8,11 +8,41 @@ def debug(*parts):
         print(*parts)
         
 Aliases = {}
+_AliasScopes = threading.local()
+
 def alias(prefix="t"):
+    # outside of alias_scope(), aliases are unique per process
     global Aliases
-    i = Aliases.get(prefix, 1)
-    Aliases[prefix] = i+1
-    return f"{prefix}_{i}"
+    scopes = getattr(_AliasScopes, "Stack", None)
+    if scopes:
+        tag, counters = scopes[-1]
+    else:
+        tag, counters = "", Aliases
+    i = counters.get(prefix, 1)
+    counters[prefix] = i+1
+    return f"{prefix}_{tag}{i}"
+
+class alias_scope(object):
+    # Within the scope, aliases are numbered from 1 in the current thread and tagged with the scope tag,
+    # so that building SQL for the same query shape always produces the same text, which can then be reused as
+    # a prepared statement. SQL built in scopes with different tags can be combined without alias conflicts.
+    # A nested scope with the same tag continues the numbering of the enclosing scope.
+
+    def __init__(self, tag):
+        self.Tag = tag
+
+    def __enter__(self):
+        scopes = getattr(_AliasScopes, "Stack", None)
+        if scopes is None:
+            scopes = _AliasScopes.Stack = []
+        if scopes and scopes[-1][0] == self.Tag:
+            scopes.append(scopes[-1])
+        else:
+            scopes.append((self.Tag, {}))
+        return self
+
+    def __exit__(self, *params):
+        _AliasScopes.Stack.pop()
 
 class AlreadyExistsError(Exception):
     pass
@@ -71,3 +101,49 @@ def make_list_if_short(iterable, limit):
             return head, None
     else:
         return None, iterable
+
+
+class _CopyOutWriter(object):
+    # file-like object passed to cursor.copy_expert(), handing the data over to copy_out() generator
+    
+    def __init__(self, q, stop):
+        self.Queue = q
+        self.Stop = stop
+        
+    def write(self, data):
+        while not self.Stop.is_set():
+            try:
+                self.Queue.put(data, timeout=1.0)
+                return len(data)
+            except queue.Full:
+                pass
+        raise RuntimeError("COPY output is no longer consumed")
+
+def copy_out(db, copy_sql, queue_size=100):
+    # runs "COPY ... TO STDOUT" and yields the output chunks as they arrive from the database
+    # copy_expert() blocks until the whole output is written, so it runs in a separate thread
+    q = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+    
+    def run():
+        try:
+            db.cursor().copy_expert(copy_sql, _CopyOutWriter(q, stop))
+            q.put(done)
+        except Exception as e:
+            if not stop.is_set():
+                q.put(e)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    try:
+        while True:
+            data = q.get()
+            if data is done:
+                break
+            elif isinstance(data, Exception):
+                raise data
+            yield data
+    finally:
+        stop.set()
+        t.join()
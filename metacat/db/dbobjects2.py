@@ -1,6 +1,6 @@
 import uuid, json, hashlib, re, time, io, traceback, base64
 from metacat.util import (to_bytes, to_str, epoch, chunked, limited, strided, 
-    skipped, first_not_empty, validate_metadata, insert_sql, fetch_generator
+    skipped, first_not_empty, metadata_validator, insert_sql, fetch_generator, fetch_batches, SQLParams, execute_sql
 )
 from metacat.auth import BaseDBUser, BaseDBRole as DBRole
 from metacat.common import FileMetaExpressionDNF, DatasetMetaExpressionDNF, DBObject, DBManyToMany, transactioned, insert_many
@@ -17,7 +17,7 @@ def debug(*parts):
 
 from .common import (
     AlreadyExistsError, DatasetCircularDependencyDetected, NotFoundError, MetaValidationError,
-    parse_name, alias
+    parse_name, alias, copy_out
 )
 
 class DBFileSet(DBObject):
@@ -33,13 +33,18 @@ class DBFileSet(DBObject):
             c.execute(self.SQL)
             return fetch_generator(c)
 
-    def __init__(self, db, files=None, sql=None, count=None):
+    def __init__(self, db, files=None, sql=None, count=None, itersize=None, params=None):
+        # itersize: if not None and the set is defined by SQL, the SQL will be executed using a server-side (named)
+        #           cursor, fetching itersize rows at a time, instead of loading the whole result into memory
+        # params: SQLParams with the values of the parameters bound in the SQL
         DBObject.__init__(self, db)
         assert not (files and sql), "DBFileSet can not be initialized from both files and sql"
         if not sql and not files:
             files = []          # empty file set
         self.Files = files
         self.SQL = sql
+        self.Params = params
+        self.Itersize = itersize
         if hasattr(files, "__len__"):
             count = len(files)
         self.Count = count
@@ -71,6 +76,220 @@ class DBFileSet(DBObject):
         files = sorted(self, lambda f: f.ID)
         yield from files
 
+    # files without created_timestamp are paged as if they were created at the epoch
+    PageEpoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    @staticmethod
+    def page_key(f):
+        return (f.CreatedTimestamp or DBFileSet.PageEpoch, f.FID)
+
+    def page(self, after=None, limit=None):
+        # keyset pagination in (created_timestamp, id) order, consistent with DBFileSet.sql_for_page()
+        # after: (created_timestamp, fid) as returned by DBFileSet.parse_continuation_token() or None
+        files = iter(self)
+        if after is not None:
+            after_ts, after_fid = after
+            after = (datetime.fromisoformat(after_ts), after_fid)
+            files = (f for f in files if DBFileSet.page_key(f) > after)
+        files = sorted(files, key=DBFileSet.page_key)
+        if limit is not None:
+            files = files[:limit]
+        return DBFileSet(self.DB, files)
+
+    @staticmethod
+    def sql_for_page(sql, params, after=None, limit=None):
+        # wraps the file query SQL to return one page of results in (created_timestamp, id) order,
+        # see DBFileSet.page_key(). Must match the files_created_timestamp_id index
+        t = alias("t")
+        key = f"coalesce({t}.created_timestamp, 'epoch'::timestamptz)"
+        where_clause = ""
+        if after is not None:
+            after_ts, after_fid = after
+            where_clause = f"where ({key}, {t}.id) > ({params.bind(after_ts, 'timestamptz')}, {params.bind(after_fid)})"
+        limit_clause = "" if limit is None else f"limit {params.bind(limit)}"
+        return insert_sql(f"""\
+            -- page {t}
+                select {t}.*
+                from (
+                    $sql
+                ) {t} {where_clause}
+                order by {key}, {t}.id
+                {limit_clause}
+            -- end of page {t}
+        """, sql=sql)
+
+    @staticmethod
+    def sql_as_json(sql, with_meta=False, metadata_keys=None, params=None):
+        # wraps the file query SQL to return each file as single JSON text column, in DBFile.to_jsonable() format
+        # metadata_keys: list of metadata keys to include instead of the whole metadata, requires params.
+        # Provenance is not included. It is loaded in batches with DBFileSet.load_provenance() instead
+        t = alias("t")
+        json_sql = f"""jsonb_build_object(
+                            'fid', {t}.id, 'namespace', {t}.namespace, 'name', {t}.name,
+                            'retired', {t}.retired, 'retired_by', {t}.retired_by, 'updated_by', {t}.updated_by,
+                            'retired_timestamp', extract(epoch from {t}.retired_timestamp),
+                            'updated_timestamp', extract(epoch from {t}.updated_timestamp),
+                            'created_timestamp', extract(epoch from {t}.created_timestamp)
+                        )
+                        || jsonb_strip_nulls(jsonb_build_object('checksums', {t}.checksums, 'size', {t}.size, 'creator', {t}.creator))"""
+        if metadata_keys:
+            keys = [params.bind(k) for k in metadata_keys]
+            projected = ", ".join(f"{k}, {t}.metadata -> {k}" for k in keys)
+            json_sql += f"""
+                        || jsonb_build_object('metadata', jsonb_build_object({projected}))"""
+        elif with_meta:
+            json_sql += f"""
+                        || jsonb_build_object('metadata', coalesce({t}.metadata, '{{}}'::jsonb))"""
+        return insert_sql(f"""\
+            -- as json {t}
+                select ({json_sql})::text
+                from (
+                    $sql
+                ) {t}
+            -- end of as json {t}
+        """, sql=sql)
+
+    ExportColumns = [
+        ("fid", "id"), ("namespace", "namespace"), ("name", "name"), ("size", "size"), ("creator", "creator"), 
+        ("created_timestamp", "extract(epoch from $t.created_timestamp)"), ("updated_by", "updated_by"),
+        ("updated_timestamp", "extract(epoch from $t.updated_timestamp)"), ("retired", "retired"), 
+        ("retired_by", "retired_by"), ("retired_timestamp", "extract(epoch from $t.retired_timestamp)"),
+        ("checksums", "checksums")
+    ]
+
+    @staticmethod
+    def sql_for_export(sql, params, format="csv", metadata_keys=None, with_meta=False):
+        # returns COPY ... TO STDOUT statement with the parameters bound, see copy_out()
+        # format: 
+        #   "csv"    - one column per file attribute, plus one column per metadata key or "metadata" column with whole metadata
+        #   "ndjson" - one JSON object per line in DBFile.to_jsonable() format
+        # metadata_keys: list of metadata keys to include, instead of the whole metadata
+        if format == "ndjson":
+            json_sql = DBFileSet.sql_as_json(sql, with_meta=with_meta, metadata_keys=metadata_keys, params=params)
+            # JSON text never contains unescaped control characters, so these delimiter and quote characters 
+            # make COPY output the text as is
+            return f"copy (\n{json_sql}\n) to stdout with (format csv, delimiter E'\\x1F', quote E'\\x1E')"
+        elif format == "csv":
+            t = alias("t")
+            columns = []
+            for name, column in DBFileSet.ExportColumns:
+                column = column.replace("$t", t) if "$t" in column else f"{t}.{column}"
+                columns.append(f"{column} as {name}")
+            if metadata_keys:
+                for k in metadata_keys:
+                    column_name = '"%s"' % (k.replace('"', '""'),)
+                    columns.append(f"{t}.metadata ->> {params.bind(k)} as {column_name}")
+            elif with_meta:
+                columns.append(f"{t}.metadata")
+            columns = ",\n                    ".join(columns)
+            select_sql = insert_sql(f"""\
+                -- export {t}
+                    select {columns}
+                    from (
+                        $sql
+                    ) {t}
+                -- end of export {t}
+            """, sql=sql)
+            return f"copy (\n{select_sql}\n) to stdout with (format csv, header)"
+        else:
+            raise ValueError(f"Unsupported export format: {format}")
+
+    # file attribute name -> (files table column, DBFile attribute). Other column names are metadata keys
+    ColumnAttributes = {
+        "fid":                  ("id", "FID"),
+        "namespace":            ("namespace", "Namespace"),
+        "name":                 ("name", "Name"),
+        "size":                 ("size", "Size"),
+        "creator":              ("creator", "Creator"),
+        "created_timestamp":    ("created_timestamp", "CreatedTimestamp"),
+        "updated_by":           ("updated_by", "UpdatedBy"),
+        "updated_timestamp":    ("updated_timestamp", "UpdatedTimestamp"),
+        "retired":              ("retired", "Retired"),
+        "retired_by":           ("retired_by", "RetiredBy"),
+        "retired_timestamp":    ("retired_timestamp", "RetiredTimestamp"),
+        "checksums":            ("checksums", "Checksums")
+    }
+
+    @staticmethod
+    def sql_for_columns(sql, columns, params):
+        # wraps the file query SQL to return only the listed file attributes and metadata values
+        t = alias("t")
+        select = []
+        for c in columns:
+            if c in DBFileSet.ColumnAttributes:
+                select.append(f"{t}.{DBFileSet.ColumnAttributes[c][0]}")
+            else:
+                select.append(f"{t}.metadata -> {params.bind(c)}")
+        select = ", ".join(select)
+        return insert_sql(f"""\
+            -- columns {t}
+                select {select}
+                from (
+                    $sql
+                ) {t}
+            -- end of columns {t}
+        """, sql=sql)
+
+    def row_batches(self, batch_size=10000):
+        # for the sets defined by SQL built with sql_for_columns(): yields lists of row tuples
+        if self.Itersize:
+            tuples = self.stream_tuples(self.Itersize)
+        else:
+            c = self.DB.cursor()
+            execute_sql(c, self.SQL, self.Params)
+            tuples = fetch_generator(c)
+        return chunked(tuples, batch_size)
+
+    def column_batches(self, columns, batch_size=10000):
+        # same as row_batches(), but for the sets of DBFile objects
+        getters = []
+        for c in columns:
+            if c in DBFileSet.ColumnAttributes:
+                attr = DBFileSet.ColumnAttributes[c][1]
+                getters.append(lambda f, attr=attr: getattr(f, attr))
+            else:
+                getters.append(lambda f, key=c: (f.Metadata or {}).get(key))
+        rows = (tuple(g(f) for g in getters) for f in self)
+        return chunked(rows, batch_size)
+
+    @staticmethod
+    def export(db, copy_sql, params=None):
+        # yields the output of the COPY statement built by sql_for_export() in chunks
+        # COPY does not accept parameters, so they are bound on the client side
+        if params:
+            copy_sql = to_str(db.cursor().mogrify(copy_sql, params))
+        return copy_out(db, copy_sql)
+
+    def json_rows(self):
+        # for the sets defined by SQL built with sql_as_json(): yields JSON text for each file
+        if self.Itersize:
+            tuples = self.stream_tuples(self.Itersize)
+        else:
+            c = self.DB.cursor()
+            execute_sql(c, self.SQL, self.Params)
+            tuples = fetch_generator(c)
+        return (text for (text,) in tuples)
+
+    @staticmethod
+    def continuation_token(f):
+        # opaque token pointing to the position right after the file f in (created_timestamp, id) order
+        created_timestamp, fid = DBFileSet.page_key(f)
+        data = json.dumps([created_timestamp.isoformat(), fid]).encode("utf-8")
+        return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def parse_continuation_token(token):
+        # returns (created_timestamp as ISO string, fid)
+        try:
+            token = to_bytes(token)
+            data = base64.urlsafe_b64decode(token + b"=" * (-len(token) % 4))
+            ts, fid = json.loads(data)
+            ts = datetime.fromisoformat(ts).isoformat()        # validate
+            assert isinstance(fid, str)
+        except Exception:
+            raise ValueError("Invalid continuation token")
+        return ts, fid
+
     @staticmethod
     def from_tuples(db, g, count=None):
         # must be in sync with DBFile.all_columns()
@@ -126,12 +345,29 @@ class DBFileSet(DBObject):
     def __iter__(self):
         if self.Files is not None:
             return (f for f in self.Files)
+        elif self.Itersize:
+            return (f for f in DBFileSet.from_tuples(self.DB, self.stream_tuples(self.Itersize)))
         else:
             c = self.DB.cursor()
-            c.execute(self.SQL)
+            execute_sql(c, self.SQL, self.Params)
             debug("DBFileSet.from_sql: return from execute()")
             return (f for f in DBFileSet.from_tuples(self.DB, fetch_generator(c), count=c.rowcount))
 
+    def stream_tuples(self, itersize=10000):
+        # execute self.SQL with a server-side cursor so that only itersize rows are held in memory at a time
+        # named cursors live inside the current transaction, so the connection must not be committed
+        # or rolled back until the generator is exhausted
+        c = self.DB.cursor(name=alias("fileset_cursor"))
+        c.itersize = itersize
+        try:
+            # DECLARE accepts only a SELECT or VALUES statement, not EXECUTE of a prepared statement, so streamed
+            # queries are planned each time and the parameters are bound by psycopg2
+            c.execute(self.SQL, self.Params or None)
+            debug("DBFileSet.stream_tuples: return from execute()")
+            yield from fetch_batches(c, itersize)
+        finally:
+            c.close()
+
     def as_list(self):
         # list(DBFileSet) should work too
         return list(self.Files)
@@ -142,29 +378,50 @@ class DBFileSet(DBObject):
     def children(self, with_metadata = False, with_provenance = False):
         return self._relationship("children", with_metadata, with_provenance)
             
-    def _relationship(self, rel, with_metadata, with_provenance):
-        table = "files" if not with_provenance else "files_with_provenance"
+    def ancestors(self, depth=None, with_metadata = False, with_provenance = False):
+        return self._relationship("ancestors", with_metadata, with_provenance, depth)
+            
+    def descendants(self, depth=None, with_metadata = False, with_provenance = False):
+        return self._relationship("descendants", with_metadata, with_provenance, depth)
+            
+    def _relationship(self, rel, with_metadata, with_provenance, depth=None):
+        table = "files"
         f = alias("f")
         pc = alias("pc")
         attrs = DBFile.attr_columns(f)
+        depth_condition = f"and {pc}.depth <= %s" if depth is not None else ""
         if rel == "children":
-            join = f"{f}.id = {pc}.child_id and {pc}.parent_id = any (%s)"
+            related = f"select {pc}.child_id from parent_child {pc} where {pc}.parent_id = any (%s)"
+        elif rel == "parents":
+            related = f"select {pc}.parent_id from parent_child {pc} where {pc}.child_id = any (%s)"
+        elif rel == "descendants":
+            related = f"select {pc}.descendant_id from file_lineage {pc} where {pc}.ancestor_id = any (%s) {depth_condition}"
         else:
-            join = f"{f}.id = {pc}.parent_id and {pc}.child_id = any (%s)"
+            related = f"select {pc}.ancestor_id from file_lineage {pc} where {pc}.descendant_id = any (%s) {depth_condition}"
             
         meta = "null as metadata" if not with_metadata else f"{f}.metadata"
-        provenance = "null as parents, null as children" if not with_provenance else \
-            f"{f}.parents, {f}.children"
+        provenance = "null as parents, null as children"
             
         c = self.DB.cursor()
         file_ids = list(f.FID for f in self.Files)
 
-        sql = f"""select distinct {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, {provenance}
-                    from {table} {f}, parent_child {pc}
-                    where {join}
+        sql = f"""select {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, {provenance}
+                    from {table} {f}
+                    where {f}.id in ({related})
                     """
-        c.execute(sql, (file_ids,))
-        return DBFileSet.from_tuples(self.DB, fetch_generator(c), count=c.rowcount)
+        c.execute(sql, (file_ids,) if depth is None else (file_ids, int(depth)))
+        out = DBFileSet.from_tuples(self.DB, fetch_generator(c), count=c.rowcount)
+        if with_provenance:
+            out = out.load_provenance()
+        return out
+
+    def load_provenance(self, chunk_size=10000):
+        # returns new DBFileSet with the files' parents and children loaded in one pass per chunk of chunk_size files,
+        # instead of 2 queries per file
+        def loaded(files):
+            for chunk in chunked(files, chunk_size):
+                yield from DBFile.load_provenance_bulk(self.DB, chunk)
+        return DBFileSet(self.DB, loaded(self), count=self.Count)
 
     @staticmethod
     def join(db, file_sets):
@@ -236,27 +493,29 @@ class DBFileSet(DBObject):
             )
         
     @staticmethod
-    def sql_for_basic_query(db, basic_file_query, include_retired=False):
+    def sql_for_basic_query(db, basic_file_query, params, include_retired=False):
+        # params: SQLParams to bind the query literals to
         debug("sql_for_basic_query: bfq:", basic_file_query, " with provenance:", basic_file_query.WithProvenance)
 
         f = alias("f")
 
         limit = basic_file_query.Limit
-        limit = "" if limit is None else f"limit {limit}"
-        offset = "" if not basic_file_query.Skip else f"offset {basic_file_query.Skip}"
+        limit = "" if limit is None else f"limit {params.bind(limit)}"
+        offset = "" if not basic_file_query.Skip else f"offset {params.bind(basic_file_query.Skip)}"
         #order = f"order by {f}.created_timestamp,{f}.id" if basic_file_query.Skip or basic_file_query.Limit or basic_file_query.Ordered else ""
         order = f"order by {f}.created_timestamp,{f}.id" if basic_file_query.Ordered else ""
         
         debug("sql_for_basic_query: offset:", offset)
 
         meta = f"{f}.metadata" if basic_file_query.WithMeta else "null as metadata"
-        parents = f"{f}.parents" if basic_file_query.WithProvenance else "null as parents"
-        children = f"{f}.children" if basic_file_query.WithProvenance else "null as children"
-        table = "files_with_provenance" if basic_file_query.WithProvenance else "files"
+        # provenance is not selected here. It is loaded in batches for the final results, see DBFileSet.load_provenance()
+        parents = "null as parents"
+        children = "null as children"
+        table = "files"
 
         debug("sql_for_basic_query: table:", table)
 
-        file_meta_exp = FileMetaExpressionDNF(basic_file_query.Wheres).sql(f) or "true"
+        file_meta_exp = FileMetaExpressionDNF(basic_file_query.Wheres).sql(f, params=params) or "true"
         retired_condition = "true" if include_retired else f"not {f}.retired"
 
         attrs = DBFile.attr_columns(f)
@@ -275,23 +534,26 @@ class DBFileSet(DBObject):
                 -- end of sql_for_basic_query {f}
             """, file_meta_exp = file_meta_exp)
         else:
-            datasets_sql = DBDataset.sql_for_bdqs(basic_file_query.DatasetSelectors, names_only=True)
+            datasets_sql = DBDataset.sql_for_bdqs(basic_file_query.DatasetSelectors, params, names_only=True)
             #datasets_sql = DBDataset.sql_for_selector(dataset_selector)
             
+            # dataset membership is tested with a semi-join so that files found in several selected datasets
+            # are deduplicated by id instead of sorting the whole rows including metadata with "select distinct"
             fd = alias("fd")
             ds = alias("ds")
-            distinct = "" if basic_file_query.single_dataset() else "distinct"
             sql = insert_sql(f"""\
                 -- sql_for_basic_query {f}
-                    select {distinct} {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, {parents}, {children}
-                        from {table} {f},
-                            files_datasets {fd},
-                            (
-                                $datasets_sql
-                            ) as {ds}(namespace, name)
-                        where {fd}.file_id = {f}.id
-                            and {ds}.namespace = {fd}.dataset_namespace
-                            and {ds}.name = {fd}.dataset_name
+                    select {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, {parents}, {children}
+                        from {table} {f}
+                        where exists (
+                                select 1 from files_datasets {fd},
+                                    (
+                                        $datasets_sql
+                                    ) as {ds}(namespace, name)
+                                    where {fd}.file_id = {f}.id
+                                        and {fd}.dataset_namespace = {ds}.namespace
+                                        and {fd}.dataset_name = {ds}.name
+                            )
                             and {retired_condition}   -- include retired ? 
                             and (  -- metadata
                                 $file_meta_exp
@@ -303,7 +565,7 @@ class DBFileSet(DBObject):
         return sql
         
     @staticmethod
-    def sql_for_file_list(spec_type, spec_list, with_meta, with_provenance, limit, skip):
+    def sql_for_file_list(spec_type, spec_list, with_meta, with_provenance, limit, skip, params):
         
         f = alias("f")
         meta = f"{f}.metadata" if with_meta else "null as metadata"
@@ -312,38 +574,69 @@ class DBFileSet(DBObject):
         
         attrs = DBFile.attr_columns(f)
 
-        if with_provenance:
-            table = "files_with_provenance"
-            prov_columns = f"{f}.parents, {f}.children"
-        else:
-            table = "files"
-            prov_columns = f"null as parents, null as children"
+        # provenance is loaded in batches for the final results, see DBFileSet.load_provenance()
+        table = "files"
+        prov_columns = f"null as parents, null as children"
 
         sql = dedent(f"""\
                 select {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, {prov_columns} from {table} {f}
         """)
 
         if spec_type == "fid":
-            id_list = ",".join(["'%s'" % (i,) for i in spec_list])
-            sql += f" where id in ({id_list}) "
+            sql += f" where id = any({params.bind(list(spec_list), 'text[]')}) "
         else:
-            namespace_names = []
+            namespaces = []
+            names = []
             for spec in spec_list:
                 if not spec.get("namespace"):
                     raise ValueError("No namespace is given for " + spec.get("name"))
-                namespace_names.append("('%(namespace)s', '%(name)s')" % spec)
-            namespace_names = ','.join(namespace_names)
-            sql += f" where (namespace, name) in ({namespace_names}) """
+                namespaces.append(spec["namespace"])
+                names.append(spec["name"])
+            namespaces = params.bind(namespaces, "text[]")
+            names = params.bind(names, "text[]")
+            sql += f" where (namespace, name) in (select * from unnest({namespaces}, {names})) """
 
         sql += f" order by {f}.id "
 
         if limit is not None:
-            sql += f" limit {limit}"
+            sql += f" limit {params.bind(limit)}"
         if skip > 0:
-            sql += f" offset {skip}"
+            sql += f" offset {params.bind(skip)}"
 
         return sql
 
+    @staticmethod
+    def sql_for_temp_table(db, files, table, with_meta=False, chunk_size=10000):
+        # copies ids of the files into a session temp table and returns the SQL selecting the files from it,
+        # so that the files produced in Python can be used as input for SQL queries.
+        # If with_meta, the metadata is copied too, because filters may modify it
+        c = db.cursor()
+        c.execute(f"""create temp table if not exists {table} (id text, metadata jsonb);
+            truncate table {table};
+        """)
+        seen = set()
+        for chunk in chunked(files, chunk_size):
+            lines = []
+            for f in chunk:
+                if f.FID not in seen:
+                    seen.add(f.FID)
+                    meta = json.dumps(f.Metadata).replace("\\", "\\\\") if with_meta and f.Metadata is not None else r"\N"
+                    lines.append(f"{f.FID}\t{meta}\n")
+            c.copy_from(io.StringIO("".join(lines)), table, columns=["id", "metadata"])
+        c.execute(f"analyze {table}")
+
+        f = alias("f")
+        t = alias("t")
+        meta = f"{t}.metadata" if with_meta else "null as metadata"
+        attrs = DBFile.attr_columns(f)
+        return dedent(f"""\
+            -- temp table {table}
+                select {f}.id, {f}.namespace, {f}.name, {meta}, {attrs}, null as parents, null as children
+                from files {f}
+                    inner join {table} {t} on {t}.id = {f}.id
+            -- end of temp table {table}
+        """)
+
     def counts(self):
         total_size = n = 0
         if self.SQL:
@@ -356,7 +649,7 @@ class DBFileSet(DBObject):
                 -- end of summary:count
             """, fileset_sql=self.SQL)
             c = self.DB.cursor()
-            c.execute(sql)
+            execute_sql(c, sql, self.Params)
             n, total_size = c.fetchone()
         else:
             for f in self:
@@ -376,7 +669,7 @@ class DBFileSet(DBObject):
                 -- end of summary:keys
             """, fileset_sql=self.SQL)
             c = self.DB.cursor()
-            c.execute(sql)
+            execute_sql(c, sql, self.Params)
             for tup in fetch_generator(c):
                 yield tup[0]
         else:
@@ -399,7 +692,7 @@ class DBFileSet(DBObject):
                 -- end of summary:key/values
             """, fileset_sql=self.SQL)
             c = self.DB.cursor()
-            c.execute(sql)
+            execute_sql(c, sql, self.Params)
             yield from fetch_generator(c)
         else:
             seen = {}
@@ -492,12 +785,15 @@ class DBFile(DBObject):
     @transactioned
     def delete(self, transaction=None):
         # delete the file from the DB
+        DBFile.lock_lineage(transaction, [self.FID])
+        transaction.execute("""
+                select parent_id, child_id from parent_child where parent_id = %s or child_id = %s
+            """, (self.FID, self.FID))
+        DBFile.remove_edges(transaction, transaction.fetchall())
         transaction.execute("""
-                delete from parent_child where parent_id = %s;
-                delete from parent_child where child_id = %s;
                 delete from files_datasets where file_id = %s;
                 delete from files where id = %s;
-            """, (self.FID, self.FID, self.FID, self.FID))
+            """, (self.FID, self.FID))
 
     @transactioned
     def create(self, creator=None, transaction=None):
@@ -513,12 +809,7 @@ class DBFile(DBObject):
                 datetime.fromtimestamp(f.CreatedTimestamp).isoformat() if self.CreatedTimestamp else datetime.now()))
         self.CreatedTimestamp = c.fetchone()[0]
         if self.Parents:
-            insert_many(self.DB,
-                "parent_child", 
-                ((p.FID if isinstance(p, DBFile) else p, self.FID) for p in self.Parents),
-                column_names=["parent_id", "child_id"], 
-                transaction=transaction
-            )
+            DBFile.add_edges(transaction, [(p.FID if isinstance(p, DBFile) else p, self.FID) for p in self.Parents])
         return self
 
     def did(self):
@@ -530,8 +821,23 @@ class DBFile(DBObject):
         if isinstance(creator, DBUser):
             creator = DBUser.Username
         files = list(files)
+        files_data = DBFile.copy_rows(db, files, creator)
+        edges = []
+        for f in files:
+            if f.Parents:
+                edges += [(p.FID if isinstance(p, DBFile) else p, f.FID) for p in f.Parents]
+        #open("/tmp/files.csv", "w").write(files_data)
+        transaction.copy_from(io.StringIO(files_data), "files", columns = DBFile.CopyColumns)
+        DBFile.add_edges(transaction, edges)
+            
+        return DBFileSet(db, files)
+
+    CopyColumns = ["id", "namespace", "name", "metadata", "size", "checksums","creator", "created_timestamp"]
+
+    @staticmethod
+    def copy_rows(db, files, creator):
+        # COPY text format rows for CopyColumns. Assigns file ids and creator
         files_csv = []
-        parents_csv = []
         null = r"\N"
         for f in files:
             f.FID = f.FID or DBFile.generate_id()
@@ -546,18 +852,102 @@ class DBFile(DBObject):
                 datetime.fromtimestamp(f.CreatedTimestamp).isoformat() if f.CreatedTimestamp else datetime.now(),
             ))
             f.Creator = f.Creator or creator
-            if f.Parents:
-                parents_csv += ["%s\t%s" % (f.FID, p.FID if isinstance(p, DBFile) else p) for p in f.Parents]
             f.DB = db
-        
-        files_data = "\n".join(files_csv)
-        #open("/tmp/files.csv", "w").write(files_data)
-        transaction.copy_from(io.StringIO(files_data), "files", 
-                columns = ["id", "namespace", "name", "metadata", "size", "checksums","creator", "created_timestamp"])
-        transaction.copy_from(io.StringIO("\n".join(parents_csv)), "parent_child", 
-                columns=["child_id", "parent_id"])
-            
-        return DBFileSet(db, files)
+        return "\n".join(files_csv)
+
+    @staticmethod
+    @transactioned
+    def declare_staged(db, files, creator, dataset=None, transaction=None):
+        #
+        # Declares a chunk of files through staging tables: COPY the chunk into the staging tables, detect duplicates
+        # and resolve parents with set-based queries, then insert the files, their parent/child edges and
+        # dataset memberships.
+        #
+        # files: list of DBFile objects. Parents can be file ids, DBFile objects or (namespace, name) tuples. A parent
+        #   can be declared earlier in the same transaction or in the same chunk.
+        # Returns list of errors as tuples (fid, message). If there are errors, nothing is inserted
+        #
+        if isinstance(creator, DBUser):
+            creator = creator.Username
+        files = list(files)
+        if not files:
+            return []
+        transaction.execute("""
+            create temp table if not exists file_staging (
+                id text, namespace text, name text, metadata jsonb, size bigint, checksums jsonb,
+                creator text, created_timestamp timestamp with time zone
+            ) on commit drop;
+            create temp table if not exists file_staging_parents (
+                child_id text, parent_id text, parent_namespace text, parent_name text
+            ) on commit drop;
+            truncate file_staging, file_staging_parents
+        """)
+        transaction.copy_from(io.StringIO(DBFile.copy_rows(db, files, creator)), "file_staging", columns = DBFile.CopyColumns)
+
+        null = r"\N"
+        parents_csv = []
+        for f in files:
+            for p in f.Parents or []:
+                if isinstance(p, tuple):
+                    parents_csv.append("%s\t%s\t%s\t%s" % (f.FID, null, p[0], p[1]))
+                else:
+                    parents_csv.append("%s\t%s\t%s\t%s" % (f.FID, p.FID if isinstance(p, DBFile) else p, null, null))
+        if parents_csv:
+            transaction.copy_from(io.StringIO("\n".join(parents_csv)), "file_staging_parents",
+                columns = ["child_id", "parent_id", "parent_namespace", "parent_name"])
+
+        transaction.execute("""
+            select s.id, 'File ' || s.namespace || ':' || s.name || ' already exists'
+                from file_staging s
+                where exists (select 1 from files f where f.namespace = s.namespace and f.name = s.name)
+            union
+            select s.id, 'File with id ' || s.id || ' already exists'
+                from file_staging s
+                where exists (select 1 from files f where f.id = s.id)
+            union
+            select d.id, 'Duplicate file ' || d.namespace || ':' || d.name || ' or id ' || d.id
+                from (
+                    select id, namespace, name,
+                            count(*) over (partition by namespace, name) as n_names,
+                            count(*) over (partition by id) as n_ids
+                        from file_staging
+                ) d
+                where d.n_names > 1 or d.n_ids > 1
+        """)
+        errors = transaction.fetchall()
+        if errors:
+            return errors
+
+        if parents_csv:
+            transaction.execute("""
+                update file_staging_parents p
+                    set parent_id = coalesce(
+                        (select f.id from files f where f.namespace = p.parent_namespace and f.name = p.parent_name),
+                        (select s.id from file_staging s where s.namespace = p.parent_namespace and s.name = p.parent_name)
+                    )
+                    where p.parent_id is null;
+                select p.child_id, 'Parent not found: ' || coalesce(p.parent_id, p.parent_namespace || ':' || p.parent_name)
+                    from file_staging_parents p
+                    where p.parent_id is null
+                        or not exists (select 1 from files f where f.id = p.parent_id)
+                            and not exists (select 1 from file_staging s where s.id = p.parent_id)
+            """)
+            errors = transaction.fetchall()
+            if errors:
+                return errors
+
+        columns = ",".join(DBFile.CopyColumns)
+        transaction.execute(f"insert into files({columns}) select {columns} from file_staging")
+        if parents_csv:
+            transaction.execute("select distinct parent_id, child_id from file_staging_parents")
+            DBFile.add_edges(transaction, transaction.fetchall())
+        if dataset is not None:
+            transaction.execute("""
+                insert into files_datasets(file_id, dataset_namespace, dataset_name)
+                    select id, %s, %s from file_staging
+                    on conflict do nothing
+            """, (dataset.Namespace, dataset.Name))
+        return []
 
         
     @transactioned
@@ -846,6 +1236,32 @@ class DBFile(DBObject):
     def to_json(self, with_metadata = False, with_datasets = False, with_provenance=False):
         return json.dumps(self.to_jsonable(with_metadata=with_metadata, with_provenance=with_provenance, with_datasets=with_datasets))
         
+    @staticmethod
+    def load_provenance_bulk(db, files):
+        # files: list of DBFile objects
+        # loads parents and children lists for all the files using one query per relationship
+        files = list(files)
+        fids = list(set(f.FID for f in files))
+        if not fids:
+            return files
+        c = db.cursor()
+        c.execute("""
+            select child_id, array_agg(parent_id) from parent_child 
+                where child_id = any(%s)
+                group by child_id
+        """, (fids,))
+        parents = dict(fetch_generator(c))
+        c.execute("""
+            select parent_id, array_agg(child_id) from parent_child 
+                where parent_id = any(%s)
+                group by parent_id
+        """, (fids,))
+        children = dict(fetch_generator(c))
+        for f in files:
+            f.Parents = parents.get(f.FID, [])
+            f.Children = children.get(f.FID, [])
+        return files
+
     @transactioned
     def parents(self, as_files=False, with_metadata=False, transaction=None):
         if self.Parents is None:
@@ -870,65 +1286,197 @@ class DBFile(DBObject):
         else:
             return self.Children
 
+    #
+    # file_lineage is the closure of parent_child. It has a row for each ancestor/descendant pair and each distance
+    # (depth) between them, with the number of distinct paths of that length. It is updated together with parent_child
+    # so that ancestors() and descendants() of any depth are a single indexed join.
+    #
+    # A set of edges is added or removed in one statement. A path going through some of the edges is a chain of them
+    # connected by paths already in file_lineage:
+    #   ancestor ... e1.parent -> e1.child ... e2.parent -> e2.child ... descendant
+    # LineageChainsSQL counts the chains of the edges in the "edges" CTE using file_lineage as it was before the statement.
+    # When the edges are added, each new path is counted once, as the chain of all the new edges on it.
+    # When the edges are removed, file_lineage still has the paths going through them, so a path with k of the edges
+    # is a part of chains of 1...k edges. Counting them with alternating signs gives 1 for each such path.
+    #
+
+    LineageChainsSQL = """
+            chains(ancestor_id, node_id, depth, paths, edges) as (
+                select a.ancestor_id, e.child_id, a.depth + 1, a.paths, 1
+                    from edges e,
+                        lateral (
+                            select e.parent_id as ancestor_id, 0 as depth, 1::bigint as paths
+                            union all
+                            select l.ancestor_id, l.depth, l.paths from file_lineage l where l.descendant_id = e.parent_id
+                        ) a
+                union all
+                select c.ancestor_id, e.child_id, c.depth + m.depth + 1, %(sign)s * c.paths * m.paths, c.edges + 1
+                    from chains c, edges e,
+                        lateral (
+                            select 0 as depth, 1::bigint as paths where e.parent_id = c.node_id
+                            union all
+                            select l.depth, l.paths from file_lineage l where l.ancestor_id = c.node_id and l.descendant_id = e.parent_id
+                        ) m
+                    where c.edges < (select count(*) from edges)          -- stops at circular connections
+            ),
+            counts as (
+                select c.ancestor_id, d.descendant_id, c.depth + d.depth as depth, sum(c.paths * d.paths) as paths
+                    from chains c,
+                        lateral (
+                            select c.node_id as descendant_id, 0 as depth, 1::bigint as paths
+                            union all
+                            select l.descendant_id, l.depth, l.paths from file_lineage l where l.ancestor_id = c.node_id
+                        ) d
+                    where c.ancestor_id != d.descendant_id
+                    group by c.ancestor_id, d.descendant_id, c.depth + d.depth
+                    having sum(c.paths * d.paths) != 0
+            )
+    """
+
+    AddEdgesSQL = f"""
+        with recursive edges as (
+                insert into parent_child(parent_id, child_id)
+                    select parent_id, child_id from unnest(%(parents)s::text[], %(children)s::text[]) as e(parent_id, child_id)
+                    on conflict(parent_id, child_id) do nothing
+                    returning parent_id, child_id
+            ), 
+            {LineageChainsSQL % dict(sign=1)}
+        insert into file_lineage(ancestor_id, descendant_id, depth, paths)
+            select ancestor_id, descendant_id, depth, paths from counts
+            on conflict(ancestor_id, descendant_id, depth) do update
+                set paths = file_lineage.paths + excluded.paths
+    """
+
+    RemoveEdgesSQL = f"""
+        with recursive edges as (
+                delete from parent_child pc
+                    using unnest(%(parents)s::text[], %(children)s::text[]) as e(parent_id, child_id)
+                    where pc.parent_id = e.parent_id and pc.child_id = e.child_id
+                    returning pc.parent_id, pc.child_id
+            ), 
+            {LineageChainsSQL % dict(sign=-1)},
+            removed as (
+                delete from file_lineage l using counts c
+                    where l.ancestor_id = c.ancestor_id and l.descendant_id = c.descendant_id and l.depth = c.depth
+                        and l.paths <= c.paths
+            )
+        update file_lineage l set paths = l.paths - c.paths
+            from counts c
+            where l.ancestor_id = c.ancestor_id and l.descendant_id = c.descendant_id and l.depth = c.depth
+                and l.paths > c.paths
+    """
+
+    LineageLockStripes = 64
+
+    LineageStripesSQL = """
+        select distinct abs(hashtext(f.id) %% %(stripes)s)
+            from (
+                select unnest(%(fids)s::text[]) as id
+                union
+                select l.ancestor_id from file_lineage l where l.descendant_id = any(%(fids)s::text[])
+                union
+                select l.descendant_id from file_lineage l where l.ancestor_id = any(%(fids)s::text[])
+            ) f
+    """
+
+    @staticmethod
+    def lock_lineage(transaction, fids=None):
+        # file_lineage path counts are computed from the closure rows the transaction can see, so the transactions
+        # modifying connected parts of the lineage must not run concurrently. The files, their ancestors and
+        # descendants are hashed into LineageLockStripes advisory locks, held until the end of the transaction.
+        # The lineage may grow while the transaction waits for the locks, so the stripes are looked up again
+        # until all of them are locked.
+        # fids=None: lock the whole lineage
+        lock_sql = """
+            select pg_advisory_xact_lock(hashtext('file_lineage'), s) from unnest(%s::int[]) s order by s
+        """
+        if fids is None:
+            transaction.execute(lock_sql, (list(range(DBFile.LineageLockStripes)),))
+            return
+        fids = list(fids)
+        locked = set()
+        while True:
+            transaction.execute(DBFile.LineageStripesSQL, dict(fids=fids, stripes=DBFile.LineageLockStripes))
+            stripes = sorted(set(s for (s,) in transaction.fetchall()) - locked)
+            if not stripes:
+                break
+            transaction.execute(lock_sql, (stripes,))
+            locked.update(stripes)
+
+    @staticmethod
+    def edges_params(edges):
+        return dict(parents=[p for p, c in edges], children=[c for p, c in edges])
+
+    @staticmethod
+    def add_edges(transaction, edges):
+        # edges: list of (parent_id, child_id). Existing edges are ignored
+        edges = list(edges)
+        if edges:
+            DBFile.lock_lineage(transaction, set(fid for edge in edges for fid in edge))
+            transaction.execute(DBFile.AddEdgesSQL, DBFile.edges_params(edges))
+
+    @staticmethod
+    def remove_edges(transaction, edges):
+        # edges: list of (parent_id, child_id). Missing edges are ignored
+        edges = list(edges)
+        if edges:
+            DBFile.lock_lineage(transaction, set(fid for edge in edges for fid in edge))
+            transaction.execute(DBFile.RemoveEdgesSQL, DBFile.edges_params(edges))
+
+    @staticmethod
+    @transactioned
+    def rebuild_lineage(db, transaction=None):
+        # rebuilds file_lineage from parent_child, e.g. after parent_child was modified bypassing add_edges()/remove_edges()
+        DBFile.lock_lineage(transaction)
+        transaction.execute("""
+            truncate file_lineage;
+            insert into file_lineage(ancestor_id, descendant_id, depth, paths)
+                with recursive paths(ancestor_id, descendant_id, depth) as (
+                        select parent_id, child_id, 1 from parent_child
+                        union all
+                        select p.ancestor_id, pc.child_id, p.depth + 1
+                            from paths p, parent_child pc
+                            where pc.parent_id = p.descendant_id
+                    )
+                select ancestor_id, descendant_id, depth, count(*) from paths
+                    group by ancestor_id, descendant_id, depth
+        """)
+
     @transactioned
     def add_child(self, child, transaction=None):
         child_fid = child if isinstance(child, str) else child.FID
-        transaction.execute("""
-            insert into parent_child(parent_id, child_id)
-                values(%s, %s)        
-                on conflict(parent_id, child_id) do nothing;
-            """, (self.FID, child_fid)
-        )
+        DBFile.add_edges(transaction, [(self.FID, child_fid)])
         
     @transactioned
     def add_parents(self, parents, transaction=None):
-        parent_fids = [(p if isinstance(p, str) else p.FID,) for p in parents]
-        transaction.executemany(f"""
-            insert into parent_child(parent_id, child_id)
-                values(%s, %s)        
-                on conflict(parent_id, child_id) do nothing;
-            """, [(fid, self.FID) for fid in parent_fids]
-        )
+        parent_fids = [p if isinstance(p, str) else p.FID for p in parents]
+        DBFile.add_edges(transaction, [(fid, self.FID) for fid in parent_fids])
         
     @transactioned
     def set_parents(self, fids_or_files, transaction=None):
-        parent_fids = [(p if isinstance(p, str) else p.FID,) for p in fids_or_files]
-        transaction.execute(f"delete from parent_child where child_id=%s", (self.FID,))
-        transaction.executemany(f"""
-            insert into parent_child(parent_id, child_id)
-                values(%s, %s)        
-            """, [(fid, self.FID) for fid in parent_fids]
-        )
+        parent_fids = [p if isinstance(p, str) else p.FID for p in fids_or_files]
+        transaction.execute("select parent_id from parent_child where child_id=%s", (self.FID,))
+        old_fids = set(fid for (fid,) in transaction.fetchall())
+        DBFile.remove_edges(transaction, [(fid, self.FID) for fid in old_fids if fid not in parent_fids])
+        DBFile.add_edges(transaction, [(fid, self.FID) for fid in parent_fids if fid not in old_fids])
         
     @transactioned
     def add_children(self, children, transaction=None):
-        child_fids = [(p if isinstance(p, str) else p.FID,) for p in children]
-        transaction.executemany(f"""
-            insert into parent_child(parent_id, child_id)
-                values(%s, %s)
-                on conflict(parent_id, child_id) do nothing;
-            """, [(self.FID, fid) for fid in child_fids]
-        )
+        child_fids = [p if isinstance(p, str) else p.FID for p in children]
+        DBFile.add_edges(transaction, [(self.FID, fid) for fid in child_fids])
         
     @transactioned
     def set_children(self, fids_or_files, transaction=None):
-        child_fids = [(p if isinstance(p, str) else p.FID,) for p in fids_or_files]
-        #print("set_parents: fids:", parent_fids)
-        transaction.execute("delete from parent_child where parent_id=%s", (self.FID,))
-        transaction.executemany(f"""
-            insert into parent_child(parent_id, child_id)
-                values(%s, %s)        
-            """, [(self.FID, fid) for fid in child_fids]
-        )
+        child_fids = [p if isinstance(p, str) else p.FID for p in fids_or_files]
+        transaction.execute("select child_id from parent_child where parent_id=%s", (self.FID,))
+        old_fids = set(fid for (fid,) in transaction.fetchall())
+        DBFile.remove_edges(transaction, [(self.FID, fid) for fid in old_fids if fid not in child_fids])
+        DBFile.add_edges(transaction, [(self.FID, fid) for fid in child_fids if fid not in old_fids])
         
     @transactioned
     def remove_child(self, child, transaction=None):
         child_fid = child if isinstance(child, str) else child.FID
-        transaction.execute("""
-            delete from parent_child where
-                parent_id = %s and child_id = %s;
-            """, (self.FID, child_fid)
-        )
+        DBFile.remove_edges(transaction, [(self.FID, child_fid)])
 
     @transactioned
     def add_parent(self, parent, transaction=None):
@@ -998,25 +1546,19 @@ class DBFile(DBObject):
                                order by dval; """)
         return [x[0] for x in fetch_generator(c) if x[0]]
 
-class _DatasetParentToChild(DBManyToMany):
-    
-    def __init__(self, db, parent):
-        DBManyToMany.__init__(self, db, "datasets_parent_child", "child_namespace", "child_name", 
-                    parent_namespace = parent.Namespace, parent_name = parent.Name)
-                    
 class DBDataset(DBObject):
     
     ColumnsText = "namespace,name,frozen,monotonic,metadata,creator,created_timestamp,description,file_metadata_requirements,file_count"
     Columns = ['namespace', 'name', 'frozen', 'monotonic', 
             'metadata', 'creator', 'created_timestamp', 'description', 
             'file_metadata_requirements', 'file_count',
-            'updated_timestamp', 'updated_by'
+            'updated_timestamp', 'updated_by', 'total_size'
     ]
     Table = "datasets"
     
 
     def __init__(self, db, namespace, name, frozen=False, monotonic=False, metadata={}, file_meta_requirements=None, creator=None,
-            description = None, file_count = 0, updated_timestamp=None, updated_by=None):
+            description = None, file_count = 0, updated_timestamp=None, updated_by=None, total_size=0):
         DBObject.__init__(self, db)
         assert namespace is not None and name is not None
         self.Namespace = namespace
@@ -1029,7 +1571,9 @@ class DBDataset(DBObject):
         self.Metadata = metadata
         self.Description = description
         self.FileMetaRequirements = file_meta_requirements
+        self.FileMetaValidator = None           # compiled from FileMetaRequirements when needed
         self.FileCount = file_count
+        self.TotalSize = total_size
         self.UpdatedTimestamp = updated_timestamp
         self.UpdatedBy = updated_by
     
@@ -1042,10 +1586,10 @@ class DBDataset(DBObject):
     @staticmethod
     def from_tuple(db, tup):
         (namespace, name, frozen, monotonic, metadata, creator, created_timestamp, description,
-            file_metadata_requirements, file_count, updated_timestamp, updated_by) = tup
+            file_metadata_requirements, file_count, updated_timestamp, updated_by, total_size) = tup
         dataset = DBDataset(db, namespace, name, 
             frozen=frozen, monotonic=monotonic, metadata=metadata, file_meta_requirements=file_metadata_requirements,
-            file_count = file_count, updated_timestamp=updated_timestamp, updated_by=updated_by)
+            file_count = file_count, updated_timestamp=updated_timestamp, updated_by=updated_by, total_size=total_size)
         dataset.Creator = creator
         dataset.CreatedTimestamp = created_timestamp
         dataset.Description = description
@@ -1057,7 +1601,7 @@ class DBDataset(DBObject):
         meta = json.dumps(self.Metadata or {})
         file_meta_requirements = json.dumps(self.FileMetaRequirements or {})
         #print("DBDataset.save: saving")
-        column_names = self.columns(exclude="created_timestamp")        # use DB default for creation
+        column_names = self.columns(exclude=["created_timestamp", "total_size"])        # use DB default for creation
         transaction.execute(f"""
             insert into datasets({column_names}) 
                 values(%s, %s, %s, %s, %s, %s, %s, %s, %s, null, null)
@@ -1076,17 +1620,17 @@ class DBDataset(DBObject):
         meta = json.dumps(self.Metadata or {})
         file_meta_requirements = json.dumps(self.FileMetaRequirements or {})
         #print("DBDataset.save: saving")
-        column_names = self.columns()
+        # file_count is maintained by the database, see update_file_counts()
         if updated_by:
             transaction.execute(f"""
                 update datasets 
                     set frozen=%s, monotonic=%s, metadata=%s, description=%s, 
-                        file_metadata_requirements=%s, file_count=%s,
+                        file_metadata_requirements=%s,
                         updated_by=%s, updated_timestamp=now()
                     where namespace=%s and name=%s
                     returning updated_timestamp
                 """,
-                (   self.Frozen, self.Monotonic, meta, self.Description, file_meta_requirements, self.FileCount,
+                (   self.Frozen, self.Monotonic, meta, self.Description, file_meta_requirements,
                     updated_by,
                     namespace, self.Name
                 )
@@ -1096,13 +1640,14 @@ class DBDataset(DBObject):
             transaction.execute(f"""
                 update datasets 
                     set frozen=%s, monotonic=%s, metadata=%s, description=%s, 
-                        file_metadata_requirements=%s, file_count=%s
+                        file_metadata_requirements=%s
                     where namespace=%s and name=%s
                 """,
-                (   self.Frozen, self.Monotonic, meta, self.Description, file_meta_requirements, self.FileCount,
+                (   self.Frozen, self.Monotonic, meta, self.Description, file_meta_requirements,
                     namespace, self.Name
                 )
             )
+        self.FileMetaValidator = None
         return self
 
     @transactioned
@@ -1111,32 +1656,30 @@ class DBDataset(DBObject):
         if exclude_immediate:
             immediate = set((c.Namespace, c.Name) for c in self.children())
         columns = self.columns("d")
-        meta_condition = "and " + meta_filter.sql("d") if meta_filter is not None else ""
+        params = SQLParams()
+        meta_condition = "and " + meta_filter.sql("d", params=params) if meta_filter is not None else ""
+        namespace, name = params.bind(self.Namespace), params.bind(self.Name)
         transaction.execute(f"""
-            with recursive subsets (namespace, name, path, loop) as 
-            (
-                select pc.child_namespace, pc.child_name, array[pc.child_namespace || ':' || pc.child_name], false
-                    from datasets_parent_child pc
-                    where pc.parent_namespace = %s and pc.parent_name = %s
-                union
-                    select pc1.child_namespace, pc1.child_name,
-                        s.path || (pc1.child_namespace || ':' || pc1.child_name),
-                        pc1.child_namespace || ':' || pc1.child_name = any(s.path)
-                    from datasets_parent_child pc1, subsets s
-                    where pc1.parent_namespace = s.namespace and pc1.parent_name = s.name and not s.loop
-            )
-            select distinct {columns} from subsets s, datasets d
-                where d.namespace = s.namespace and
-                    d.name = s.name
+            select {columns} from datasets d
+                where (d.namespace, d.name) in (
+                        select c.descendant_namespace, c.descendant_name
+                            from datasets_closure c
+                            where c.ancestor_namespace = {namespace} and c.ancestor_name = {name}
+                    )
                     {meta_condition}
-        """, (self.Namespace, self.Name))
+        """, params)
         out = (DBDataset.from_tuple(self.DB, tup) for tup in transaction)
         if exclude_immediate:
             out = (ds for ds in out if (ds.Namespace, ds.Name) not in immediate)
         return out
 
     def subset_count(self):
-        return len(list(self.subsets()))
+        c = self.DB.cursor()
+        c.execute("""
+            select count(*) from datasets_closure
+                where ancestor_namespace = %s and ancestor_name = %s
+        """, (self.Namespace, self.Name))
+        return c.fetchone()[0]
             
     @transactioned
     def ancestors(self, exclude_immediate=False, transaction=None):
@@ -1145,21 +1688,12 @@ class DBDataset(DBObject):
             immediate = set((c.Namespace, c.Name) for c in self.parents())
         columns = self.columns("d")
         transaction.execute(f"""
-            with recursive ancestors (namespace, name, path, loop) as 
-            (
-                select pc.parent_namespace, pc.parent_name, array[pc.parent_namespace || ':' || pc.parent_name], false
-                    from datasets_parent_child pc
-                    where pc.child_namespace = %s and pc.child_name = %s
-                union
-                    select pc1.parent_namespace, pc1.parent_name,
-                        a.path || (pc1.parent_namespace || ':' || pc1.parent_name),
-                        pc1.parent_namespace || ':' || pc1.parent_name = any(a.path)
-                    from datasets_parent_child pc1, ancestors a
-                    where pc1.child_namespace = a.namespace and pc1.child_name = a.name and not a.loop
-            )
-            select distinct {columns} from ancestors a, datasets d
-                where d.namespace = a.namespace and
-                    d.name = a.name
+            select {columns} from datasets d
+                where (d.namespace, d.name) in (
+                        select c.ancestor_namespace, c.ancestor_name
+                            from datasets_closure c
+                            where c.descendant_namespace = %s and c.descendant_name = %s
+                    )
         """, (self.Namespace, self.Name))
         out = (DBDataset.from_tuple(self.DB, tup) for tup in transaction)
         if exclude_immediate:
@@ -1167,20 +1701,27 @@ class DBDataset(DBObject):
         return out
 
     def ancestor_count(self):
-        return len(list(self.ancestors()))
+        c = self.DB.cursor()
+        c.execute("""
+            select count(*) from datasets_closure
+                where descendant_namespace = %s and descendant_name = %s
+        """, (self.Namespace, self.Name))
+        return c.fetchone()[0]
 
     @transactioned
     def children(self, meta_filter=None, transaction=None):
         # immediate children as filled DBDataset objects
         columns = self.columns("c")
-        meta_where_clause = "and " + meta_filter.sql("c") if meta_filter is not None else ""
+        params = SQLParams()
+        meta_where_clause = "and " + meta_filter.sql("c", params=params) if meta_filter is not None else ""
+        namespace, name = params.bind(self.Namespace), params.bind(self.Name)
         transaction.execute(f"""select {columns}
                         from datasets c, datasets_parent_child pc
-                        where pc.parent_namespace=%s and pc.parent_name=%s
+                        where pc.parent_namespace={namespace} and pc.parent_name={name}
                             and pc.child_namespace=c.namespace
                             and pc.child_name=c.name
                             {meta_where_clause}
-                        """, (self.Namespace, self.Name)
+                        """, params
         )
         return (DBDataset.from_tuple(self.DB, tup) for tup in transaction.results())
 
@@ -1233,11 +1774,117 @@ class DBDataset(DBObject):
         )
         return c.fetchone()[0]
 
-    def add_child(self, child):
-        _DatasetParentToChild(self.DB, self).add(child.Namespace, child.Name)
+    #
+    # datasets_closure has a row for each ancestor/descendant pair of datasets with the number of distinct paths
+    # between them. It is updated together with datasets_parent_child, one edge at a time.
+    #
+
+    ClosurePathsSQL = """
+                select a.namespace as ancestor_namespace, a.name as ancestor_name, 
+                        d.namespace as descendant_namespace, d.name as descendant_name, 
+                        sum(a.paths * d.paths) as paths
+                    from edge e,
+                        lateral (
+                            select e.parent_namespace as namespace, e.parent_name as name, 1::bigint as paths
+                            union all
+                            select c.ancestor_namespace, c.ancestor_name, c.paths from datasets_closure c 
+                                where c.descendant_namespace = e.parent_namespace and c.descendant_name = e.parent_name
+                        ) a,
+                        lateral (
+                            select e.child_namespace as namespace, e.child_name as name, 1::bigint as paths
+                            union all
+                            select c.descendant_namespace, c.descendant_name, c.paths from datasets_closure c 
+                                where c.ancestor_namespace = e.child_namespace and c.ancestor_name = e.child_name
+                        ) d
+                    group by a.namespace, a.name, d.namespace, d.name
+    """
+
+    AddEdgeSQL = f"""
+        with edge as (
+                insert into datasets_parent_child(parent_namespace, parent_name, child_namespace, child_name) 
+                    values(%(parent_namespace)s, %(parent_name)s, %(child_namespace)s, %(child_name)s)
+                    on conflict(parent_namespace, parent_name, child_namespace, child_name) do nothing
+                    returning parent_namespace, parent_name, child_namespace, child_name
+            ), 
+            counts as ({ClosurePathsSQL})
+        insert into datasets_closure(ancestor_namespace, ancestor_name, descendant_namespace, descendant_name, paths)
+            select ancestor_namespace, ancestor_name, descendant_namespace, descendant_name, paths from counts
+            on conflict(ancestor_namespace, ancestor_name, descendant_namespace, descendant_name) do update
+                set paths = datasets_closure.paths + excluded.paths
+    """
+
+    RemoveEdgeSQL = f"""
+        with edge as (
+                delete from datasets_parent_child 
+                    where parent_namespace = %(parent_namespace)s and parent_name = %(parent_name)s 
+                        and child_namespace = %(child_namespace)s and child_name = %(child_name)s
+                    returning parent_namespace, parent_name, child_namespace, child_name
+            ), 
+            counts as ({ClosurePathsSQL}),
+            removed as (
+                delete from datasets_closure dc using counts c
+                    where (dc.ancestor_namespace, dc.ancestor_name, dc.descendant_namespace, dc.descendant_name) = 
+                            (c.ancestor_namespace, c.ancestor_name, c.descendant_namespace, c.descendant_name)
+                        and dc.paths <= c.paths
+            )
+        update datasets_closure dc set paths = dc.paths - c.paths
+            from counts c
+            where (dc.ancestor_namespace, dc.ancestor_name, dc.descendant_namespace, dc.descendant_name) = 
+                    (c.ancestor_namespace, c.ancestor_name, c.descendant_namespace, c.descendant_name)
+                and dc.paths > c.paths
+    """
+
+    @staticmethod
+    def lock_closure(transaction):
+        # datasets_closure path counts are computed from the closure rows the transaction can see, so the transactions
+        # modifying datasets_parent_child must not run concurrently. The lock is held until the end of the transaction
+        transaction.execute("lock table datasets_parent_child in share row exclusive mode")
+
+    @transactioned
+    def add_child(self, child, transaction=None):
+        # raises DatasetCircularDependencyDetected if the child is this dataset or one of its ancestors
+        DBDataset.lock_closure(transaction)
+        transaction.execute("""
+            select exists (
+                select 1 from datasets_closure
+                    where ancestor_namespace = %s and ancestor_name = %s 
+                        and descendant_namespace = %s and descendant_name = %s
+            )""", (child.Namespace, child.Name, self.Namespace, self.Name))
+        if transaction.fetchone()[0] or (child.Namespace, child.Name) == (self.Namespace, self.Name):
+            raise DatasetCircularDependencyDetected(f"{child.did()} is {self.did()} or one of its ancestors")
+        transaction.execute(DBDataset.AddEdgeSQL, dict(parent_namespace=self.Namespace, parent_name=self.Name,
+                                child_namespace=child.Namespace, child_name=child.Name))
     
-    def remove_child(self, child):
-        _DatasetParentToChild(self.DB, self).remove(child.Namespace, child.Name)
+    @transactioned
+    def remove_child(self, child, transaction=None):
+        DBDataset.lock_closure(transaction)
+        transaction.execute(DBDataset.RemoveEdgeSQL, dict(parent_namespace=self.Namespace, parent_name=self.Name,
+                                child_namespace=child.Namespace, child_name=child.Name))
+
+    @staticmethod
+    @transactioned
+    def rebuild_closure(db, transaction=None):
+        # rebuilds datasets_closure from datasets_parent_child
+        # parent/child connections, which make circular dependencies, are removed
+        # returns list of removed connections as (parent, child) tuples of DBDataset objects
+        DBDataset.lock_closure(transaction)
+        transaction.execute("""
+            select parent_namespace, parent_name, child_namespace, child_name from datasets_parent_child;
+        """)
+        edges = transaction.fetchall()
+        transaction.execute("""
+            truncate datasets_closure;
+            delete from datasets_parent_child;
+        """)
+        removed = []
+        for parent_namespace, parent_name, child_namespace, child_name in edges:
+            parent = DBDataset(db, parent_namespace, parent_name)
+            child = DBDataset(db, child_namespace, child_name)
+            try:
+                parent.add_child(child, transaction=transaction)
+            except DatasetCircularDependencyDetected:
+                removed.append((parent, child))
+        return removed
     
     @transactioned
     def add_file(self, f, transaction=None, **args):
@@ -1277,11 +1924,6 @@ class DBDataset(DBObject):
                 on conflict do nothing""", (self.Namespace, self.Name))
         nadded = transaction.rowcount
         transaction.execute(f"drop table {temp_table}")
-        transaction.execute(f"""
-            update datasets
-                set file_count = file_count + %s
-                where namespace = %s and name = %s
-        """, (nadded, self.Namespace, self.Name))
         return nadded
 
     @transactioned
@@ -1394,6 +2036,9 @@ class DBDataset(DBObject):
         return (DBDataset.from_tuple(db, tup) for tup in transaction.results())
 
     def nfiles(self, exact=False):
+        # exact=True: number of not retired files in the dataset, counted now
+        # exact=False: the file_count column. It includes retired files and is updated by the daemon, so it lags behind
+        #   by up to counts_update_interval, see update_file_counts()
         c = self.DB.cursor()
         if exact:
             c.execute("""select count(*) 
@@ -1421,6 +2066,7 @@ class DBDataset(DBObject):
             file_meta_requirements = self.FileMetaRequirements,
             description = self.Description,
             file_count = self.FileCount,
+            total_size = self.TotalSize,
             updated_timestamp = epoch(self.UpdatedTimestamp),
             updated_by = self.UpdatedBy
         )
@@ -1437,14 +2083,23 @@ class DBDataset(DBObject):
     @transactioned
     def delete(self, transaction=None):
         # delete attachments to dataset and then the dataset itself
+        DBDataset.lock_closure(transaction)
         transaction.execute("""
-            delete from datasets_parent_child where (parent_namespace=%s and parent_name=%s) 
+            select parent_namespace, parent_name, child_namespace, child_name from datasets_parent_child 
+                where (parent_namespace=%s and parent_name=%s) 
                   or (child_namespace=%s and child_name=%s);
-            delete from files_datasets where dataset_namespace=%s and dataset_name=%s;
-            delete from datasets where namespace=%s and name=%s;
         """, (
           self.Namespace, self.Name,
           self.Namespace, self.Name,
+        ))
+        transaction.executemany(DBDataset.RemoveEdgeSQL, 
+            [dict(parent_namespace=pns, parent_name=pn, child_namespace=cns, child_name=cn) 
+                for pns, pn, cns, cn in transaction.fetchall()]
+        )
+        transaction.execute("""
+            delete from files_datasets where dataset_namespace=%s and dataset_name=%s;
+            delete from datasets where namespace=%s and name=%s;
+        """, (
           self.Namespace, self.Name,
           self.Namespace, self.Name,
         ))
@@ -1472,10 +2127,18 @@ class DBDataset(DBObject):
                 datasets.add((namespace, name))
                 
         #print("list_datasets: with_children:", with_children)
-        specs = set(f"{namespace}:{name}" for namespace, name in datasets)
-        if with_children:
-            specs = subsets_rec(c, specs, set(), level=None if recursively else 0)              # FIXME
-        return DBDataset.get_many(db, [spec.split(":",1) for spec in specs])    
+        if with_children and datasets:
+            namespaces, names = zip(*datasets)
+            if recursively:
+                c.execute("""select descendant_namespace, descendant_name from datasets_closure
+                                where (ancestor_namespace, ancestor_name) in (select * from unnest(%s::text[], %s::text[]))
+                        """, (list(namespaces), list(names)))
+            else:
+                c.execute("""select child_namespace, child_name from datasets_parent_child
+                                where (parent_namespace, parent_name) in (select * from unnest(%s::text[], %s::text[]))
+                        """, (list(namespaces), list(names)))
+            datasets |= set(c.fetchall())
+        return DBDataset.get_many(db, list(datasets))    
 
     @staticmethod
     def datasets_for_bdq(db, bdq, limit=None):
@@ -1486,10 +2149,11 @@ class DBDataset(DBObject):
         if bdq.is_explicit():
             out = [(bdq.Namespace, bdq.Name)]
         else:
-            sql = DBDataset.sql_for_bdq(bdq)
+            params = SQLParams()
+            sql = DBDataset.sql_for_bdq(bdq, params)
             debug("datasets_for_bdq: sql: " + sql)
             c = db.cursor()
-            c.execute(sql)
+            execute_sql(c, sql, params)
             datasets = (DBDataset.from_tuple(db, tup) for tup in fetch_generator(c))
             out = limited(((ds.Namespace, ds.Name) for ds in datasets), limit)
         return out
@@ -1502,15 +2166,16 @@ class DBDataset(DBObject):
                 yield ds
 
     @staticmethod
-    def datasets_from_sql(db, sql):
+    def datasets_from_sql(db, sql, params=None):
         c = db.cursor()
-        c.execute(sql)
+        execute_sql(c, sql, params)
         return (DBDataset.from_tuple(db, tup) for tup in fetch_generator(c))
 
     @staticmethod
-    def sql_for_bdq(bdq, names_only=False):
-            namespace = bdq.Namespace
-            name = bdq.Name
+    def sql_for_bdq(bdq, params, names_only=False):
+            # params: SQLParams to bind the query literals to
+            namespace = params.bind(bdq.Namespace)
+            name = params.bind(bdq.Name)
             columns = ["namespace", "name"] if names_only else DBDataset.columns(as_text=False)
             table = DBDataset.Table
             
@@ -1520,7 +2185,7 @@ class DBDataset(DBObject):
                 sql = f"""\
                         select {columns} 
                             from {table} {a}
-                            where {a}.namespace = '{namespace}' and {a}.name = '{name}'
+                            where {a}.namespace = {namespace} and {a}.name = {name}
                 """
                 #print("was explicit. SQL:", sql)
                 return dedent(sql)
@@ -1532,11 +2197,8 @@ class DBDataset(DBObject):
             where = bdq.Where
 
             pc = alias("pc")
-            pc1 = alias("pc1")
             d = alias("d")
-            s = alias("s")
             ds = alias("ds")
-            t = alias("t")
 
             meta_filter_dnf = DatasetMetaExpressionDNF(where) if where is not None else None
 
@@ -1544,7 +2206,7 @@ class DBDataset(DBObject):
                 "~" if regexp else "like"
             )
 
-            name_cmp = f"{ds}.name {name_cmp_op} '{name}'"
+            name_cmp = f"{ds}.name {name_cmp_op} {name}"
 
             if not with_children:
                 #print([f"{ds}.{c}" for c in columns])
@@ -1552,11 +2214,11 @@ class DBDataset(DBObject):
                 #print("columns:", columns)
                 meta_filter = ""
                 if meta_filter_dnf is not None:
-                    meta_filter = "and " + meta_filter_dnf.sql(ds)
+                    meta_filter = "and " + meta_filter_dnf.sql(ds, params=params)
                 sql = dedent(f"""\
                     select {columns} 
                         from {table} {ds} 
-                        where {ds}.namespace = '{namespace}' 
+                        where {ds}.namespace = {namespace} 
                             and {name_cmp}
                             {meta_filter}
                 """)
@@ -1564,53 +2226,36 @@ class DBDataset(DBObject):
                 #    sql += " and " + meta_filter_dnf.sql(ds)
             else:
                 columns = ",".join(f"{d}.{c}" for c in columns)
-                top_sql = dedent(f"""\
-                    select {ds}.namespace, {ds}.name, array[{ds}.namespace || ':' || {ds}.name], false
-                        from {table} {ds}
-                        where {ds}.namespace = '{namespace}' and {name_cmp}
-                    """)
-
-                if not recursively:
-                    selected_sql = insert_sql(dedent(f"""\
-                        with selected_datasets (namespace, name, path, loop) as 
-                        (
-                            with {t} (namespace, name, path, loop) as 
-                            ( 
-                                $top_sql
-                            )
-                            select namespace, name, path, loop from {t}
-                            union
-                                select {pc}.child_namespace, {pc}.child_name,
-                                    {t}.path || ({pc}.child_namespace || ':' || {pc}.child_name), true
-                                from datasets_parent_child {pc}, {t}
-                                where {pc}.parent_namespace = {t}.namespace and {pc}.parent_name = {t}.name
-                        )"""), top_sql=top_sql)
+                if recursively:
+                    subsets_sql = f"""\
+                            select {pc}.descendant_namespace, {pc}.descendant_name
+                                from {table} {ds}, datasets_closure {pc}
+                                where {ds}.namespace = {namespace} and {name_cmp}
+                                    and {pc}.ancestor_namespace = {ds}.namespace and {pc}.ancestor_name = {ds}.name"""
                 else:
-                    selected_sql = insert_sql(dedent(f"""\
-                        with recursive selected_datasets (namespace, name, path, loop) as 
-                        (
-                            $top_sql
-                            union
-                                select {pc1}.child_namespace, {pc1}.child_name,
-                                    {s}.path || ({pc1}.child_namespace || ':' || {pc1}.child_name),
-                                    {pc1}.child_namespace || ':' || {pc1}.child_name = any({s}.path)
-                                from datasets_parent_child {pc1}, selected_datasets {s}
-                                where {pc1}.parent_namespace = {s}.namespace and {pc1}.parent_name = {s}.name and not {s}.loop
-                        )"""), top_sql=top_sql)
-                meta_condition = "and " + meta_filter_dnf.sql(d) if meta_filter_dnf is not None else ""
-                sql = insert_sql(f"""\
-                    $selected_sql
-                    select distinct {columns} 
-                        from selected_datasets {s}, datasets {d}
-                        where {d}.namespace = {s}.namespace and
-                            {d}.name = {s}.name
+                    subsets_sql = f"""\
+                            select {pc}.child_namespace, {pc}.child_name
+                                from {table} {ds}, datasets_parent_child {pc}
+                                where {ds}.namespace = {namespace} and {name_cmp}
+                                    and {pc}.parent_namespace = {ds}.namespace and {pc}.parent_name = {ds}.name"""
+                meta_condition = "and " + meta_filter_dnf.sql(d, params=params) if meta_filter_dnf is not None else ""
+                sql = insert_sql(dedent(f"""\
+                    select {columns} 
+                        from {table} {d}
+                        where ({d}.namespace, {d}.name) in (
+                                select {ds}.namespace, {ds}.name
+                                    from {table} {ds}
+                                    where {ds}.namespace = {namespace} and {name_cmp}
+                                union all
+                                $subsets_sql
+                            )
                             {meta_condition}
-                """, selected_sql=selected_sql)
+                """), subsets_sql=subsets_sql)
             debug(f"sql_for_basic_dataset_query({bdq}): sql:\n", sql)
             return sql
 
     @staticmethod
-    def sql_for_bdqs(bdqs, names_only=False):
+    def sql_for_bdqs(bdqs, params, names_only=False):
         explicits = [q for q in bdqs if q.is_explicit()]
         others = [q for q in bdqs if not q.is_explicit()]
         
@@ -1620,18 +2265,18 @@ class DBDataset(DBObject):
             columns = ["namespace", "name"] if names_only else DBDataset.columns(as_text=False)
             a = alias("exp")
             columns = ",".join(f"{a}.{c}" for c in columns)
-            pairs = tuple((q.Namespace, q.Name) for q in explicits)
-            pairs = ','.join(str(pair) for pair in pairs)
+            namespaces = params.bind([q.Namespace for q in explicits], "text[]")
+            names = params.bind([q.Name for q in explicits], "text[]")
             sql = f"""\
                 select {columns}
                     from {table} {a}
-                    where ({a}.namespace, {a}.name) in ({pairs})
+                    where ({a}.namespace, {a}.name) in (select * from unnest({namespaces}, {names}))
             """
             #sql = f"""\
             #    values {pairs}
             #"""
             parts.append(sql)
-        parts.extend([DBDataset.sql_for_bdq(q, names_only) for q in others])
+        parts.extend([DBDataset.sql_for_bdq(q, params, names_only) for q in others])
         return"\nunion\n".join(dedent(p) for p in parts)
 
     def validate_file_metadata(self, meta):
@@ -1649,7 +2294,9 @@ class DBDataset(DBObject):
             ...
         }
         """
-        error_list = validate_metadata(self.FileMetaRequirements or {}, False, meta)
+        if self.FileMetaValidator is None:
+            self.FileMetaValidator = metadata_validator(self.FileMetaRequirements, False)
+        error_list = self.FileMetaValidator.validate(meta)
         errors = []
         for name, error in error_list:
             v = meta.get(name)
@@ -1735,6 +2382,51 @@ class DBDataset(DBObject):
         """)
         return dict(((ds_ns, ds_name), n) for ds_ns, ds_name, n in fetch_generator(c))
 
+    @staticmethod
+    @transactioned
+    def update_file_counts(db, recount=False, transaction=None):
+        #
+        # Adds file count and size changes, logged by the database triggers in file_count_deltas, to the datasets.
+        # recount=True: recalculates the counts from scratch instead. The pending deltas are discarded in the same
+        # statement, so that both see the same snapshot of the database.
+        #
+        transaction.execute("select pg_advisory_xact_lock(hashtext('datasets.file_count'))")
+        if recount:
+            transaction.execute("""
+                with discarded as (
+                        delete from file_count_deltas where dataset_name is not null
+                    ),
+                    counts as (
+                        select fd.dataset_namespace as namespace, fd.dataset_name as name, 
+                                count(*) as files, coalesce(sum(f.size), 0) as bytes
+                            from files_datasets fd, files f
+                            where f.id = fd.file_id
+                            group by fd.dataset_namespace, fd.dataset_name
+                    )
+                update datasets d
+                    set file_count = coalesce(c.files, 0), total_size = coalesce(c.bytes, 0)
+                    from datasets d1 left outer join counts c on c.namespace = d1.namespace and c.name = d1.name
+                    where d.namespace = d1.namespace and d.name = d1.name
+                        and (d.file_count, d.total_size) is distinct from (coalesce(c.files, 0), coalesce(c.bytes, 0))
+            """)
+        else:
+            transaction.execute("""
+                with deltas as (
+                        delete from file_count_deltas where dataset_name is not null
+                            returning namespace, dataset_name, files, bytes
+                    ),
+                    totals as (
+                        select namespace, dataset_name as name, sum(files) as files, sum(bytes) as bytes
+                            from deltas
+                            group by namespace, dataset_name
+                    )
+                update datasets d
+                    set file_count = d.file_count + t.files, total_size = d.total_size + t.bytes
+                    from totals t
+                    where d.namespace = t.namespace and d.name = t.name
+            """)
+        return transaction.rowcount
+
 
 class DBNamedQuery(DBObject):
     
@@ -1823,34 +2515,34 @@ class DBNamedQuery(DBObject):
         return (DBNamedQuery.from_tuple(db, tup) for tup in fetch_generator(c))
 
     @staticmethod
-    def sql_for_bqq(bqq):
-        namespace = bqq.Namespace
-        name = bqq.Name
+    def sql_for_bqq(bqq, params):
+        namespace = params.bind(bqq.Namespace)
+        name = params.bind(bqq.Name)
         regexp = bqq.RegExp
         where = bqq.Where
         a = alias("nq")
         meta_filter_dnf = DatasetMetaExpressionDNF(where) if where is not None else None
-        where_sql = "" if meta_filter_dnf is None else " and " + meta_filter_dnf.sql(a)
+        where_sql = "" if meta_filter_dnf is None else " and " + meta_filter_dnf.sql(a, params=params)
         table = DBNamedQuery.Table
         columns = DBNamedQuery.columns(table_name=a)
         if regexp:
             sql = f"""select {columns}
                 from {table} {a}
-                where {a}.namespace='{namespace}' and {a}.name ~ '{name}'
+                where {a}.namespace={namespace} and {a}.name ~ {name}
                     {where_sql}
             """
         else:
             sql = f"""select {columns}
                 from {table} {a}
-                where {a}.namespace='{namespace}' and {a}.name like '{name}'
+                where {a}.namespace={namespace} and {a}.name like {name}
                     {where_sql}
             """
         return sql
     
     @staticmethod
-    def queries_from_sql(db, sql):
+    def queries_from_sql(db, sql, params=None):
         c = db.cursor()
-        c.execute(sql)
+        execute_sql(c, sql, params)
         return (DBNamedQuery.from_tuple(db, tup) for tup in fetch_generator(c))
 
 
@@ -1878,12 +2570,12 @@ class DBUser(BaseDBUser):
 
 class DBNamespace(DBObject):
 
-    Columns = "name,owner_user,owner_role,description,creator,created_timestamp,file_count".split(",")
+    Columns = "name,owner_user,owner_role,description,creator,created_timestamp,file_count,total_size".split(",")
     Table = "namespaces"
     PK = ["name"]
 
     def __init__(self, db, name, owner_user=None, owner_role=None, description=None, 
-                creator=None, created_timestamp=None, file_count=0):
+                creator=None, created_timestamp=None, file_count=0, total_size=0):
         DBObject.__init__(self, db)
         self.Name = name
         assert None in (owner_user, owner_role)
@@ -1893,11 +2585,12 @@ class DBNamespace(DBObject):
         self.Creator = creator
         self.CreatedTimestamp = created_timestamp
         self.FileCount = file_count
+        self.TotalSize = total_size
         
     @staticmethod
     def from_tuple(db, tup):
-        name, owner_user, owner_role, description, creator, created_timestamp, file_count = tup
-        ns = DBNamespace(db, name, owner_user, owner_role, description, creator, created_timestamp, file_count)
+        name, owner_user, owner_role, description, creator, created_timestamp, file_count, total_size = tup
+        ns = DBNamespace(db, name, owner_user, owner_role, description, creator, created_timestamp, file_count, total_size)
         return ns
         
     def to_jsonable(self):
@@ -1907,17 +2600,19 @@ class DBNamespace(DBObject):
             owner_role=self.OwnerRole,
             creator = self.Creator,
             description = self.Description,
-            created_timestamp = epoch(self.CreatedTimestamp)
+            created_timestamp = epoch(self.CreatedTimestamp),
+            file_count = self.FileCount,
+            total_size = self.TotalSize
         )
         
     @transactioned
     def save(self, transaction=None):
         transaction.execute(f"""
             update {self.Table}
-                set owner_user=%s, owner_role=%s, description=%s, file_count=%s
+                set owner_user=%s, owner_role=%s, description=%s
                 where name=%s
             """,
-            (self.OwnerUser, self.OwnerRole, self.Description, self.FileCount,
+            (self.OwnerUser, self.OwnerRole, self.Description,
                 self.Name)
         )
         return self
@@ -1998,6 +2693,58 @@ class DBNamespace(DBObject):
         if isinstance(role, DBRole):   role = role.Name
         return self.OwnerRole == role
 
+    @staticmethod
+    def names_owned_by_user(db, user):
+        # set of names of namespaces owned by the user directly or through roles
+        if isinstance(user, DBUser):   user = user.Username
+        c = db.cursor()
+        c.execute(f"""
+            select ns.name from {DBNamespace.Table} ns where ns.owner_user = %s
+            union
+            select ns.name from {DBNamespace.Table} ns, users_roles ur
+                where ur.username = %s and ur.role_name = ns.owner_role
+        """, (user, user))
+        return set(name for (name,) in fetch_generator(c))
+
+    @staticmethod
+    @transactioned
+    def update_file_counts(db, recount=False, transaction=None):
+        # see DBDataset.update_file_counts()
+        transaction.execute("select pg_advisory_xact_lock(hashtext('namespaces.file_count'))")
+        if recount:
+            transaction.execute("""
+                with discarded as (
+                        delete from file_count_deltas where dataset_name is null
+                    ),
+                    counts as (
+                        select f.namespace, count(*) as files, coalesce(sum(f.size), 0) as bytes
+                            from files f
+                            group by f.namespace
+                    )
+                update namespaces ns
+                    set file_count = coalesce(c.files, 0), total_size = coalesce(c.bytes, 0)
+                    from namespaces ns1 left outer join counts c on c.namespace = ns1.name
+                    where ns.name = ns1.name
+                        and (ns.file_count, ns.total_size) is distinct from (coalesce(c.files, 0), coalesce(c.bytes, 0))
+            """)
+        else:
+            transaction.execute("""
+                with deltas as (
+                        delete from file_count_deltas where dataset_name is null
+                            returning namespace, files, bytes
+                    ),
+                    totals as (
+                        select namespace, sum(files) as files, sum(bytes) as bytes
+                            from deltas
+                            group by namespace
+                    )
+                update namespaces ns
+                    set file_count = ns.file_count + t.files, total_size = ns.total_size + t.bytes
+                    from totals t
+                    where ns.name = t.namespace
+            """)
+        return transaction.rowcount
+
     def file_count(self):
         c = self.DB.cursor()
         c.execute("""select count(*) from files where namespace=%s""", (self.Name,))
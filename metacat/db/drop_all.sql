@@ -1,4 +1,6 @@
 drop view if exists file_provenance, files_with_provenance;
-drop table if exists files_datasets, datasets_parent_child, users_roles, parent_child, queries, parameter_definitions, authenticators cascade;
+drop table if exists file_count_deltas, files_datasets, datasets_closure, datasets_parent_child, users_roles, file_lineage, parent_child, queries, parameter_definitions, authenticators cascade;
 drop table if exists files, datasets, users, parameter_categories, namespaces, roles cascade;
 
+drop function if exists files_inserted_count, files_deleted_count, files_deleting_count, files_updated_count, 
+    files_datasets_inserted_count, files_datasets_deleted_count;
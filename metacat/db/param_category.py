@@ -1,7 +1,8 @@
 from metacat.common import DBObject, transactioned
 from metacat.db import DBRole, DBUser
-import json
-from metacat.util import epoch, validate_metadata, fetch_generator
+import json, time
+from threading import RLock
+from metacat.util import epoch, metadata_validator, fetch_generator
 
 class DBParamCategory(DBObject):
 
@@ -27,6 +28,13 @@ class DBParamCategory(DBObject):
     Types =  ('int','float','text','boolean',
                 'int[]','float[]','text[]','boolean[]','dict', 'list', 'any')
 
+    # Validators of the deepest categories for metadata parameter paths, used by validate_metadata_bulk().
+    # Refreshed when categories are created or saved by this process, and expire after ValidatorsTTL
+    # seconds to see changes made by other processes
+    ValidatorsTTL = 60
+    Validators = {}                 # path -> (expiration, validator or None)
+    ValidatorsLock = RLock()
+
     def __init__(self, db, path, restricted=False, owner_role=None, owner_user=None, creator=None, definitions={}, description="", created_timestamp=None):
         self.Path = path
         self.DB = db
@@ -37,6 +45,7 @@ class DBParamCategory(DBObject):
         self.Definitions = definitions         
         self.Creator = creator 
         self.CreatedTimestamp = created_timestamp
+        self.Validator = None
         
     def owners(self, directly=False):
         if self.OwnerUser is not None:
@@ -100,6 +109,8 @@ class DBParamCategory(DBObject):
             """,
             dict(path=self.Path, owner_user=self.OwnerUser, owner_role=self.OwnerRole, restricted=self.Restricted, defs=defs,
                     description=self.Description, creator=self.Creator))
+        self.Validator = None
+        DBParamCategory.invalidate_validators()
         return self
 
     @transactioned
@@ -115,6 +126,7 @@ class DBParamCategory(DBObject):
                     description=self.Description, creator=self.Creator)
         )
         self.CreatedTimestamp = transaction.fetchone()[0]
+        DBParamCategory.invalidate_validators()
         return self
     
     @staticmethod
@@ -140,8 +152,8 @@ class DBParamCategory(DBObject):
         return DBParamCategory.get(db, path) != None
 
     @staticmethod
-    def category_for_path(db, path):
-        # get the deepest category containing the path
+    def path_prefixes(path):
+        # paths of the categories which may contain the path, from the root down
         words = path.split(".")
         p = []
         paths = ['.']
@@ -149,7 +161,12 @@ class DBParamCategory(DBObject):
             if w:
                 p.append(w)
                 paths.append(".".join(p))
-                
+        return paths
+
+    @staticmethod
+    def category_for_path(db, path):
+        # get the deepest category containing the path
+        paths = DBParamCategory.path_prefixes(path)
         c = db.cursor()
         columns = DBParamCategory.columns()
         c.execute(f"""
@@ -160,13 +177,56 @@ class DBParamCategory(DBObject):
         tup = c.fetchone()
         return DBParamCategory.from_tuple(db, tup)
 
+    def validator(self):
+        if self.Validator is None:
+            self.Validator = metadata_validator(self.Definitions, self.Restricted)
+        return self.Validator
+
     def validate_parameter(self, name, value):
-        errors = validate_metadata(self.Definitions, self.Restricted, name=name, value=value)
+        return DBParamCategory.parameter_validation(self.validator(), name, value)
+
+    @staticmethod
+    def parameter_validation(validator, name, value):
+        errors = validator.validate(name=name, value=value)
         if errors:
             return False, errors[0][1]
         else:
             return True, "valid"
-        return True, "valid"
+
+    @staticmethod
+    def validators_for_paths(db, paths):
+        # returns {path: validator of the deepest category containing the path, or None}
+        now = time.time()
+        validators = {}
+        missing = []
+        with DBParamCategory.ValidatorsLock:
+            for path in paths:
+                entry = DBParamCategory.Validators.get(path)
+                if entry is not None and entry[0] > now:
+                    validators[path] = entry[1]
+                else:
+                    missing.append(path)
+        if missing:
+            prefixes = {path: DBParamCategory.path_prefixes(path) for path in missing}
+            categories = {c.Path: c for c in DBParamCategory.get_many(db, set().union(*prefixes.values()))}
+            expiration = now + DBParamCategory.ValidatorsTTL
+            with DBParamCategory.ValidatorsLock:
+                for path, path_prefixes in prefixes.items():
+                    category = None
+                    for prefix in reversed(path_prefixes):
+                        category = categories.get(prefix)
+                        if category is not None:
+                            break
+                    validator = None if category is None else category.validator()
+                    validators[path] = validator
+                    if DBParamCategory.ValidatorsTTL:
+                        DBParamCategory.Validators[path] = (expiration, validator)
+        return validators
+
+    @staticmethod
+    def invalidate_validators():
+        with DBParamCategory.ValidatorsLock:
+            DBParamCategory.Validators.clear()
     
     @staticmethod
     def validate_metadata_bulk(db, items):
@@ -188,7 +248,7 @@ class DBParamCategory(DBObject):
                     path, _ = name.rsplit(".", 1)
                     category_paths.add(path)
 
-        categories = {path:DBParamCategory.category_for_path(db, path) for path in category_paths}
+        validators = DBParamCategory.validators_for_paths(db, category_paths)
 
         errors = []
         for index, item in enumerate(items):
@@ -197,9 +257,9 @@ class DBParamCategory(DBObject):
             for name, value in meta.items():
                 if "." in name:
                     path, vname = name.rsplit(".", 1)
-                    category = categories[path]
-                    if category is not None:
-                        ok, error = category.validate_parameter(vname, value)
+                    validator = validators[path]
+                    if validator is not None:
+                        ok, error = DBParamCategory.parameter_validation(validator, vname, value)
                         if not ok:
                             item_errors.append({"name": name, "reason": error, "value": value})
                 else:
@@ -46,7 +46,8 @@ create table namespaces
     
     creator        text references users(username),
     created_timestamp   timestamp with time zone        default now(),
-    file_count  bigint          default 0
+    file_count  bigint          default 0,
+    total_size  bigint          default 0
 );
 
 create table files
@@ -72,6 +73,7 @@ create index files_meta_index on files using gin (metadata);
 
 create index files_creator on files(creator);
 create index files_created_timestamp on files(created_timestamp);
+create index files_created_timestamp_id on files(coalesce(created_timestamp, 'epoch'::timestamptz), id);
 create index files_size on files(size);
 create index files_name on files(name) include (namespace, id);
 create index files_ns_create on files using btree  (namespace , created_timestamp);
@@ -87,6 +89,18 @@ create table parent_child
 
 create index parent_child_child on parent_child(child_id, parent_id);
 
+-- closure of parent_child, maintained by DBFile.add_edges() and DBFile.remove_edges()
+create table file_lineage
+(
+    ancestor_id     text references files(id),
+    descendant_id   text references files(id),
+    depth           int,            -- number of generations between the files
+    paths           bigint,         -- number of distinct parent/child paths of this length
+    primary key (ancestor_id, descendant_id, depth)
+);
+
+create index file_lineage_descendant on file_lineage(descendant_id, ancestor_id, depth);
+
 create view file_provenance as
     select f.id, 
         array(select parent_id from parent_child pc1 where pc1.child_id=f.id) as parents, 
@@ -117,7 +131,8 @@ create table datasets
     file_metadata_requirements  jsonb   default '{}'::jsonb,
     file_count  bigint          default 0,
     updated_timestamp   timestamp with time zone,
-    updated_by          text references users(username)
+    updated_by          text references users(username),
+    total_size  bigint          default 0
 );
 
 create index datasets_meta_index on datasets using gin (metadata);
@@ -139,6 +154,21 @@ create index datasets_parent_child_child on datasets_parent_child(child_namespac
 create index datasets_parent_child_child_spec on datasets_parent_child( (child_namespace || ':' || child_name ));
 create index datasets_parent_child_parent_spec on datasets_parent_child( (parent_namespace || ':' || parent_name ));
 
+-- closure of datasets_parent_child, maintained by DBDataset.add_child() and DBDataset.remove_child()
+create table datasets_closure
+(
+    ancestor_namespace      text,
+    ancestor_name           text,
+    descendant_namespace    text,
+    descendant_name         text,
+    paths                   bigint,         -- number of distinct parent/child paths between the datasets
+    foreign key (ancestor_namespace, ancestor_name) references datasets(namespace, name) on delete cascade,
+    foreign key (descendant_namespace, descendant_name) references datasets(namespace, name) on delete cascade,
+    primary key (ancestor_namespace, ancestor_name, descendant_namespace, descendant_name)
+);
+
+create index datasets_closure_descendant on datasets_closure(descendant_namespace, descendant_name);
+
 create table files_datasets
 (
     file_id                 text    references files on delete cascade,
@@ -150,6 +180,121 @@ create table files_datasets
 
 create index files_datasets_file_id on files_datasets(file_id);
 
+--
+-- Namespace and dataset file counts and total sizes, including retired files.
+-- The triggers below log the changes into file_count_deltas, and the daemon periodically adds them to
+-- namespaces and datasets, see DBNamespace.update_file_counts() and DBDataset.update_file_counts()
+--
+
+create table file_count_deltas
+(
+    namespace       text,
+    dataset_name    text,           -- null for namespace counts
+    files           bigint,
+    bytes           bigint
+);
+
+create function files_inserted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select n.namespace, null, count(*), coalesce(sum(n.size), 0)
+            from new_rows n
+            group by n.namespace;
+    return null;
+end $$;
+
+create function files_deleted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select o.namespace, null, -count(*), -coalesce(sum(o.size), 0)
+            from old_rows o
+            group by o.namespace;
+    return null;
+end $$;
+
+-- the files_datasets rows of a deleted file are deleted by the cascade after the file is gone,
+-- so the file is removed from the dataset counts before it is deleted
+create function files_deleting_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select fd.dataset_namespace, fd.dataset_name, -1, -coalesce(old.size, 0)
+            from files_datasets fd
+            where fd.file_id = old.id;
+    return old;
+end $$;
+
+-- namespace or size change
+create function files_updated_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        with deltas as (
+                select o.id, o.namespace, -1 as files, -coalesce(o.size, 0) as bytes
+                    from old_rows o, new_rows n
+                    where o.id = n.id
+                        and (o.namespace, o.size) is distinct from (n.namespace, n.size)
+                union all
+                select n.id, n.namespace, 1, coalesce(n.size, 0)
+                    from old_rows o, new_rows n
+                    where o.id = n.id
+                        and (o.namespace, o.size) is distinct from (n.namespace, n.size)
+            )
+        select d.namespace, null::text, sum(d.files), sum(d.bytes)
+            from deltas d
+            group by d.namespace
+            having sum(d.files) != 0 or sum(d.bytes) != 0
+        union all
+        select fd.dataset_namespace, fd.dataset_name, sum(d.files), sum(d.bytes)
+            from deltas d, files_datasets fd
+            where fd.file_id = d.id
+            group by fd.dataset_namespace, fd.dataset_name
+            having sum(d.files) != 0 or sum(d.bytes) != 0;
+    return null;
+end $$;
+
+create function files_datasets_inserted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select n.dataset_namespace, n.dataset_name, count(*), coalesce(sum(f.size), 0)
+            from new_rows n, files f
+            where f.id = n.file_id
+            group by n.dataset_namespace, n.dataset_name;
+    return null;
+end $$;
+
+create function files_datasets_deleted_count() returns trigger language plpgsql as $$
+begin
+    -- the rows of deleted files were counted by files_deleting_count()
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select o.dataset_namespace, o.dataset_name, -count(*), -coalesce(sum(f.size), 0)
+            from old_rows o, files f
+            where f.id = o.file_id
+            group by o.dataset_namespace, o.dataset_name;
+    return null;
+end $$;
+
+create trigger files_inserted_count after insert on files
+    referencing new table as new_rows
+    for each statement execute function files_inserted_count();
+
+create trigger files_deleted_count after delete on files
+    referencing old table as old_rows
+    for each statement execute function files_deleted_count();
+
+create trigger files_deleting_count before delete on files
+    for each row execute function files_deleting_count();
+
+create trigger files_updated_count after update on files
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function files_updated_count();
+
+create trigger files_datasets_inserted_count after insert on files_datasets
+    referencing new table as new_rows
+    for each statement execute function files_datasets_inserted_count();
+
+create trigger files_datasets_deleted_count after delete on files_datasets
+    referencing old table as old_rows
+    for each statement execute function files_datasets_deleted_count();
+
 create table queries
 (
     namespace       text references namespaces(name),
@@ -0,0 +1,190 @@
+--
+-- Upgrades an existing database created with the MetaCat 4.1 schema.sql: adds the file lineage and dataset closure tables,
+-- the file count triggers and the total_size columns, and initializes the file counts.
+--
+-- Change experiment_web to the proper web account before running. After this script, populate file_lineage and
+-- datasets_closure from parent_child and datasets_parent_child with:
+--
+--      python tools/build_lineage.py <postgres connection string>
+--
+
+begin;
+
+-- keep the files and their datasets unchanged until the counts are initialized and the triggers are in place
+lock table files, files_datasets in share mode;
+
+alter table namespaces add column if not exists total_size bigint default 0;
+alter table datasets add column if not exists total_size bigint default 0;
+
+create index if not exists files_created_timestamp_id on files(coalesce(created_timestamp, 'epoch'::timestamptz), id);
+
+-- closure of parent_child, maintained by DBFile.add_edges() and DBFile.remove_edges()
+create table if not exists file_lineage
+(
+    ancestor_id     text references files(id),
+    descendant_id   text references files(id),
+    depth           int,            -- number of generations between the files
+    paths           bigint,         -- number of distinct parent/child paths of this length
+    primary key (ancestor_id, descendant_id, depth)
+);
+
+create index if not exists file_lineage_descendant on file_lineage(descendant_id, ancestor_id, depth);
+
+-- closure of datasets_parent_child, maintained by DBDataset.add_child() and DBDataset.remove_child()
+create table if not exists datasets_closure
+(
+    ancestor_namespace      text,
+    ancestor_name           text,
+    descendant_namespace    text,
+    descendant_name         text,
+    paths                   bigint,         -- number of distinct parent/child paths between the datasets
+    foreign key (ancestor_namespace, ancestor_name) references datasets(namespace, name) on delete cascade,
+    foreign key (descendant_namespace, descendant_name) references datasets(namespace, name) on delete cascade,
+    primary key (ancestor_namespace, ancestor_name, descendant_namespace, descendant_name)
+);
+
+create index if not exists datasets_closure_descendant on datasets_closure(descendant_namespace, descendant_name);
+
+--
+-- File counts, see schema.sql
+--
+
+create table if not exists file_count_deltas
+(
+    namespace       text,
+    dataset_name    text,           -- null for namespace counts
+    files           bigint,
+    bytes           bigint
+);
+
+create or replace function files_inserted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select n.namespace, null, count(*), coalesce(sum(n.size), 0)
+            from new_rows n
+            group by n.namespace;
+    return null;
+end $$;
+
+create or replace function files_deleted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select o.namespace, null, -count(*), -coalesce(sum(o.size), 0)
+            from old_rows o
+            group by o.namespace;
+    return null;
+end $$;
+
+-- the files_datasets rows of a deleted file are deleted by the cascade after the file is gone,
+-- so the file is removed from the dataset counts before it is deleted
+create or replace function files_deleting_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select fd.dataset_namespace, fd.dataset_name, -1, -coalesce(old.size, 0)
+            from files_datasets fd
+            where fd.file_id = old.id;
+    return old;
+end $$;
+
+-- namespace or size change
+create or replace function files_updated_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        with deltas as (
+                select o.id, o.namespace, -1 as files, -coalesce(o.size, 0) as bytes
+                    from old_rows o, new_rows n
+                    where o.id = n.id
+                        and (o.namespace, o.size) is distinct from (n.namespace, n.size)
+                union all
+                select n.id, n.namespace, 1, coalesce(n.size, 0)
+                    from old_rows o, new_rows n
+                    where o.id = n.id
+                        and (o.namespace, o.size) is distinct from (n.namespace, n.size)
+            )
+        select d.namespace, null::text, sum(d.files), sum(d.bytes)
+            from deltas d
+            group by d.namespace
+            having sum(d.files) != 0 or sum(d.bytes) != 0
+        union all
+        select fd.dataset_namespace, fd.dataset_name, sum(d.files), sum(d.bytes)
+            from deltas d, files_datasets fd
+            where fd.file_id = d.id
+            group by fd.dataset_namespace, fd.dataset_name
+            having sum(d.files) != 0 or sum(d.bytes) != 0;
+    return null;
+end $$;
+
+create or replace function files_datasets_inserted_count() returns trigger language plpgsql as $$
+begin
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select n.dataset_namespace, n.dataset_name, count(*), coalesce(sum(f.size), 0)
+            from new_rows n, files f
+            where f.id = n.file_id
+            group by n.dataset_namespace, n.dataset_name;
+    return null;
+end $$;
+
+create or replace function files_datasets_deleted_count() returns trigger language plpgsql as $$
+begin
+    -- the rows of deleted files were counted by files_deleting_count()
+    insert into file_count_deltas(namespace, dataset_name, files, bytes)
+        select o.dataset_namespace, o.dataset_name, -count(*), -coalesce(sum(f.size), 0)
+            from old_rows o, files f
+            where f.id = o.file_id
+            group by o.dataset_namespace, o.dataset_name;
+    return null;
+end $$;
+
+drop trigger if exists files_inserted_count on files;
+create trigger files_inserted_count after insert on files
+    referencing new table as new_rows
+    for each statement execute function files_inserted_count();
+
+drop trigger if exists files_deleted_count on files;
+create trigger files_deleted_count after delete on files
+    referencing old table as old_rows
+    for each statement execute function files_deleted_count();
+
+drop trigger if exists files_deleting_count on files;
+create trigger files_deleting_count before delete on files
+    for each row execute function files_deleting_count();
+
+drop trigger if exists files_updated_count on files;
+create trigger files_updated_count after update on files
+    referencing old table as old_rows new table as new_rows
+    for each statement execute function files_updated_count();
+
+drop trigger if exists files_datasets_inserted_count on files_datasets;
+create trigger files_datasets_inserted_count after insert on files_datasets
+    referencing new table as new_rows
+    for each statement execute function files_datasets_inserted_count();
+
+drop trigger if exists files_datasets_deleted_count on files_datasets;
+create trigger files_datasets_deleted_count after delete on files_datasets
+    referencing old table as old_rows
+    for each statement execute function files_datasets_deleted_count();
+
+-- the counts are calculated from scratch, so there are no changes to log in file_count_deltas yet
+update namespaces ns
+    set file_count = coalesce(c.files, 0), total_size = coalesce(c.bytes, 0)
+    from namespaces ns1 left outer join (
+            select f.namespace, count(*) as files, coalesce(sum(f.size), 0) as bytes
+                from files f
+                group by f.namespace
+        ) c on c.namespace = ns1.name
+    where ns.name = ns1.name;
+
+update datasets d
+    set file_count = coalesce(c.files, 0), total_size = coalesce(c.bytes, 0)
+    from datasets d1 left outer join (
+            select fd.dataset_namespace as namespace, fd.dataset_name as name, count(*) as files, coalesce(sum(f.size), 0) as bytes
+                from files_datasets fd, files f
+                where f.id = fd.file_id
+                group by fd.dataset_namespace, fd.dataset_name
+        ) c on c.namespace = d1.namespace and c.name = d1.name
+    where d.namespace = d1.namespace and d.name = d1.name;
+
+grant select, insert, update, delete, truncate, references, trigger on file_lineage, datasets_closure, file_count_deltas to dm_admin;
+grant select, insert, update, delete, truncate, references, trigger on file_lineage, datasets_closure, file_count_deltas to experiment_web;
+
+commit;
@@ -1 +1,2 @@
-from .filters import MetaCatFilter, standard_filters
+from .filters import MetaCatFilter, MetaCatBatchFilter, standard_filters
+from .cache import FilterCache, SQLiteFilterCache, filter_cache
@@ -0,0 +1,183 @@
+import time, pickle
+from threading import RLock
+from collections import OrderedDict
+from contextlib import contextmanager
+from metacat.util import chunked
+
+#
+# Per-item caches of external lookup results for filters, see MetaCatFilter.cached_lookup()
+#
+# Keys are items looked up, e.g. file DIDs or run numbers. Keys which the lookup did not find are cached too,
+# so that they are not looked up again until they expire
+#
+
+class _NotFound(object):
+    pass
+
+NotFound = _NotFound()
+
+class FilterCache(object):
+    #
+    # In-process LRU cache with TTL
+    #
+
+    def __init__(self, capacity=100000, ttl=600):
+        self.Capacity = capacity
+        self.TTL = ttl
+        self.Entries = OrderedDict()        # key -> (expiration, value)
+        self.Lock = RLock()
+        self.Hits = self.Misses = 0
+
+    def get_many(self, keys):
+        # returns dict key -> value (or NotFound) for keys in the cache, and list of keys not in the cache
+        found = {}
+        missing = []
+        now = time.time()
+        with self.Lock:
+            for key in keys:
+                entry = self.Entries.get(key)
+                if entry is not None:
+                    expiration, value = entry
+                    if expiration is None or expiration > now:
+                        self.Entries.move_to_end(key)
+                        found[key] = value
+                        continue
+                    del self.Entries[key]
+                missing.append(key)
+            self.Hits += len(found)
+            self.Misses += len(missing)
+        return found, missing
+
+    def put_many(self, items):
+        # items: dict key -> value (or NotFound)
+        if not self.Capacity:
+            return
+        expiration = None if not self.TTL else time.time() + self.TTL
+        with self.Lock:
+            for key, value in items.items():
+                self.Entries[key] = (expiration, value)
+                self.Entries.move_to_end(key)
+            while len(self.Entries) > self.Capacity:
+                self.Entries.popitem(last=False)
+
+    def clear(self):
+        with self.Lock:
+            self.Entries.clear()
+
+    def stats(self):
+        with self.Lock:
+            return dict(
+                type = "memory",
+                size = len(self.Entries),
+                capacity = self.Capacity,
+                ttl = self.TTL,
+                hits = self.Hits,
+                misses = self.Misses
+            )
+
+
+class SQLiteFilterCache(object):
+    #
+    # Cache stored in an sqlite database file, shared by server processes on the same host.
+    # Values are pickled
+    #
+
+    LookupChunkSize = 500           # below the sqlite limit on the number of parameters in a statement
+
+    def __init__(self, path, capacity=1000000, ttl=600):
+        self.Path = path
+        self.Capacity = capacity
+        self.TTL = ttl
+        self.Lock = RLock()
+        self.Hits = self.Misses = 0
+        with self.transaction() as conn:
+            conn.execute("""create table if not exists filter_cache (
+                    key blob primary key,
+                    expiration real,
+                    value blob
+                )""")
+            conn.execute("create index if not exists filter_cache_expiration on filter_cache(expiration)")
+
+    def connect(self):
+        import sqlite3
+        return sqlite3.connect(self.Path, timeout=10.0)
+
+    @contextmanager
+    def transaction(self):
+        # sqlite3 connection used as a context manager commits or rolls back the transaction, but does not close
+        # the connection, so it is closed here
+        conn = self.connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        now = time.time()
+        with self.transaction() as conn:
+            for chunk in chunked(keys, self.LookupChunkSize):
+                by_pickle = {pickle.dumps(key): key for key in chunk}
+                placeholders = ",".join(["?"] * len(by_pickle))
+                rows = conn.execute(f"""select key, value from filter_cache
+                        where key in ({placeholders}) and (expiration is null or expiration > ?)""",
+                    list(by_pickle) + [now])
+                for pickled_key, pickled_value in rows:
+                    value = pickle.loads(pickled_value)
+                    found[by_pickle[pickled_key]] = NotFound if isinstance(value, _NotFound) else value
+        missing = [k for k in keys if k not in found]
+        with self.Lock:
+            self.Hits += len(found)
+            self.Misses += len(missing)
+        return found, missing
+
+    def put_many(self, items):
+        if not self.Capacity:
+            return
+        now = time.time()
+        expiration = None if not self.TTL else now + self.TTL
+        with self.transaction() as conn:
+            conn.executemany("insert or replace into filter_cache(key, expiration, value) values(?, ?, ?)",
+                [(pickle.dumps(k), expiration, pickle.dumps(v)) for k, v in items.items()])
+            conn.execute("delete from filter_cache where expiration <= ?", (now,))
+            n = conn.execute("select count(*) from filter_cache").fetchone()[0]
+            if n > self.Capacity:
+                conn.execute("""delete from filter_cache where key in
+                        (select key from filter_cache order by expiration limit ?)""", (n - self.Capacity,))
+
+    def clear(self):
+        with self.transaction() as conn:
+            conn.execute("delete from filter_cache")
+
+    def stats(self):
+        with self.transaction() as conn:
+            size = conn.execute("select count(*) from filter_cache").fetchone()[0]
+        with self.Lock:
+            return dict(
+                type = "sqlite",
+                path = self.Path,
+                size = size,
+                capacity = self.Capacity,
+                ttl = self.TTL,
+                hits = self.Hits,
+                misses = self.Misses
+            )
+
+
+def filter_cache(config):
+    # creates the cache from the filter configuration:
+    #   cache:
+    #       capacity: ...       # max number of items
+    #       ttl: ...            # seconds
+    #       sqlite: <path>      # optional, use sqlite database shared by server processes
+    # returns None if the configuration is missing
+    if not config:
+        return None
+    capacity = config.get("capacity")
+    ttl = config.get("ttl", 600)
+    if config.get("sqlite"):
+        return SQLiteFilterCache(config["sqlite"], capacity=capacity or 1000000, ttl=ttl)
+    else:
+        return FilterCache(capacity=capacity or 100000, ttl=ttl)
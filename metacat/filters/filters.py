@@ -1,6 +1,9 @@
-from metacat.db import DBFileSet
-import random
-from metacat.util import strided, limited, skipped
+from metacat.db import DBFileSet, DBFile, alias
+import random, math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metacat.util import strided, limited, skipped, chunked, insert_sql, prefetched
+from .cache import NotFound
 
 #
 # Common filters
@@ -26,8 +29,28 @@ def implement_skip(filter):
 
 class MetaCatFilter(object):
 
-    def __init__(self, show_config=None):
+    def __init__(self, show_config=None, cache=None):
         self.ShowConfig = show_config
+        self.Cache = cache          # FilterCache or SQLiteFilterCache for cached_lookup(), see filters/cache.py
+
+    def cached_lookup(self, keys, lookup):
+        #
+        # keys: iterable of hashable items to look up, e.g. file DIDs
+        # lookup: callable, lookup(list of keys) -> dict key -> value for the keys found
+        # returns dict key -> value for the keys found, using the cache if the filter has one
+        #
+        keys = list(keys)
+        if self.Cache is None:
+            return lookup(keys)
+        found, missing = self.Cache.get_many(keys)
+        if missing:
+            looked_up = lookup(missing)
+            found.update(looked_up)
+            self.Cache.put_many({key: looked_up.get(key, NotFound) for key in missing})
+        return {key: value for key, value in found.items() if value is not NotFound}
+
+    def cache_stats(self):
+        return None if self.Cache is None else self.Cache.stats()
 
     # overridable
     def run(self, inputs, params, kw, limit=None, skip=0,
@@ -49,6 +72,92 @@ class MetaCatFilter(object):
     def filter(self, *params, **kv):
         raise NotImplementedError()
 
+    # overridable
+    def sql(self, inputs, sql_params, *params, **kv):
+        #
+        # SQL rewrite of the filter, used when all the filter inputs are SQL queries
+        # inputs: list of SQL texts, one per input file set
+        # sql_params: SQLParams to bind the parameter values to
+        # params, kv: filter parameters, as for filter()
+        # returns SQL text producing the same columns as the inputs, or None if the filter has to run in Python
+        #
+        return None
+
+class MetaCatBatchFilter(MetaCatFilter):
+    #
+    # Base class for filters which process single input file set in batches, e.g. looking the files up in an external service.
+    # Subclasses implement filter_batch(). While a batch is being processed, the next input batches are fetched
+    # from the database. If concurrency > 1, up to <concurrency> batches are processed at the same time on a thread pool.
+    # The order of output batches follows the order of input batches if the filter is asked for ordered output.
+    #
+
+    def __init__(self, show_config=None, batch_size=1000, prefetch=1, concurrency=1, cache=None):
+        MetaCatFilter.__init__(self, show_config, cache)
+        self.BatchSize = batch_size
+        self.Prefetch = prefetch
+        self.Concurrency = concurrency
+
+    # overridable
+    def filter_batch(self, batch, *params, **kv):
+        # batch: list of DBFile objects
+        # returns list of output files for the batch
+        raise NotImplementedError()
+
+    def filter(self, inputs, *params, ordered=False, **kv):
+        batches = chunked(inputs[0], self.BatchSize)
+        if self.Prefetch:
+            batches = prefetched(batches, self.Prefetch)
+        if self.Concurrency <= 1:
+            for batch in batches:
+                yield from self.filter_batch(batch, *params, **kv)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.Concurrency) as pool:
+            pending = deque()
+            try:
+                for batch in batches:
+                    pending.append(pool.submit(self.filter_batch, batch, *params, **kv))
+                    while len(pending) >= self.Concurrency:
+                        yield from self._next_done(pending, ordered)
+                while pending:
+                    yield from self._next_done(pending, ordered)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def _next_done(pending, ordered):
+        # removes next finished batch from the pending deque and returns its results
+        if ordered:
+            future = pending.popleft()
+        else:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            future = next(iter(finished))
+            pending.remove(future)
+        return future.result()
+
+def file_columns(t):
+    # file columns produced by file query SQL
+    return f"{t}.id, {t}.namespace, {t}.name, {t}.metadata, {DBFile.attr_columns(t)}, {t}.parents, {t}.children"
+
+def numbered_rows_sql(input_sql, condition):
+    # selects the rows of the input satisfying the condition on the 1-based row number {n}
+    t = alias("t")
+    n = alias("n")
+    condition = condition.format(n=f"{t}.{n}")
+    return insert_sql(f"""\
+        -- numbered rows {t}
+            select {file_columns(t)}
+            from (
+                select *, row_number() over () as {n}
+                from (
+                    $input_sql
+                ) {t}_input
+            ) {t}
+            where {condition}
+        -- end of numbered rows {t}
+    """, input_sql=input_sql)
+
 class Sample(MetaCatFilter):
     """
     Inputs: single file set
@@ -56,18 +165,21 @@ class Sample(MetaCatFilter):
     Parameters:
         fraction: floating point number from 0.0 to 1.0
     
-    Output: Randomly picked subset of the input file set
+    Output: Subset of the input file set. The n-th file (1-based) is picked if n*fraction crosses an integer,
+        i.e. floor(n*fraction) > floor((n-1)*fraction)
     """
     
     def filter(self, inputs, fraction, **ignore):
         file_set = inputs[0]
-        x = 0.0
-        for f in file_set:
-            x += fraction
-            if x >= 1.0:
-                x -= 1.0
+        for n, f in enumerate(file_set, 1):
+            # must be in sync with sql()
+            if math.floor(n*fraction) > math.floor((n-1)*fraction):
                 yield f
 
+    def sql(self, inputs, sql_params, fraction, **ignore):
+        fraction = sql_params.bind(float(fraction), "double precision")
+        return numbered_rows_sql(inputs[0], f"floor({{n}}*{fraction}) > floor(({{n}}-1)*{fraction})")
+
 class Limit(MetaCatFilter):
     """
     Inputs: single file set
@@ -101,6 +213,11 @@ class Stride(MetaCatFilter):
             if i % modulo == remainder:
                 yield f
             i += 1
+
+    def sql(self, inputs, sql_params, modulo, remainder, **ignore):
+        modulo = sql_params.bind(int(modulo))
+        remainder = sql_params.bind(int(remainder))
+        return numbered_rows_sql(inputs[0], f"mod({{n}}-1, {modulo}) = {remainder}")
             
 class Hash(MetaCatFilter):
     """
@@ -121,6 +238,29 @@ class Hash(MetaCatFilter):
             r = adler32(f.FID.encode("utf-8")) % modulo
             if r == remainder:
                 yield f
+
+    def sql(self, inputs, sql_params, modulo, remainder, **ignore):
+        # Adler32 of the UTF-8 bytes b[0]...b[n-1] of the id is B*65536 + A, where
+        #   A = (1 + sum(b[i])) % 65521
+        #   B = (n + sum((n-i)*b[i])) % 65521
+        t = alias("t")
+        b = alias("b")
+        modulo = sql_params.bind(int(modulo))
+        remainder = sql_params.bind(int(remainder))
+        input_sql = inputs[0]
+        return insert_sql(f"""\
+            -- hash {t}
+                select {t}.*
+                from (
+                    $input_sql
+                ) {t}, lateral (select convert_to({t}.id, 'UTF8') as bytes) {b}
+                where mod((
+                        select mod(length({b}.bytes) + coalesce(sum((length({b}.bytes) - i) * get_byte({b}.bytes, i)), 0), 65521) * 65536
+                            + mod(1 + coalesce(sum(get_byte({b}.bytes, i)), 0), 65521)
+                        from generate_series(0, length({b}.bytes) - 1) i
+                    ), {modulo}) = {remainder}
+            -- end of hash {t}
+        """, input_sql=input_sql)
                 
 class Randomize(MetaCatFilter):
     
@@ -147,6 +287,21 @@ class Randomize(MetaCatFilter):
         for f in saved:
             if f is not None:
                 yield f
+
+    def sql(self, inputs, sql_params, seed=None, **ignore):
+        # the whole set is shuffled, so the window is not used
+        t = alias("t")
+        order = "random()" if seed is None else f"md5({t}.id || {sql_params.bind(str(seed))})"
+        input_sql = inputs[0]
+        return insert_sql(f"""\
+            -- randomize {t}
+                select {t}.*
+                from (
+                    $input_sql
+                ) {t}
+                order by {order}
+            -- end of randomize {t}
+        """, input_sql=input_sql)
             
 class Mix(MetaCatFilter):
     """
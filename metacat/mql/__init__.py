@@ -1 +1,3 @@
 from .mql10 import MQLQuery, MQLSyntaxError, MQLCompilationError, MQLExecutionError, MQLError
+from .plan_cache import plan_cache, PlanCache
+from .explain import QueryProfile, QueryExplainer
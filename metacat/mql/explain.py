@@ -0,0 +1,182 @@
+import time
+from contextlib import contextmanager
+from metacat.common.trees import Node
+from metacat.db import DBFileSet
+from .query_executor import FileQueryExecutor
+
+#
+# Query diagnostics for data/query?explain=plan|analyze
+#
+
+class QueryProfile(object):
+    #
+    # Wall clock time spent in the query processing phases: parsing, optimizer passes, compilation, execution
+    #
+
+    def __init__(self):
+        self.Phases = []            # [(phase name, seconds), ...] in the order of completion
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.Phases.append((name, time.time() - t0))
+
+    def as_jsonable(self):
+        return [dict(phase=name, time=t) for name, t in self.Phases]
+
+
+class _NoProfile(QueryProfile):
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+NoProfile = _NoProfile()
+
+
+def _jsonable(v):
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    elif isinstance(v, (list, tuple)):
+        return [_jsonable(x) for x in v]
+    elif isinstance(v, dict):
+        return {str(k): _jsonable(x) for k, x in v.items()}
+    else:
+        return str(v)
+
+
+class _NodeStats(object):
+
+    def __init__(self, node):
+        self.Node = node
+        self.Children = []
+        self.Rows = None            # None if the node output was not consumed
+        self.Time = 0.0             # time spent producing the node output, including the time spent in its inputs
+        self.Explain = None         # Postgres EXPLAIN output for SQL nodes
+
+    def counted(self, files):
+        self.Rows = 0
+        t0 = time.time()
+        it = iter(files)
+        self.Time += time.time() - t0
+        while True:
+            t0 = time.time()
+            try:
+                f = next(it)
+            except StopIteration:
+                break
+            finally:
+                self.Time += time.time() - t0
+            self.Rows += 1
+            yield f
+
+    def walk(self):
+        yield self
+        for c in self.Children:
+            yield from c.walk()
+
+    def as_jsonable(self):
+        node = self.Node
+        out = dict(
+            node = node.T,
+            rows = self.Rows,
+            time = self.Time,
+            self_time = max(0.0, self.Time - sum(c.Time for c in self.Children)),
+            children = [c.as_jsonable() for c in self.Children]
+        )
+        if node.T == "sql":
+            out["sql"] = node["sql"]
+            params = node.get("params")
+            out["params"] = _jsonable(dict(params)) if params else {}
+            out["explain"] = self.Explain
+        else:
+            out["data"] = {name: _jsonable(v) for name, v in node.D.items() if not isinstance(v, Node)}
+        return out
+
+
+class _ProfilingExecutor(FileQueryExecutor):
+
+    # FileQueryExecutor which counts rows and time flowing out of each tree node
+
+    def __init__(self, db, filters):
+        FileQueryExecutor.__init__(self, db, filters)
+        self.Stack = []
+        self.Root = None
+
+    def _walk(self, node, debug=False):
+        if not isinstance(node, Node):
+            return FileQueryExecutor._walk(self, node, debug)
+        stats = _NodeStats(node)
+        if self.Stack:
+            self.Stack[-1].Children.append(stats)
+        else:
+            self.Root = stats
+        self.Stack.append(stats)
+        try:
+            out = FileQueryExecutor._walk(self, node, debug)
+        finally:
+            self.Stack.pop()
+        if isinstance(out, DBFileSet):
+            out = DBFileSet(self.DB, stats.counted(out))
+        return out
+
+
+class QueryExplainer(object):
+    #
+    # analyze=False: returns the compiled tree with Postgres EXPLAIN output for each SQL node. Nothing is executed
+    # analyze=True:  runs the query, counting rows and time for each tree node, then runs EXPLAIN ANALYZE for each SQL node.
+    #                Note that EXPLAIN ANALYZE executes the SQL once again
+    #
+
+    def __init__(self, db, filters={}, analyze=False):
+        self.DB = db
+        self.Filters = filters
+        self.Analyze = analyze
+
+    def explain_sql(self, sql, params):
+        options = "analyze, buffers, format json" if self.Analyze else "format json"
+        c = self.DB.cursor()
+        c.execute(f"explain ({options})\n{sql}", params or None)
+        return c.fetchone()[0]
+
+    def plan_stats(self, node):
+        stats = _NodeStats(node)
+        for c in list(node.D.values()) + list(node.C):
+            if isinstance(c, Node):
+                stats.Children.append(self.plan_stats(c))
+        return stats
+
+    def __call__(self, compiled, profile=NoProfile):
+        # returns the tree of _NodeStats
+        if self.Analyze:
+            executor = _ProfilingExecutor(self.DB, self.Filters)
+            with profile.phase("execution"):
+                for _ in executor(compiled):
+                    pass
+            stats = executor.Root
+        else:
+            stats = self.plan_stats(compiled)
+        with profile.phase("explain"):
+            for s in stats.walk():
+                if s.Node.T == "sql":
+                    s.Explain = self.explain_sql(s.Node["sql"], s.Node.get("params"))
+        return stats
+
+    def explain(self, compiled, profile=None):
+        profile = profile or QueryProfile()
+        stats = self(compiled, profile)
+        all_stats = list(stats.walk())
+        out = dict(
+            mode = "analyze" if self.Analyze else "plan",
+            phases = profile.as_jsonable(),
+            plan = stats.as_jsonable()
+        )
+        if self.Analyze:
+            out["rows"] = stats.Rows
+            out["sql_time"] = sum(s.Time for s in all_stats if s.Node.T == "sql")
+            out["filter_time"] = sum(s.Time - sum(c.Time for c in s.Children)
+                                    for s in all_stats if s.Node.T in ("filter", "meta_filter"))
+        return out
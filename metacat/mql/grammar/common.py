@@ -6,17 +6,17 @@ Common = """
 
 qualified_name:     (FNAME ":")? FNAME
 
-qualified_name_list:   qualified_name ("," qualified_name)*
+qualified_name_list:   qualified_name (_LIST_COMMA qualified_name)*
 
 ?did:    FNAME ":" FNAME
 
-fid_list:  FID ("," FID)*
+fid_list:  FID (_LIST_COMMA FID)*
 
 //?did_list:  did ("," did)*
 
-param_def_list :  param_def ("," param_def)*
+param_def_list :  param_def (("," | _PARAMS_COMMA) param_def)*
 
-param_def: FNAME "=" constant
+param_def: PARAM_NAME "=" constant
 
 ?meta_exp:   meta_or                                                           
 
@@ -26,13 +26,13 @@ meta_and:   term_meta ( "and" term_meta )*
 
 ?term_meta:  scalar CMPOP constant                  -> cmp_op
     | scalar "in" constant ":" constant             -> in_range
-    | scalar "not" "in" constant ":" constant       -> not_in_range
+    | scalar _NOT_IN constant ":" constant          -> not_in_range
     | scalar "in" "(" constant_list ")"             -> in_set
-    | scalar "not" "in" "(" constant_list ")"       -> not_in_set
+    | scalar _NOT_IN "(" constant_list ")"          -> not_in_set
     | META_NAME "present"                               -> present                   
-    | META_NAME "not" "present"                         -> not_present                   
+    | META_NAME _NOT_PRESENT                            -> not_present                   
     | constant "in" META_NAME                           -> constant_in
-    | constant "not" "in" META_NAME                     -> constant_not_in
+    | constant _NOT_IN META_NAME                        -> constant_not_in
     | "(" meta_exp ")"                              
     | "!" term_meta                                 -> meta_not
     | "exists" STRING                               -> json_path
@@ -64,11 +64,23 @@ FNAME: ("_"|"-"|"."|LETTER|DIGIT|"/")+
 
 FID: ("_"|"-"|"."|LETTER|DIGIT|"/")+
 
+PARAM_NAME.2: /[a-z0-9_.\\/-]+(?=\\s*=(?!=))/i
+
+// comma separating names or file ids in a list, unless it is followed by the next file query in a query list
+_LIST_COMMA.2: /,(?!\\s*((files?|fids?)\\s+[^\\s:,]|filter\\s|(union|join|parents|children|ancestors|descendants)\\s*\\(|[\\[{(]))/i
+
 WORD: LETTER ("_"|LETTER|DIGIT)*
 
 CMPOP:  "<" "="? | "!"? "=" "="? | "!"? "~" "*"? | ">" "="? | "like"            //# like is not implemented yet
 
-BOOL: "true"i | "false"i
+// "not in" and "not present" are single terminals so that the parser does not need to look past "not"
+_NOT_IN: /not\\s+in\\b/
+_NOT_PRESENT: /not\\s+present\\b/
+
+// numbers and booleans must not be followed by characters which would make them an unquoted string, e.g. 12abc
+BOOL.2: /(true|false)(?![a-z0-9$@_.-])/i
+SIGNED_INT.2: /[+-]?\\d+(?![a-z0-9$@_.-])/i
+SIGNED_FLOAT.3: /[+-]?((\\d+\\.\\d*|\\.\\d+)(e[+-]?\\d+)?|\\d+e[+-]?\\d+)(?![a-z0-9$@_.-])/i
 
 STRING : /("(?!"").*?(?<!\\\\)(\\\\\\\\)*?"|'(?!'').*?(?<!\\\\)(\\\\\\\\)*?')/i
 SAFE_CHARACTER : /[a-z0-9$@_.-]/i
@@ -77,8 +89,6 @@ PATTERN_CHARACTER : (SAFE_CHARACTER|/[*?^%]/)
 PATTERN : PATTERN_CHARACTER+
 
 %import common.CNAME
-%import common.SIGNED_INT
-%import common.SIGNED_FLOAT
 
 %import common.WS
 %import common.LETTER
@@ -2,7 +2,10 @@ DatasetQuery = """
 
 top_dataset_query       :    "datasets" dataset_query_list
 
-dataset_query_list: dataset_query ("," dataset_query)*            -> dataset_query_list
+dataset_query_list: dataset_query (_DATASET_COMMA dataset_query)*            -> dataset_query_list
+
+// comma followed by another dataset specification, as opposed to the comma separating file queries in a list
+_DATASET_COMMA.2: /,(?=\\s*(matching\\s|[a-z0-9_.\\/-]+\\s*:))/i
 
 ?dataset_query   :    dataset_query_with_subsets
     | dataset_query_with_subsets "having" meta_exp          -> dataset_add_where
@@ -2,8 +2,17 @@ FileQuery = """
 
 top_file_query          :    file_query
 
+// limit, skip and ordered apply to the whole query on the left of them, "where" following them too.
+// Otherwise, "where" applies to the single file_query_exression on the left
+
 ?file_query: meta_filter                                  
     | file_query "-" meta_filter                          -> minus
+    | file_query_postfix
+    | file_query_postfix "where" meta_exp                 -> meta_filter
+
+?file_query_postfix: file_query "limit" SIGNED_INT      -> limit              
+    |   file_query "skip" SIGNED_INT                     -> skip
+    |   file_query "ordered"                             -> ordered
 
 ?meta_filter: file_query_exression "where" meta_exp     
     |   file_query_exression                             
@@ -15,9 +24,8 @@ top_file_query          :    file_query
     |   "{" file_query_list "}"                          -> join
     |   "parents" "(" file_query ")"                     -> parents_of
     |   "children" "(" file_query ")"                    -> children_of
-    |   file_query "limit" SIGNED_INT                    -> limit              
-    |   file_query "skip" SIGNED_INT                     -> skip
-    |   file_query "ordered"                             -> ordered
+    |   "ancestors" "(" file_query lineage_depth? ")"    -> ancestors_of
+    |   "descendants" "(" file_query lineage_depth? ")"  -> descendants_of
     |   "(" file_query ")"           
 
 file_query_term: "files" ("from" "datasets"? dataset_query_list)?                   -> basic_file_query
@@ -29,12 +37,20 @@ file_query_term: "files" ("from" "datasets"? dataset_query_list)?
     |   ("files"|"file") qualified_name_list
 
 filter_params : params_list
-    |   (params_list ",")? param_def_list
+    |   (params_list _PARAMS_COMMA)? param_def_list
 
 params_list : constant_list         // convert date, datetime to floats
 
 file_query_list: file_query ("," file_query)*     
 
+lineage_depth: _DEPTH_COMMA "depth" "=" SIGNED_INT
+
+// comma between positional and keyword filter parameters
+_PARAMS_COMMA.2: /,(?=\\s*[a-z0-9_.\\/-]+\\s*=(?!=))/i
+
+// comma before the ancestors/descendants depth limit
+_DEPTH_COMMA.3: /,(?=\\s*depth\\s*=)/i
+
 // file attributes
 FILE_ATTR_NAME: ("id" | "namespace" | "name" | "creator" | "updated_by" | "created_timestamp" | "updated_timestamp" | "retired" | "retired_by" | "retired_timestamp" | "checksums" )
 
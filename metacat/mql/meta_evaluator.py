@@ -1,6 +1,30 @@
-import re, traceback
+import re, traceback, operator
 from metacat.common import FileAttributes
 
+_FileAttributeGetters = {
+    "creator":              lambda f: f.Creator,
+    "created_timestamp":    lambda f: f.CreatedTimestamp.epoch(),
+    "name":                 lambda f: f.Name,
+    "namespace":            lambda f: f.Namespace,
+    "size":                 lambda f: f.Size,
+    "retired":              lambda f: f.Retired,
+    "retired_by":           lambda f: f.RetiredBy,
+    "retired_timestamp":    lambda f: f.RetiredTimestamp,
+    "updated_by":           lambda f: f.UpdatedBy,
+    "updated_timestamp":    lambda f: f.UpdatedTimestamp,
+    "checksums":            lambda f: f.Checksums
+}
+
+_CmpOps = {
+    "<":    operator.lt,
+    ">":    operator.gt,
+    "<=":   operator.le,
+    ">=":   operator.ge,
+    "=":    operator.eq,
+    "==":   operator.eq,
+    "!=":   operator.ne
+}
+
 class MetaEvaluator(object):
 
     BOOL_OPS = ("and", "or", "not")
@@ -240,6 +264,131 @@ class MetaEvaluator(object):
             raise ValueError("Invalid comparison operator '%s'" % (op,))
         
         
+    #
+    # Compilation of meta expression into a Python closure f -> bool. The closure does the same as
+    # evaluate_meta_expression, but the tree is walked, the sets are built and the regular expressions are compiled
+    # only once per query instead of once per file
+    #
+
+    def compile(self, meta_expression):
+        op, args = meta_expression.T, meta_expression.C
+        if op in ("meta_and", "meta_or") and len(args) == 1:
+            return self.compile(args[0])
+        if op in ("and", "meta_and"):
+            parts = [self.compile(a) for a in args]
+            def meta_and(f):
+                for p in parts:
+                    if not p(f):
+                        return False
+                return True
+            return meta_and
+        elif op in ("or", "meta_or"):
+            parts = [self.compile(a) for a in args]
+            def meta_or(f):
+                for p in parts:
+                    if p(f):
+                        return True
+                return False
+            return meta_or
+        elif op == "not":
+            assert len(args) == 1
+            part = self.compile(args[0])
+            return lambda f: not part(f)
+        elif op in ("present", "not_present"):
+            name = meta_expression["name"]
+            if op == "present":
+                return lambda f: name in f.metadata()
+            else:
+                return lambda f: name not in f.metadata()
+        elif op in ("in_set", "not_in_set"):
+            neg = meta_expression.get("neg", False) != (op == "not_in_set")
+            vset = set(meta_expression.get("set", []))
+            return self.compile_predicate(args[0], self.compile_in_set(vset), neg, neg)
+        elif op in ("in_range", "not_in_range"):
+            neg = meta_expression.get("neg", False) != (op == "not_in_range")
+            low, high = meta_expression["low"], meta_expression["high"]
+            return self.compile_predicate(args[0], lambda v: v >= low and v <= high, neg, neg)
+        elif op == "cmp_op":
+            left, right = args
+            cmp = self.compile_cmp_op(meta_expression["op"], right["value"])
+            neg = meta_expression.get("neg", False) if left.T == "array_any" else False
+            return self.compile_predicate(left, cmp, neg, False)
+        else:
+            def invalid(f):
+                raise ValueError("Invalid expression:\n"+meta_expression.pretty())
+            return invalid
+
+    def compile_in_set(self, vset):
+        def in_set(v):
+            try:    return v in vset
+            except TypeError:
+                return False        # unhashable value
+        return in_set
+
+    def compile_cmp_op(self, op, y):
+        if op in ("~", "!~", "~*", "!~*"):
+            negated = op[0] == '!'
+            r = re.compile(y, re.IGNORECASE if op[-1] == '*' else 0)
+            return lambda x: (r.search(x) is not None) != negated
+        cmp = _CmpOps.get(op)
+        if cmp is None:
+            raise ValueError("Invalid comparison operator '%s'" % (op,))
+        return lambda x: cmp(x, y)
+
+    def compile_predicate(self, left, predicate, neg, missing):
+        # returns closure f -> predicate(<value of the left side>) != neg
+        # missing: result if the attribute is not in the metadata, for array operations
+        # neg is returned if the value can not be obtained or compared
+        aname = left["name"]
+        if left.T in ("scalar", "meta_attribute"):
+            def evaluate(f):
+                metadata = f.metadata()
+                if aname not in metadata:
+                    return neg
+                try:    return predicate(metadata[aname]) != neg
+                except: return neg
+        elif left.T == "object_attribute":
+            getter = _FileAttributeGetters.get(aname, lambda f: None)
+            def evaluate(f):
+                try:    return predicate(getter(f)) != neg
+                except: return neg
+        elif left.T == "array_any":
+            def evaluate(f):
+                lst = f.metadata().get(aname)
+                if lst is None:
+                    return missing
+                if isinstance(lst, dict):
+                    lst = lst.values()
+                elif not isinstance(lst, list):
+                    return neg
+                for x in lst:
+                    try:
+                        if predicate(x):
+                            return not neg
+                    except:
+                        pass
+                return neg
+        elif left.T in ("array_subscript", "subscript"):
+            inx = left["index"]
+            def evaluate(f):
+                lst = f.metadata().get(aname)
+                if lst is None:
+                    return missing
+                try:    return predicate(lst[inx]) != neg
+                except: return neg
+        elif left.T == "array_length":
+            def evaluate(f):
+                lst = f.metadata().get(aname)
+                if lst is None:
+                    return missing
+                if not isinstance(lst, list):
+                    return neg
+                try:    return predicate(len(lst)) != neg
+                except: return neg
+        else:
+            raise ValueError("Unsupported left side of the expression: %s" % (left.T,))
+        return evaluate
+
     @staticmethod
     def evaluate(meta, exp):
         return MetaEvaluator().evaluate_meta_expression(meta, exp)
@@ -1,11 +1,13 @@
 import json, time, pprint, traceback
-from metacat.db import DBDataset, DBFile, DBNamedQuery, DBFileSet
-from metacat.util import limited, unique
+from metacat.db import DBDataset, DBFile, DBNamedQuery, DBFileSet, alias_scope
+from metacat.util import limited, unique, SQLParams
 from metacat.common.trees import Node, Ascender, Descender, Converter
 from metacat.common import FileMetaExpressionDNF
 from .sql_converter import SQLConverter
 from .query_executor import FileQueryExecutor
 from .meta_evaluator import MetaEvaluator
+from .plan_cache import plan_cache, PlanCache
+from .explain import QueryProfile, QueryExplainer, NoProfile
 from datetime import date, datetime, timezone
 
 from lark import Lark, LarkError
@@ -14,7 +16,7 @@ from lark import Tree, Token
 CMP_OPS = [">" , "<" , ">=" , "<=" , "==" , "=" , "!=", "~~", "~~*", "!~~", "!~~*"]
 
 from .grammar import MQL_Grammar
-_Parser = Lark(MQL_Grammar, start="query")
+_Parser = Lark(MQL_Grammar, start="query", parser="lalr", cache=True)
 
 class MQLError(Exception):
 
@@ -47,7 +49,8 @@ def _merge_skip_limit(existing_skip, existing_limit, skip=0, limit=None):
 class _QueryQueryCompiler(Ascender):
 
     def basic_query_query(self, node, *args, query=None):
-        return Node("sql", sql=DBNamedQuery.sql_for_bqq(query))
+        params = SQLParams()
+        return Node("sql", sql=DBNamedQuery.sql_for_bqq(query, params), params=params)
 
 class _QueryQueryExecutor(Ascender):
     
@@ -55,8 +58,8 @@ class _QueryQueryExecutor(Ascender):
         Ascender.__init__(self)
         self.DB = db
 
-    def sql(self, node, sql=None):
-        return DBNamedQuery.queries_from_sql(self.DB, sql)
+    def sql(self, node, sql=None, params=None):
+        return DBNamedQuery.queries_from_sql(self.DB, sql, params)
 
 class QueryQuery(object):
     
@@ -78,8 +81,9 @@ class _DatasetQueryCompiler(Ascender):
 
     def dataset_query_list(self, node, *args):
         queries = [a["query"] for a in args]
-        sql = DBDataset.sql_for_bdqs(queries)
-        return Node("sql", sql=sql)
+        params = SQLParams()
+        sql = DBDataset.sql_for_bdqs(queries, params)
+        return Node("sql", sql=sql, params=params)
 
 class _DatasetQueryExecutor(Ascender):
     
@@ -87,8 +91,8 @@ class _DatasetQueryExecutor(Ascender):
         Ascender.__init__(self)
         self.DB = db
 
-    def sql(self, node, sql=None):
-        return DBDataset.datasets_from_sql(self.DB, sql)
+    def sql(self, node, sql=None, params=None):
+        return DBDataset.datasets_from_sql(self.DB, sql, params)
 
 class DatasetQuery(object):
     
@@ -99,7 +103,9 @@ class DatasetQuery(object):
         self.Compiled = None
 
     def compile(self, with_meta=False, with_provenance=False):
-        self.Compiled = self.Compiled or _DatasetQueryCompiler()(self.Tree)
+        if self.Compiled is None:
+            with alias_scope("q"):
+                self.Compiled = _DatasetQueryCompiler()(self.Tree)
         return self.Compiled
 
     def run(self, db, debug=False, **ignore):
@@ -115,6 +121,8 @@ class FileQuery(object):
         self.Tree = tree
         self.Assembled = self.Optimized = self.Compiled = None
         self.IncludeRetired = include_retired
+        self.References = set()             # named queries and datasets used by the query, see PlanCache
+        self.Plan = self.PlanOptions = None     # compiled tree and the options it was compiled with
 
     def __str__(self):
         return "FileQuery(\n%s\n)" % (self.Tree.pretty("  "),)
@@ -124,7 +132,7 @@ class FileQuery(object):
             self.Assembled = self.Tree
         return self.Assembled
 
-    def optimize(self, debug=False, skip=0, limit=None):
+    def optimize(self, debug=False, skip=0, limit=None, profile=NoProfile):
         if self.Optimized is None:
             #print("Query.optimize: assembled:----\n", self.Assembled.pretty())
 
@@ -139,18 +147,21 @@ class FileQuery(object):
             #    print(optimized.pretty("    "))
                 
             #print("starting _MetaExpPusher...")
-            optimized = _MetaExpPusher().walk(optimized, None)
+            with profile.phase("optimize: MetaExpPusher"):
+                optimized = _MetaExpPusher().walk(optimized, None)
             if debug:
                 print("Query.optimize: after _MetaExpPusher:----")
                 print(optimized.pretty("    "))
 
-            optimized = _RemoveEmpty().walk(optimized, debug)
+            with profile.phase("optimize: RemoveEmpty"):
+                optimized = _RemoveEmpty().walk(optimized, debug)
             if debug:
                 print("Query.optimize: after _RemoveEmpty:----")
                 print(optimized.pretty("    "))
             
             #print("Query.optimize(): calling second _SkipLimitApplier: skip=", skip, "   limit=", limit)
-            optimized = _SkipLimitApplier().walk(optimized, skip, limit)
+            with profile.phase("optimize: SkipLimitApplier"):
+                optimized = _SkipLimitApplier().walk(optimized, skip, limit)
             if debug:
                 print("Query.optimize: after 2nd _SkipLimitApplier:----")
                 print(optimized.pretty("    "))
@@ -163,17 +174,48 @@ class FileQuery(object):
             self.Optimized = optimized
         return self.Optimized
 
-    def compile(self, db=None, skip=0, limit=None, with_meta=False, with_provenance=False, debug=False):
+    def compile(self, db=None, skip=0, limit=None, with_meta=False, with_provenance=False, debug=False,
+                page_size=None, page_after=None, profile=NoProfile, as_json=False, columns=None, filters={}):
+        # page_size, page_after: keyset pagination in (created_timestamp, id) order.
+        #   page_after is (created_timestamp, fid) of the last file of the previous page, see DBFileSet.parse_continuation_token()
+        # as_json: the compiled query will produce JSON text for each file instead of DBFile objects
+        # columns: list of file attributes and metadata keys. The compiled query will produce batches of rows
+        #   with these values instead of DBFile objects
+        # filters: filters by name. Filters which have SQL rewrites are converted to SQL if their inputs are SQL
         try:
-            optimized = self.optimize(debug=debug, skip=skip, limit=limit)
-            optimized = _QueryOptionsApplier().walk(optimized, 
-                dict(
-                    with_provenance = with_provenance,
-                    with_meta = with_meta
-                ))
-            if debug:
-                print("after _QueryOptionsApplier:", optimized.pretty())
-            self.Compiled = compiled = SQLConverter(db, debug=debug, include_retired=self.IncludeRetired)(optimized)
+            plan_options = (skip, limit, with_meta, with_provenance, tuple(sorted(filters)))
+            if self.Plan is not None and self.PlanOptions == plan_options:
+                compiled = self.Plan
+            else:
+                optimized = self.optimize(debug=debug, skip=skip, limit=limit, profile=profile)
+                with profile.phase("compile: QueryOptionsApplier"):
+                    optimized = _QueryOptionsApplier().walk(optimized, 
+                        dict(
+                            with_provenance = with_provenance,
+                            with_meta = with_meta
+                        ))
+                if debug:
+                    print("after _QueryOptionsApplier:", optimized.pretty())
+                with profile.phase("compile: SQLConverter"), alias_scope("q"):
+                    compiled = SQLConverter(db, debug=debug, include_retired=self.IncludeRetired, filters=filters)(optimized)
+                self.Plan, self.PlanOptions = compiled, plan_options
+            # the plan may come from the cache, so the SQL wrapped around it uses its own alias scopes
+            if page_size is not None or page_after is not None:
+                with alias_scope("p"):
+                    compiled = SQLConverter(db, debug=debug, include_retired=self.IncludeRetired)(
+                        Node("page", [compiled], after=page_after, limit=page_size)
+                    )
+            if as_json:
+                with alias_scope("j"):
+                    compiled = SQLConverter(db, debug=debug, include_retired=self.IncludeRetired)(
+                        Node("json_rows", [compiled], with_meta=with_meta, with_provenance=with_provenance)
+                    )
+            elif columns:
+                with alias_scope("c"):
+                    compiled = SQLConverter(db, debug=debug, include_retired=self.IncludeRetired)(
+                        Node("project", [compiled], columns=columns)
+                    )
+            self.Compiled = compiled
         except Exception as e:
             raise MQLCompilationError(traceback.format_exc(limit=-1))
 
@@ -182,19 +224,47 @@ class FileQuery(object):
 
         return compiled
 
-    def run(self, db=None, filters={}, skip=0, limit=None, with_meta=True, with_provenance=True, debug=False):
+    def run(self, db=None, filters={}, skip=0, limit=None, with_meta=True, with_provenance=True, debug=False, itersize=None,
+                page_size=None, page_after=None, as_json=False, columns=None, connect=None, parallelism=1):
+        # as_json: return iterable of JSON texts, one per file in DBFile.to_jsonable() format, instead of DBFileSet.
+        #   If the query is converted to SQL entirely, the JSON is built by the database
+        # columns: list of file attributes and metadata keys. Returns iterable of lists of row tuples with
+        #   the values in the columns order instead of DBFileSet, see DBFileSet.ColumnAttributes
+        # connect: callable returning new DB connection. If given, up to parallelism branches of union and join
+        #   are executed concurrently, each with its own connection
 
         compiled = self.compile(db=db, 
                     skip=skip, limit=limit, 
                     with_meta=with_meta, with_provenance=with_provenance,
-                    debug=debug)
+                    debug=debug, page_size=page_size, page_after=page_after, as_json=as_json, columns=columns,
+                    filters=filters)
+        bound = page_size if page_size is not None else limit
+        if itersize and bound is not None and bound <= itersize:
+            # the result fits in one fetch, so there is no need for a server-side cursor, which would
+            # prevent the use of a prepared statement
+            itersize = None
         try:
-            result = FileQueryExecutor(db, filters, debug=debug)(compiled)
+            result = FileQueryExecutor(db, filters, debug=debug, itersize=itersize, 
+                                connect=connect, parallelism=parallelism)(compiled)
         except Exception as e:
             raise MQLExecutionError(str(e))
-        assert isinstance(result, DBFileSet)
+        if not as_json and not columns:
+            assert isinstance(result, DBFileSet)
         return result
 
+    def explain(self, db, filters={}, analyze=False, skip=0, limit=None, with_meta=True, with_provenance=True, profile=None):
+        # analyze=False: compile the query and EXPLAIN its SQL without running it
+        # analyze=True:  run the query, collecting row counts and times for each node of the compiled tree,
+        #                and EXPLAIN ANALYZE its SQL
+        # returns JSON-able dictionary, see QueryExplainer
+        profile = profile or QueryProfile()
+        compiled = self.compile(db=db, skip=skip, limit=limit, with_meta=with_meta, with_provenance=with_provenance,
+                    profile=profile, filters=filters)
+        try:
+            return QueryExplainer(db, filters, analyze=analyze).explain(compiled, profile)
+        except Exception as e:
+            raise MQLExecutionError(str(e))
+
 class _OrderedApplier(Descender):
     
     def walk(self, tree, ordered=False):
@@ -216,6 +286,8 @@ class _OrderedApplier(Descender):
     def children_of(self, node, ordered):
         return node.clone(ordered=ordered or node.get("ordered"))
 
+    ancestors_of = descendants_of = children_of
+
     basic_dataset_query = basic_file_query
 
     def skip_limit(self, node, ordered):
@@ -410,7 +482,7 @@ class _QueryOptionsApplier(Descender):
         new_params["with_provenance"] = True
         return self.visit_children(node, new_params)
         
-    children_of = parents_of
+    children_of = ancestors_of = descendants_of = parents_of
 
     def filter(self, node, params):
         # the filter may need metadata but probably not provenance
@@ -459,7 +531,7 @@ class _MetaExpPusher(Descender):
             #
             return Node("meta_filter", query=self.visit_children(node, None), meta_exp=meta_exp)
         
-    parents_of = children_of
+    parents_of = ancestors_of = descendants_of = children_of
     
     def meta_filter(self, node, meta_exp):
         child = node["query"]
@@ -670,7 +742,7 @@ class Orderer(Descender):
     def filter(self, node, _):
         return node.clone(ordered = True)
 
-    parents_of = children_of = filter
+    parents_of = children_of = ancestors_of = descendants_of = filter
     
     def _done(self, node, _):
         return node
@@ -696,6 +768,7 @@ class QueryConverter(Converter):
         self.DB = db
         self.Loader = loader
         self.DefaultNamespace = default_namespace
+        self.References = set()         # ("query", namespace, name) and ("dataset", namespace)
 
     def convert(self, tree):
         q = self.transform(tree)
@@ -910,6 +983,7 @@ class QueryConverter(Converter):
         (q,) = args
         namespace = q["namespace"] or self.DefaultNamespace
         name = q["name"]
+        self.References.add(("query", namespace, name))
         if self.DB is not None:
             loaded = MQLQuery.from_db(self.DB, namespace, name, convert=False)
         else:
@@ -968,6 +1042,20 @@ class QueryConverter(Converter):
                 others.append(a)
         return Node("join", joins + others)
 
+    def lineage_depth(self, args):
+        assert len(args) == 1
+        return int(args[0].value)
+
+    def ancestors_of(self, args):
+        assert len(args) in (1, 2)
+        depth = args[1] if len(args) == 2 else None
+        return Node("ancestors_of", [args[0]], depth=depth)
+
+    def descendants_of(self, args):
+        assert len(args) in (1, 2)
+        depth = args[1] if len(args) == 2 else None
+        return Node("descendants_of", [args[0]], depth=depth)
+
     def params_list(self, args):
         # convert date, datetime to floats
         assert len(args) == 1 and args[0].T == "constant_list"
@@ -1310,6 +1398,7 @@ class QueryConverter(Converter):
         assert name_or_pattern.T in ("did", "sql_pattern", "regexp_pattern")
         name = name_or_pattern["name"]
         namespace = name_or_pattern.get("namespace") or self.DefaultNamespace
+        self.References.add(("dataset", namespace))
         query = BasicDatasetQuery(namespace, name, pattern=pattern, regexp=regexp)
         return Node("basic_dataset_query", query=query)
         
@@ -1355,20 +1444,25 @@ class QueryConverter(Converter):
 class MQLQuery(object):
     
     @staticmethod
-    def parse(text, db=None, loader=None, debug=False, convert=True, default_namespace=None, include_retired_files=None):
+    def parse(text, db=None, loader=None, debug=False, convert=True, default_namespace=None, include_retired_files=None,
+                profile=NoProfile):
         out = []
         for l in text.split("\n"):
             l = l.split('#', 1)[0]
             out.append(l)
         text = '\n'.join(out)
         try:
-            parsed = _Parser.parse(text)
+            with profile.phase("parse"):
+                parsed = _Parser.parse(text)
             #print("parsed:\n", parsed.pretty())
             if convert:
-                converted = QueryConverter(db=db, loader=loader, default_namespace=default_namespace).convert(parsed)
+                converter = QueryConverter(db=db, loader=loader, default_namespace=default_namespace)
+                with profile.phase("convert"):
+                    converted = converter.convert(parsed)
                 #print("converted:\n", converted.pretty())
                 if converted.T == "top_file_query":
                     q = FileQuery(converted.C[0], include_retired_files)
+                    q.References = converter.References
                 elif converted.T == "top_dataset_query":
                     q = DatasetQuery(converted.C[0])
                 else:
@@ -1380,6 +1474,28 @@ class MQLQuery(object):
         except LarkError as e:
             raise MQLSyntaxError(str(e))
         
+    @staticmethod
+    def parse_cached(text, db=None, default_namespace=None, include_retired_files=False, 
+                with_meta=False, with_provenance=False, skip=0, limit=None, debug=False, filters={}):
+        # same as parse(), but file queries are also compiled with the given options and the compiled plan is
+        # kept in the process-wide plan cache, so that repeated queries skip parsing and compilation.
+        # The returned query must be run with the same options
+        key = (PlanCache.normalize(text), default_namespace, bool(include_retired_files), 
+                bool(with_meta), bool(with_provenance), skip, limit, tuple(sorted(filters)))
+        cached = plan_cache.get(key)
+        if cached is not None:
+            tree, optimized, plan = cached
+            q = FileQuery(tree, include_retired_files)
+            q.Optimized = optimized
+            q.Plan, q.PlanOptions = plan, (skip, limit, with_meta, with_provenance, tuple(sorted(filters)))
+            return q
+        q = MQLQuery.parse(text, db=db, default_namespace=default_namespace, include_retired_files=include_retired_files)
+        if q.Type == "file":
+            q.compile(db=db, skip=skip, limit=limit, with_meta=with_meta, with_provenance=with_provenance, debug=debug,
+                        filters=filters)
+            plan_cache.put(key, (q.Tree, q.Optimized, q.Plan), q.References)
+        return q
+
     @staticmethod
     def from_db(db, namespace, name, convert=True):
         q = DBNamedQuery.get(db, namespace, name)
@@ -0,0 +1,95 @@
+import time
+from threading import RLock
+from collections import OrderedDict
+
+class PlanCache(object):
+    #
+    # Process-wide LRU cache of compiled file query plans.
+    #
+    # Each entry is stored with the set of its dependencies:
+    #   ("query", namespace, name)  - named query inlined into the plan
+    #   ("dataset", namespace)      - the plan selects files from dataset(s) in the namespace
+    # so that the entries can be invalidated when the referenced named queries or datasets change.
+    # Because other server processes can change them too, entries also expire after TTL seconds.
+    #
+
+    def __init__(self, capacity=1000, ttl=600):
+        self.Capacity = capacity
+        self.TTL = ttl
+        self.Entries = OrderedDict()        # key -> (expiration, dependencies, plan)
+        self.Lock = RLock()
+        self.Hits = self.Misses = self.Invalidations = 0
+
+    def configure(self, capacity=None, ttl=None):
+        with self.Lock:
+            if capacity is not None:
+                self.Capacity = capacity
+            if ttl is not None:
+                self.TTL = ttl
+            self.trim()
+
+    @staticmethod
+    def normalize(text):
+        # remove comments, blank lines and leading/trailing blanks. Blanks inside lines are left alone
+        # because they may be inside string literals
+        lines = (l.split('#', 1)[0].strip() for l in text.split("\n"))
+        return "\n".join(l for l in lines if l)
+
+    def trim(self):
+        with self.Lock:
+            while len(self.Entries) > max(self.Capacity, 0):
+                self.Entries.popitem(last=False)
+
+    def get(self, key):
+        with self.Lock:
+            entry = self.Entries.get(key)
+            if entry is not None:
+                expiration, _, plan = entry
+                if expiration is None or expiration > time.time():
+                    self.Entries.move_to_end(key)
+                    self.Hits += 1
+                    return plan
+                del self.Entries[key]
+            self.Misses += 1
+            return None
+
+    def put(self, key, plan, dependencies=()):
+        if not self.Capacity:
+            return
+        expiration = None if not self.TTL else time.time() + self.TTL
+        with self.Lock:
+            self.Entries[key] = (expiration, frozenset(dependencies), plan)
+            self.Entries.move_to_end(key)
+            self.trim()
+
+    def invalidate(self, *dependency):
+        # invalidate(): clear the cache
+        # invalidate("query", namespace, name): drop plans using the named query
+        # invalidate("dataset", namespace[, name]): drop plans selecting files from datasets in the namespace
+        with self.Lock:
+            if not dependency:
+                n = len(self.Entries)
+                self.Entries.clear()
+            else:
+                if dependency[0] == "dataset":
+                    dependency = dependency[:2]
+                dependency = tuple(dependency)
+                keys = [k for k, (_, deps, _) in self.Entries.items() if dependency in deps]
+                for k in keys:
+                    del self.Entries[k]
+                n = len(keys)
+            self.Invalidations += n
+            return n
+
+    def stats(self):
+        with self.Lock:
+            return dict(
+                size = len(self.Entries),
+                capacity = self.Capacity,
+                ttl = self.TTL,
+                hits = self.Hits,
+                misses = self.Misses,
+                invalidations = self.Invalidations
+            )
+
+plan_cache = PlanCache()
@@ -1,16 +1,87 @@
-from metacat.common.trees  import Ascender, Node
-from metacat.db import DBFileSet
+import json, threading, queue
+from concurrent.futures import ThreadPoolExecutor
+from metacat.common.trees  import Ascender, Node, pass_node
+from metacat.db import DBFileSet, alias_scope
+from metacat.util import SQLParams
 from .meta_evaluator import MetaEvaluator
+from .sql_converter import SQLConverter
+
+# Process-wide limit for the number of DB connections used by concurrently executed union and join branches.
+# A branch holds a slot for as long as it uses its own connection, so the branches of all requests together
+# can not exhaust the connection pool
+BranchSlots = threading.BoundedSemaphore(10)
+
+def configure(branch_connections):
+    global BranchSlots
+    BranchSlots = threading.BoundedSemaphore(max(1, branch_connections))
+
+def _run_concurrently(branches, parallelism, queue_size=1000):
+    # runs the branches, callables returning iterables of files, on a thread pool of parallelism threads.
+    # yields (branch index, file) in the order the files are produced by the branches
+    q = queue.Queue(queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(i, branch):
+        try:
+            if stop.is_set():
+                return
+            files = branch()
+            try:
+                for f in files:
+                    if not put((i, f)):
+                        return
+            finally:
+                if hasattr(files, "close"):
+                    files.close()           # let the branch release its connection right away
+            put((i, done))
+        except Exception as e:
+            put((i, e))
+
+    pool = ThreadPoolExecutor(max_workers=parallelism)
+    try:
+        for i, branch in enumerate(branches):
+            pool.submit(run, i, branch)
+        remaining = len(branches)
+        while remaining:
+            i, item = q.get()
+            if item is done:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield i, item
+    finally:
+        stop.set()
+        pool.shutdown(wait=False)
 
 class FileQueryExecutor(Ascender):
     
     # the assumption is that the entire tree consists of:
     # Node(T="sql") and DBFileSet objects
     
-    def __init__(self, db, filters, debug=False):
+    # operations which SQLConverter can convert to SQL if their inputs are SQL
+    SQLOperations = {"union", "join", "minus", "parents_of", "children_of", "ancestors_of", "descendants_of",
+                "meta_filter", "skip_limit", "ordered", "page", "json_rows", "project"}
+
+    def __init__(self, db, filters, debug=False, itersize=None, materialize_filters=True, connect=None, parallelism=1):
         self.DB = db
         self.Filters = filters
         self.Debug = False
+        self.Itersize = itersize        # if not None, stream SQL results using server-side cursors
+        self.MaterializeFilters = materialize_filters   # copy output of filters used as input for SQL into temp tables
+        self.TempTables = 0
+        self.Connect = connect          # callable returning new DB connection, required for concurrent execution
+        self.Parallelism = parallelism  # max number of union or join branches executed concurrently
         
     def debug(self, *params, **args):
         if self.Debug:
@@ -18,26 +89,112 @@ class FileQueryExecutor(Ascender):
             print(*parts, **args)
             
     def __call__(self, tree):
-        result = self.walk(tree)
+        with alias_scope("e"):
+            if self.MaterializeFilters:
+                materialized = self.materialize_filters(tree)
+                if materialized is not tree:
+                    # the filter outputs are in temp tables now, so the operations above them can be converted to SQL
+                    tree = SQLConverter(self.DB, filters=self.Filters)(materialized)
+            result = self.walk(tree)
         return result
+
+    def materialize_filters(self, node, parent_type=None):
+        # runs the filters whose output is an input for an operation which could be done in SQL, stores the
+        # output in temp tables and replaces the filter nodes with SQL nodes reading the temp tables.
+        # returns the same node if nothing was replaced
+        if not isinstance(node, Node):
+            return node
+        if node.T in ("union", "join") and self.parallel(node):
+            # the branches will run on their own connections and temp tables are visible in one session only,
+            # so each branch executor materializes the filters in its subtree itself
+            return node
+        children = [self.materialize_filters(c, node.T) for c in node.C]
+        named = {name: self.materialize_filters(c, node.T) for name, c in node.D.items()}
+        if any(c is not c0 for c, c0 in zip(children, node.C)) or any(c is not node.D[n] for n, c in named.items()):
+            node = node.clone(children, **named)
+        if node.T == "filter" and parent_type in self.SQLOperations:
+            self.TempTables += 1
+            files = self.walk(node)
+            sql = DBFileSet.sql_for_temp_table(self.DB, files, f"temp_filter_{self.TempTables}",
+                    with_meta=node.get("with_meta", False))
+            self.debug("filter output materialized:", sql)
+            return Node("sql", sql=sql, params=SQLParams())
+        return node
         
     def empty(self, node, *args):
         return DBFileSet(self.DB)    # empty file set
         
-    def sql(self, node, sql=None):
+    def sql(self, node, sql=None, params=None, as_json=False, as_rows=False):
         #print("sql:", sql)
-        return DBFileSet(self.DB, sql=sql)
+        files = DBFileSet(self.DB, sql=sql, params=params, itersize=self.Itersize)
+        if as_json:
+            return files.json_rows()
+        elif as_rows:
+            return files.row_batches(self.Itersize or 10000)
+        return files
+
+    def project(self, node, arg, columns=[]):
+        return arg.column_batches(columns, self.Itersize or 10000)
+
+    def json_rows(self, node, arg, with_meta=False, with_provenance=False):
+        # the query could not be converted to SQL entirely, so build JSON in Python
+        if with_provenance:
+            arg = arg.load_provenance()
+        return (json.dumps(f.to_jsonable(with_metadata=with_meta, with_provenance=with_provenance)) for f in arg)
         
     def meta_filter(self, node, query=None, meta_exp=None, with_meta=False, with_provenance=False):
-        evaluator = MetaEvaluator()
-        filtered_files = (f for f in query if evaluator(f, meta_exp))
-        return DBFileSet(self.DB, filtered_files)
+        predicate = MetaEvaluator().compile(meta_exp)
+        return DBFileSet(self.DB, filter(predicate, query))
+
+    def parallel(self, node):
+        return self.Connect is not None and self.Parallelism > 1 and len(node.C) > 1
+
+    def branches(self, node):
+        # callables for _run_concurrently(), each executing one child of the node with its own DB connection
+        def branch(child):
+            def run():
+                slots = BranchSlots
+                with slots:
+                    db = self.Connect()
+                    try:
+                        executor = FileQueryExecutor(db, self.Filters, itersize=self.Itersize,
+                                        materialize_filters=self.MaterializeFilters)
+                        for f in executor(child):
+                            f.DB = self.DB
+                            yield f
+                    finally:
+                        db.close()
+            return run
+        return [branch(c) for c in node.C]
+
+    @pass_node
+    def union(self, node):
+        if not self.parallel(node):
+            return DBFileSet.union(self.DB, [self._walk(c) for c in node.C])
+        files = (f for _, f in _run_concurrently(self.branches(node), self.Parallelism))
+        return DBFileSet.union(self.DB, [files])
 
-    def union(self, node, *args):
-        return DBFileSet.union(self.DB, args)
+    @pass_node
+    def join(self, node):
+        if not self.parallel(node):
+            return DBFileSet.join(self.DB, [self._walk(c) for c in node.C])
 
-    def join(self, node, *args, **kv):
-        return DBFileSet.join(self.DB, args)
+        def intersection(branches, n):
+            # hash intersection: a file is yielded as soon as it is received from all n branches.
+            # Like DBFileSet.join(), the file object from the first branch is yielded because other branches
+            # may have different metadata for it
+            seen = {}
+            for i, f in _run_concurrently(branches, self.Parallelism):
+                found_in, first = seen.get(f.FID, (set(), None))
+                if i not in found_in:
+                    found_in.add(i)
+                    if i == 0:
+                        first = f
+                    seen[f.FID] = (found_in, first)
+                    if len(found_in) == n:
+                        yield first
+
+        return DBFileSet(self.DB, intersection(self.branches(node), len(node.C)))
         
     def ordered(self, node):
         assert isinstance(node, DBFileSet)
@@ -56,8 +213,17 @@ class FileQueryExecutor(Ascender):
     def children_of(self, node, *args, with_meta=False, with_provenance=False):
         return args[0].children(as_files=True, with_metadata=with_meta, with_provenance=with_provenance)
 
+    def ancestors_of(self, node, arg, depth=None, with_meta=False, with_provenance=False, **kv):
+        return arg.ancestors(depth=depth, with_metadata=with_meta, with_provenance=with_provenance)
+
+    def descendants_of(self, node, arg, depth=None, with_meta=False, with_provenance=False, **kv):
+        return arg.descendants(depth=depth, with_metadata=with_meta, with_provenance=with_provenance)
+
     def skip_limit(self, node, arg, skip=0, limit=None, **kv):
         return arg.skip(skip).limit(limit)
+
+    def page(self, node, arg, after=None, limit=None):
+        return arg.page(after, limit)
             
     def filter(self, node, *queries, name=None, params=[], kw={}, 
                 skip=0, limit=None,
@@ -2,16 +2,17 @@ from metacat.common.trees import Ascender, Node
 from metacat.db import DBFileSet, alias, DBDataset, DBFile
 from metacat.common import FileMetaExpressionDNF
 from .meta_evaluator import MetaEvaluator
-from metacat.util import limited, insert_sql
+from metacat.util import limited, insert_sql, SQLParams
 from textwrap import dedent, indent
 
 class SQLConverter(Ascender):
     
-    def __init__(self, db, debug=False, include_retired=False, summary=None):
+    def __init__(self, db, debug=False, include_retired=False, summary=None, filters={}):
         self.DB = db
         self.Debug = debug
         self.IncludeRetired = include_retired
         self.Summary = summary
+        self.Filters = filters          # filters which may have SQL rewrites, see MetaCatFilter.sql()
 
     def columns(self, t, with_meta=True, with_provenance=True):
         meta = f"{t}.metadata" if with_meta else "null as metadata"
@@ -54,8 +55,9 @@ class SQLConverter(Ascender):
             return query
         if query.T == "sql":
             t = alias("t")
+            params = SQLParams(query.get("params"))
             dnf = FileMetaExpressionDNF(meta_exp)
-            where_sql = dnf.sql(t)
+            where_sql = dnf.sql(t, params=params)
             if not where_sql:
                 return node
             columns = self.columns(t, with_meta, with_provenance)
@@ -68,7 +70,7 @@ class SQLConverter(Ascender):
                     ) {t} where {where_sql}
                 -- end of meta_filter {t}
             """, query_sql=query_sql)
-            return Node("sql", sql=sql)
+            return Node("sql", sql=sql, params=params)
         else:
             return node
 
@@ -84,41 +86,96 @@ class SQLConverter(Ascender):
                     ) {t} order by {t}.created_timestamp,{t}.id
                 -- end of ordered {t}
             """, child_sql = child_sql)
-            return Node("sql", sql=sql)
+            return Node("sql", sql=sql, params=child.get("params"))
         elif child.T == "filter":
             return child.clone(ordered=True)
         else:
             return node
 
+    def page(self, node, child, after=None, limit=None):
+        if child.T == "empty":
+            return child
+        elif child.T == "sql":
+            params = SQLParams(child.get("params"))
+            return Node("sql", sql=DBFileSet.sql_for_page(child["sql"], params, after, limit), params=params)
+        else:
+            return node.clone(children=[child])
+
+    def json_rows(self, node, child, with_meta=False, with_provenance=False):
+        # if the whole query is SQL, let Postgres build the JSON representation of the files.
+        # With provenance, the JSON is built in Python, after the provenance is loaded in batches
+        if child.T == "sql" and not with_provenance:
+            return Node("sql", sql=DBFileSet.sql_as_json(child["sql"], with_meta),
+                            params=child.get("params"), as_json=True)
+        else:
+            return node.clone(children=[child])
+
+    def project(self, node, child, columns=[]):
+        # let the database select the listed file attributes and metadata values
+        if child.T == "sql":
+            params = SQLParams(child.get("params"))
+            return Node("sql", sql=DBFileSet.sql_for_columns(child["sql"], columns, params), 
+                            params=params, as_rows=True)
+        else:
+            return node.clone(children=[child])
+
     def basic_file_query(self, node, *args, query=None):
-        sql = DBFileSet.sql_for_basic_query(self.DB, query, self.IncludeRetired)
+        params = SQLParams()
+        sql = DBFileSet.sql_for_basic_query(self.DB, query, params, self.IncludeRetired)
         if sql:
-            out = Node("sql", sql=sql)
+            out = Node("sql", sql=sql, params=params)
         else:
             out = Node("empty")            # empty file set
         return out
 
     def file_list(self, node, specs=None, spec_type=None, with_meta=False, with_provenance=False, limit=None, skip=0):
-        return Node("sql", sql=DBFileSet.sql_for_file_list(spec_type, specs, with_meta, with_provenance, limit, skip))
+        params = SQLParams()
+        sql = DBFileSet.sql_for_file_list(spec_type, specs, with_meta, with_provenance, limit, skip, params)
+        return Node("sql", sql=sql, params=params)
 
     def union(self, node, *args):
         #print("Evaluator.union: args:", args)
         args = [a for a in args if a.T != "empty"]
         if not args:
             return Node("empty")
-        sqls = [n for n in args if n.T == "sql"]
-        if not sqls:
+        if not any(n.T == "sql" for n in args):
             return Node("union", args)
-        if len(sqls) >= 2:
-            inner_sqls = {f"__{i}": n["sql"] for i, n in enumerate(sqls)}
-            parts = [f"(\n    $__{i}\n)" for i, n in enumerate(sqls)]
-            template = "\nunion\n".join(parts)
-            combined_sql = insert_sql(template, **inner_sqls)
-            sqls = [Node("sql", sql=combined_sql)]
-        others = [n for n in args if n.T != "sql"]
-        if not others:
+        # the file from the first branch which has it is used, like in DBFileSet.union(), so only adjacent
+        # SQL branches are combined and the order of the branches is preserved
+        runs = []
+        for n in args:
+            if n.T == "sql" and runs and isinstance(runs[-1], list):
+                runs[-1].append(n)
+            else:
+                runs.append([n] if n.T == "sql" else n)
+        args = [self.union_sql(run) if isinstance(run, list) else run for run in runs]
+        if len(args) == 1:
+            return args[0]
+        return Node("union", args)
+
+    def union_sql(self, sqls):
+        if len(sqls) == 1:
             return sqls[0]
-        return Node("union", sqls + others)
+        # files are combined by id, not by the whole row: metadata copied from a filter output into
+        # a temp table may differ from the metadata of the same file in another branch
+        u = alias("u")
+        b = alias("b")
+        parts = [insert_sql(f"""\
+                select {b}.*, {i} as branch_
+                from (
+                    $branch_sql
+                ) {b}""", branch_sql=n["sql"]) for i, n in enumerate(sqls)]
+        columns = self.columns(u)
+        sql = insert_sql(f"""\
+            -- union {u}
+                select distinct on ({u}.id) {columns}
+                from (
+                    $parts_sql
+                ) {u}
+                order by {u}.id, {u}.branch_
+            -- end of union {u}
+        """, parts_sql="\nunion all\n".join(parts))
+        return Node("sql", sql=sql, params=SQLParams(*[n.get("params") for n in sqls]))
 
     def join(self, node, *args, **kv):
         #print("Evaluator.union: args:", args)
@@ -128,15 +185,36 @@ class SQLConverter(Ascender):
         if not sqls:
             return node
         if len(sqls) >= 2:
-            inner_sqls = {f"__{i}": n["sql"] for i, n in enumerate(sqls)}
-            parts = [f"(\n    $__{i}\n)" for i, n in enumerate(sqls)]
-            template = "\nintersect\n".join(parts)
-            combined_sql = insert_sql(template, **inner_sqls)
-            sqls = [Node("sql", sql=combined_sql)]
-        others = [n for n in args if n.T != "sql"]
-        if not others:
-            return sqls[0]
-        return Node("join", sqls + others)
+            # files are matched by id and taken from the first branch, like in DBFileSet.join()
+            t = alias("t")
+            conditions = []
+            for n in sqls[1:]:
+                j = alias("j")
+                conditions.append(insert_sql(f"""\
+                    {t}.id in (
+                        select {j}.id
+                        from (
+                            $branch_sql
+                        ) {j}
+                    )""", branch_sql=n["sql"]))
+            columns = self.columns(t)
+            combined_sql = insert_sql(f"""\
+                -- join {t}
+                    select distinct on ({t}.id) {columns}
+                    from (
+                        $first_sql
+                    ) {t}
+                    where
+                        $conditions_sql
+                -- end of join {t}
+            """, first_sql=sqls[0]["sql"], conditions_sql="\nand ".join(conditions))
+            params = SQLParams(*[n.get("params") for n in sqls])
+            combined = Node("sql", sql=combined_sql, params=params)
+            # the combined SQL takes the place of the first SQL branch
+            args = [combined if n is sqls[0] else n for n in args if n.T != "sql" or n is sqls[0]]
+        if len(args) == 1:
+            return args[0]
+        return Node("join", list(args))
 
     def minus(self, node, *args, **kv):
         #print("Evaluator.union: args:", args)
@@ -147,18 +225,27 @@ class SQLConverter(Ascender):
         elif right.T == "empty":
             return left
         if left.T == "sql" and right.T == "sql":
-            s1 = left["sql"]
-            s2 = right["sql"]
-            sql = insert_sql("""\
-                (
-                    $s1
-                )
-                except
-                (
-                    $s2
-                )""", s1=s1, s2=s2)
+            # files are subtracted by id, see union()
+            t = alias("t")
+            r = alias("r")
+            columns = self.columns(t)
+            sql = insert_sql(f"""\
+                -- minus {t}
+                    select distinct on ({t}.id) {columns}
+                    from (
+                        $s1
+                    ) {t}
+                    where not exists (
+                        select 1
+                        from (
+                            $s2
+                        ) {r}
+                        where {r}.id = {t}.id
+                    )
+                -- end of minus {t}
+            """, s1=left["sql"], s2=right["sql"])
             self.debug("SQLConverter.minus: sql:---------\n", sql, "\n-----------")
-            return Node("sql", sql=sql)
+            return Node("sql", sql=sql, params=SQLParams(left.get("params"), right.get("params")))
         else:
             return node
 
@@ -168,14 +255,13 @@ class SQLConverter(Ascender):
         if arg.T == "empty":    return arg
         if arg.T == "sql":
             with_meta = node["with_meta"]
-            with_provenance = node["with_provenance"]
             arg_sql = arg["sql"]
             p = alias("p")
             c = alias("c")
             pc = alias("pc")
-            columns = self.columns(p, with_meta, with_provenance)
+            columns = self.columns(p, with_meta, False)      # provenance is loaded later, see DBFileSet.load_provenance()
             order = f"order by {p}.created_timestamp,{p}.id" if ordered else ""
-            table = "files_with_provenance" if with_provenance else "files"
+            table = "files"
             new_sql = insert_sql(f"""\
                 --  parents of {p}
                     select {columns}
@@ -188,7 +274,7 @@ class SQLConverter(Ascender):
                     {order}
                 --  end of parents of {p}
             """, arg_sql=arg_sql)
-            return Node("sql", sql=new_sql)
+            return Node("sql", sql=new_sql, params=arg.get("params"))
         else:
             return node
 
@@ -198,14 +284,13 @@ class SQLConverter(Ascender):
         if arg.T == "empty":    return arg
         if arg.T == "sql":
             with_meta = node["with_meta"]
-            with_provenance = node["with_provenance"]
             arg_sql = arg["sql"]
             p = alias("p")
             c = alias("c")
             pc = alias("pc")
-            columns = self.columns(c, with_meta, with_provenance)
+            columns = self.columns(c, with_meta, False)      # provenance is loaded later, see DBFileSet.load_provenance()
             order = f"order by {p}.created_timestamp,{p}.id" if ordered else ""
-            table = "files_with_provenance" if with_provenance else "files"
+            table = "files"
             new_sql = insert_sql(f"""\
                 -- children of {c}
                     select {columns}
@@ -218,7 +303,49 @@ class SQLConverter(Ascender):
                     {order}
                 -- end of children of {c}
             """, arg_sql=arg_sql)
-            return Node("sql", sql=new_sql)
+            return Node("sql", sql=new_sql, params=arg.get("params"))
+        else:
+            return node
+            
+    def ancestors_of(self, node, *args, with_meta=False, with_provenance=False, ordered=False, depth=None):
+        assert len(args) == 1
+        return self.lineage_of(node, args[0], "ancestor_id", "descendant_id", depth, ordered)
+
+    def descendants_of(self, node, *args, with_meta=False, with_provenance=False, ordered=False, depth=None):
+        assert len(args) == 1
+        return self.lineage_of(node, args[0], "descendant_id", "ancestor_id", depth, ordered)
+
+    def lineage_of(self, node, arg, related_column, arg_column, depth, ordered):
+        # ancestors or descendants of any depth up to the limit, using the file_lineage closure table
+        if arg.T == "empty":    return arg
+        if arg.T == "sql":
+            with_meta = node["with_meta"]
+            arg_sql = arg["sql"]
+            f = alias("f")
+            a = alias("a")
+            l = alias("l")
+            columns = self.columns(f, with_meta, False)      # provenance is loaded later, see DBFileSet.load_provenance()
+            order = f"order by {f}.created_timestamp,{f}.id" if ordered else ""
+            params = SQLParams(arg.get("params"))
+            depth_condition = f"where {l}.depth <= {params.bind(int(depth))}" if depth is not None else ""
+            table = "files"
+            new_sql = insert_sql(f"""\
+                --  {node.T} {f}
+                    select {columns}
+                    from {table} {f}
+                        where {f}.id in (
+                                select {l}.{related_column}
+                                    from file_lineage {l}
+                                    inner join (
+                                        $arg_sql
+                                    ) as {a} on {a}.id = {l}.{arg_column}
+                                    {depth_condition}
+                            )
+                            and not {f}.retired
+                    {order}
+                --  end of {node.T} {f}
+            """, arg_sql=arg_sql)
+            return Node("sql", sql=new_sql, params=params)
         else:
             return node
             
@@ -247,8 +374,9 @@ class SQLConverter(Ascender):
             tmp = alias()
             columns = self.columns(tmp)
             
-            limit_clouse = "" if limit is None else f"limit {limit}"
-            offset_clouse = "" if skip == 0 else f"offset {skip}"
+            params = SQLParams(arg.get("params"))
+            limit_clouse = "" if limit is None else f"limit {params.bind(limit)}"
+            offset_clouse = "" if skip == 0 else f"offset {params.bind(skip)}"
             
             sql = indent("\n" + sql + "\n", "    ")
             new_sql = insert_sql(f"""\
@@ -260,10 +388,23 @@ class SQLConverter(Ascender):
                     {limit_clouse} {offset_clouse}
                 -- end of limit {limit} {tmp}
             """, sql=sql)
-            return Node("sql", sql=new_sql)
+            return Node("sql", sql=new_sql, params=params)
         else:
             return node
 
+    def filter(self, node, *queries, name=None, params=[], kw={}, skip=0, limit=None, ordered=False, **ignore):
+        filter_object = self.Filters.get(name)
+        if filter_object is None or not queries or not all(q.T == "sql" for q in queries):
+            return node
+        sql_params = SQLParams(*[q.get("params") for q in queries])
+        sql = filter_object.sql([q["sql"] for q in queries], sql_params, *params, ordered=ordered, **kw)
+        if sql is None:
+            return node
+        out = Node("sql", sql=sql, params=sql_params)
+        if skip or limit is not None:
+            out = self.skip_limit(Node("skip_limit", [out]), out, skip=skip, limit=limit)
+        return out
+
     def _default(self, node, *children, **named):
         #print("_default:", node.pretty())
         #print("      children:")
@@ -5,14 +5,68 @@ from metacat.util import to_bytes, to_str
 from metacat.webapi import MetaCatClient, MCServerError, MCWebAPIError, MCError
 from metacat.ui.cli import CLICommand, InvalidArguments, InvalidOptions
 
+def print_explain_node(node, indent=""):
+    rows = "" if node.get("rows") is None else " rows=%d" % (node["rows"],)
+    times = ""
+    if node.get("rows") is not None:
+        times = " time=%.3f self=%.3f" % (node["time"], node["self_time"])
+    data = ""
+    if node.get("data"):
+        data = " " + " ".join("%s=%s" % (k, v) for k, v in node["data"].items() if v not in (None, [], {}))
+    print("%s%s%s%s%s" % (indent, node["node"], rows, times, data))
+    if node["node"] == "sql":
+        for line in node["sql"].split("\n"):
+            if line.strip():
+                print(indent + "  | " + line.rstrip())
+        if node.get("params"):
+            print(indent + "  params:", json.dumps(node["params"]))
+        for plan in node.get("explain") or []:
+            print_sql_plan(plan["Plan"], indent + "  ")
+            for key in ("Planning Time", "Execution Time"):
+                if key in plan:
+                    print("%s  %s: %.3f ms" % (indent, key, plan[key]))
+    for c in node.get("children", []):
+        print_explain_node(c, indent + "    ")
+
+def print_sql_plan(plan, indent=""):
+    line = "%s-> %s" % (indent, plan["Node Type"])
+    if "Relation Name" in plan:
+        line += " on %s" % (plan["Relation Name"],)
+    if "Index Name" in plan:
+        line += " using %s" % (plan["Index Name"],)
+    line += "  (cost=%s..%s rows=%s)" % (plan.get("Startup Cost"), plan.get("Total Cost"), plan.get("Plan Rows"))
+    if "Actual Total Time" in plan:
+        line += " (actual time=%s..%s rows=%s loops=%s)" % (plan.get("Actual Startup Time"), plan.get("Actual Total Time"), 
+                plan.get("Actual Rows"), plan.get("Actual Loops"))
+    if "Shared Hit Blocks" in plan:
+        line += " (buffers: hit=%s read=%s)" % (plan.get("Shared Hit Blocks"), plan.get("Shared Read Blocks"))
+    print(line)
+    for p in plan.get("Plans", []):
+        print_sql_plan(p, indent + "  ")
+
+def print_explain(out):
+    print("---- Query text ----\n%s\n" % (out.get("query"),))
+    print("---- Phases ----")
+    for p in out["phases"]:
+        print("  %-40s %.3f" % (p["phase"], p["time"]))
+    print("  %-40s %.3f" % ("total", out.get("total_time", 0.0)))
+    if out.get("mode") == "analyze":
+        print("")
+        print("Files:          ", out["rows"])
+        print("SQL time:        %.3f" % (out["sql_time"],))
+        print("Filter time:     %.3f" % (out["filter_time"],))
+    print("")
+    print("---- Plan ----")
+    print_explain_node(out["plan"], "  ")
+
 class QueryCommand(CLICommand):
 
     GNUStyle = False    
     Opts = (
         "b:jim:N:pq:S:A:lPxrL:U:S:R:Q:2t:s", 
         ["batch_size=", "line", "json", "ids", "summary=", "metadata=", "namespace=", "pretty",
-            "with-provenance", "save-as=", "add-to=", "explain", "include-retired-files",
-            "list=", "source=", "create=", "update=", "run=", "1024", "timeout="
+            "with-provenance", "save-as=", "add-to=", "explain", "analyze", "include-retired-files",
+            "list=", "source=", "create=", "update=", "run=", "1024", "timeout=", "export="
         ]
     )
     Usage = """[<options>] (-q <MQL query file>|"<MQL query>")
@@ -37,9 +91,18 @@ class QueryCommand(CLICommand):
             -S|--save-as=<namespace>:<name>     - save files as a new datset
             -A|--add-to=<namespace>:<name>      - add files to an existing dataset
             -r|--include-retired-files          - include retired files into the query results
-            -b|--batch_size N                   - perform query in batches of N files
+            -b|--batch_size N                   - retrieve query results in pages of N files, ordered by creation time
             
-            -x|--explain                        - dp not run the query, show resulting SQL only
+            -x|--explain                        - do not run the query, show the compiled query tree and the SQL execution plans
+               --analyze                        - run the query on the server and show row counts and timing for
+                                                  each query processing phase and each query tree node,
+                                                  with EXPLAIN ANALYZE output for SQL
+                                                  with -j, print the raw JSON explain output
+
+               --export (csv|ndjson)            - bulk export of the query results to stdout, using the database COPY.
+                                                  The query must not use filters.
+                                                  Use -m to include metadata: -m all for whole metadata or
+                                                  -m <field>,... for selected metadata fields as columns
     """
     
     def __call__(self, command, client, opts, args):
@@ -64,27 +127,27 @@ class QueryCommand(CLICommand):
                 raise InvalidArguments("Query must be specified")
             query_text = to_str(open(query_file, "r").read())
             
-        if "-x" in opts or "--explain" in opts:
-            from metacat.mql import MQLQuery
-            print("---- Query text ----\n%s\n" % (query_text,))
-            q = MQLQuery.parse(query_text, loader=client, include_retired_files=include_retired)
-
-            print("---- Parsed ----")
-            print(q.Parsed.pretty())
-            print("")
+        export_format = opts.get("--export")
+        if export_format is not None and export_format not in ("csv", "ndjson"):
+            raise InvalidOptions(f"Unsupported export format: {export_format}")
 
-            print("---- Converted ----")
-            print(q.Tree.pretty("    "))
-            print("")
-        
-            #q.optimize(False)
-            #print("---- Optimized ----")
-            #print(q.Optimized.pretty("    "))
-            #print("")
-    
-            compiled = q.compile(with_meta=with_meta, with_provenance=with_provenance)
-            print("---- Compiled ----")
-            print(compiled.pretty("    "))
+        if export_format:
+            client.Timeout = timeout
+            out = sys.stdout.buffer
+            for data in client.export_query(query_text, format=export_format, metadata=keys or None, 
+                                    namespace=namespace, include_retired_files=include_retired):
+                out.write(data)
+            out.flush()
+        elif "-x" in opts or "--explain" in opts or "--analyze" in opts:
+            client.Timeout = timeout
+            mode = "analyze" if "--analyze" in opts else "plan"
+            out = client.explain_query(query_text, mode=mode, namespace=namespace,
+                        with_metadata=with_meta, with_provenance=with_provenance,
+                        include_retired_files=include_retired)
+            if "--json" in opts or "-j" in opts:
+                print(json.dumps(out, indent=4))
+            else:
+                print_explain(out)
         else:
             client.Timeout = timeout
             results = client.query(
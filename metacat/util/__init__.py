@@ -3,5 +3,6 @@ from .timelib import epoch
 from .trace import Tracer
 from .object_spec import ObjectSpec, undid
 from .utils import first_not_empty, insert_sql
-from .validation import validate_metadata
-from .generators import fetch_generator, chunked, limited, unique, strided, skipped
\ No newline at end of file
+from .validation import validate_metadata, metadata_validator, MetadataValidator
+from .generators import fetch_generator, fetch_batches, chunked, limited, unique, strided, skipped, prefetched
+from .sql_params import SQLParams, execute_sql
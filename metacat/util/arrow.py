@@ -0,0 +1,105 @@
+import io, json
+
+#
+# Conversion of file query results into Arrow IPC stream. pyarrow is optional and imported only when needed
+#
+
+ArrowStreamContentType = "application/vnd.apache.arrow.stream"
+
+# Arrow types of the file attribute columns. Columns not listed here are metadata keys
+AttributeTypes = {
+    "fid":                  "string",
+    "namespace":            "string",
+    "name":                 "string",
+    "size":                 "int64",
+    "creator":              "string",
+    "created_timestamp":    "timestamp",
+    "updated_by":           "string",
+    "updated_timestamp":    "timestamp",
+    "retired":              "bool",
+    "retired_by":           "string",
+    "retired_timestamp":    "timestamp",
+    "checksums":            "json"
+}
+
+DefaultColumns = ["fid", "namespace", "name", "size", "created_timestamp"]
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("pyarrow module required for Arrow output. Use: pip install pyarrow")
+    return pyarrow
+
+def _metadata_type(values):
+    # column type for a metadata key is determined by its values in the first batch of rows
+    types = set(type(v) for v in values if v is not None)
+    if not types:
+        return "string"
+    elif types == {bool}:
+        return "bool"
+    elif types == {int}:
+        return "int64"
+    elif types <= {int, float}:
+        return "float64"
+    elif types == {str}:
+        return "string"
+    else:
+        return "json"
+
+def _convert(values, typ):
+    # values which do not match the column type are converted to nulls
+    if typ == "json":
+        return [None if v is None else (v if isinstance(v, str) else json.dumps(v)) for v in values]
+    elif typ == "string":
+        return [v if isinstance(v, str) else None for v in values]
+    elif typ == "bool":
+        return [v if isinstance(v, bool) else None for v in values]
+    elif typ == "int64":
+        return [v if isinstance(v, int) and not isinstance(v, bool) else
+                    (int(v) if isinstance(v, float) and v.is_integer() else None)
+                for v in values]
+    elif typ == "float64":
+        return [float(v) if isinstance(v, (int, float)) and not isinstance(v, bool) else None for v in values]
+    else:
+        return values
+
+def _arrow_type(pa, typ):
+    if typ == "timestamp":
+        return pa.timestamp("us", tz="UTC")
+    elif typ == "int64":
+        return pa.int64()
+    elif typ == "float64":
+        return pa.float64()
+    elif typ == "bool":
+        return pa.bool_()
+    else:
+        return pa.string()
+
+def arrow_stream(columns, row_batches):
+    # columns: list of file attribute names and metadata keys
+    # row_batches: iterable of lists of row tuples with values in the columns order
+    # yields Arrow IPC stream as bytes, one record batch at a time
+    pa = import_pyarrow()
+    out = io.BytesIO()
+    types = schema = writer = None
+    for rows in row_batches:
+        if not rows:
+            continue
+        values = list(zip(*rows))
+        if schema is None:
+            types = [AttributeTypes.get(c) or _metadata_type(v) for c, v in zip(columns, values)]
+            schema = pa.schema([(c, _arrow_type(pa, t)) for c, t in zip(columns, types)])
+            writer = pa.ipc.new_stream(out, schema)
+        arrays = [pa.array(_convert(v, t), type=f.type) for v, t, f in zip(values, types, schema)]
+        writer.write_batch(pa.record_batch(arrays, schema=schema))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    if writer is None:
+        # no rows
+        schema = pa.schema([(c, _arrow_type(pa, AttributeTypes.get(c, "string"))) for c in columns])
+        writer = pa.ipc.new_stream(out, schema)
+    writer.close()
+    yield out.getvalue()
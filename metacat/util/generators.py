@@ -1,9 +1,18 @@
+import threading, queue
+
 def fetch_generator(c):
     while True:
         tup = c.fetchone()
         if tup is None: break
         yield tup
 
+def fetch_batches(c, batch_size=1000):
+    # uses fetchmany() to pull rows in batches, useful with server-side (named) cursors
+    while True:
+        tups = c.fetchmany(batch_size)
+        if not tups: break
+        yield from tups
+
 def chunked(iterable, n):
     if iterable is None:
         return
@@ -60,3 +69,40 @@ def skipped(iterable, n):
             n -= 1
         else:
             yield f
+
+def prefetched(iterable, n=1):
+    # iterates the iterable in a separate thread, keeping up to n items ready ahead of the consumer
+    q = queue.Queue(max(1, n))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((None, e))
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    try:
+        while True:
+            item, exc = q.get()
+            if exc is not None:
+                raise exc
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
@@ -0,0 +1,105 @@
+import re, hashlib, itertools, weakref
+from collections import OrderedDict
+from datetime import datetime
+
+#
+# Bound parameters for SQL built from insert_sql() templates.
+#
+# Literals are not inlined into the SQL text. Instead, SQLParams.bind() adds the value to the parameter dictionary
+# under a process-wide unique name and returns the "%(name)s::type" placeholder for the SQL text, so that
+# parameters of independently built SQL fragments can be merged when the fragments are combined.
+#
+
+_ParamSeq = itertools.count(1)
+
+def pg_type(v):
+    if isinstance(v, bool):         return "boolean"
+    elif isinstance(v, int):        return "bigint"
+    elif isinstance(v, float):      return "double precision"
+    elif isinstance(v, datetime):   return "timestamptz"
+    elif isinstance(v, str):        return "text"
+    elif isinstance(v, (list, tuple)):
+        types = set(pg_type(x) for x in v)
+        if types == {"bigint", "double precision"}:
+            types = {"double precision"}
+        if len(types) > 1:
+            raise ValueError("Mixed type values in a list: %s" % (v,))
+        return (types.pop() if types else "text") + "[]"
+    elif v is None:                 return "text"
+    else:
+        raise ValueError("Unrecognized literal type: %s %s" % (v, type(v)))
+
+class SQLParams(dict):
+
+    def __init__(self, *sources):
+        dict.__init__(self)
+        self.Types = {}
+        for s in sources:
+            self.merge(s)
+
+    def bind(self, value, pgtype=None):
+        name = f"param_{next(_ParamSeq)}"
+        if isinstance(value, tuple):
+            value = list(value)
+        self[name] = value
+        self.Types[name] = pgtype or pg_type(value)
+        return f"%({name})s::{self.Types[name]}"
+
+    def merge(self, other):
+        if other:
+            self.update(other)
+            self.Types.update(getattr(other, "Types", {}))
+        return self
+
+#
+# Server-side prepared statements, cached per connection
+#
+
+UsePreparedStatements = True
+PreparedStatementsPerConnection = 200
+
+_Prepared = weakref.WeakKeyDictionary()        # connection -> OrderedDict(statement name -> True)
+_PlaceholderRE = re.compile(r"%\((\w+)\)s")
+
+def prepared_statement(sql, params):
+    # statements are reused if the SQL text is the same. SQL built for the same query shape has the same text
+    # because the aliases are generated in alias_scope(), see metacat.db.common
+    # returns (statement name, statement SQL with $n placeholders, list of parameter names in $n order)
+    names = []
+    def number(m):
+        name = m.group(1)
+        if name not in names:
+            names.append(name)
+        return "$%d" % (names.index(name) + 1,)
+    text = _PlaceholderRE.sub(number, sql)
+    types = [getattr(params, "Types", {}).get(n, "unknown") for n in names]
+    name = "mc_" + hashlib.md5((",".join(types) + "|" + text).encode("utf-8")).hexdigest()[:20]
+    return name, text, names
+
+def execute_sql(c, sql, params=None, prepare=True):
+    # executes SQL with bound parameters, using a prepared statement if enabled.
+    # With no parameters, the SQL text is executed as is
+    if not params:
+        c.execute(sql)
+        return
+    if not (prepare and UsePreparedStatements):
+        c.execute(sql, params)
+        return
+    try:    statements = _Prepared.setdefault(c.connection, OrderedDict())
+    except TypeError:
+        # the connection does not support weak references
+        c.execute(sql, params)
+        return
+
+    name, text, names = prepared_statement(sql, params)
+    if name in statements:
+        statements.move_to_end(name)
+    else:
+        types = ", ".join(params.Types.get(n, "unknown") for n in names)
+        c.execute(f"prepare {name} ({types}) as\n{text}")
+        statements[name] = True
+        while len(statements) > PreparedStatementsPerConnection:
+            old_name, _ = statements.popitem(last=False)
+            c.execute(f"deallocate {old_name}")
+    placeholders = ", ".join(["%s"] * len(names))
+    c.execute(f"execute {name} ({placeholders})", [params[n] for n in names])
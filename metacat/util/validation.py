@@ -1,4 +1,6 @@
-import re
+import re, json
+from threading import RLock
+from collections import OrderedDict
 
 def validate_metadata(definitions, restricted, metadata={}, name=None, value=None):
     """
@@ -33,115 +35,194 @@ def validate_metadata(definitions, restricted, metadata={}, name=None, value=Non
         empty list indicates that validation succeeded
     """
 
-    definitions = definitions or {}
-    
-    metadata = (metadata or {}).copy()
-    if name is not None:
-        metadata[name] = value
+    return MetadataValidator(definitions, restricted).validate(metadata, name, value)
 
-    errors = []
-    for name, value in metadata.items():
-        
-        definition = definitions.get(name)
-        if definition is None:    
-            if restricted:
-                errors.append((name, "parameter not allowed in restricted category"))
-            continue
-
-        typ = definition.get("type")
-        type_mismatch = False
-        repv = repr(value)
-        if typ is not None:
-            if typ == "any":
+#
+# Definitions compiled into per-parameter check functions: type checks, regexp patterns compiled once,
+# enumerations converted to sets. MetadataValidator(...).validate() returns the same errors as validate_metadata()
+#
+
+_ListTypes = {
+    # type -> (element type, error message if the value is not a list, error message if an element has wrong type)
+    "int[]":        (int,   "list of ints required instead of {repv}",      "list of ints required instead of {repv}"),
+    "float[]":      (float, "list of floats required",                      "list of floats required instead of {repv}"),
+    "text[]":       (str,   "list of strings required",                     "list of strings required instead of {repv}"),
+    "boolean[]":    (bool,  "list of booleans required",                    "list of booleans required instead of {repv}")
+}
+
+_ScalarTypes = {
+    "int":          (int,   "scalar int value required instead of {repv}"),
+    "float":        (float, "scalar float value required instead of {repv}"),
+    "text":         (str,   "scalar text value required instead of {repv}"),
+    "boolean":      (bool,  "scalar boolean value required instead of {repv}"),
+    "dict":         (dict,  "dict value required instead of {repv}"),
+    "list":         (list,  "list value required instead of {repv}")
+}
+
+def _membership(values):
+    # fast membership test for the enumeration, falls back to the list scan for unhashable values
+    try:    value_set = frozenset(values)
+    except TypeError:
+        return lambda x: x in values
+    def contains(x):
+        try:    return x in value_set
+        except TypeError:
+            return x in values
+    return contains
+
+def _type_check(typ):
+    # returns function(value) -> list of error messages, or None if the type is not checked
+    if typ in _ScalarTypes:
+        scalar_type, message = _ScalarTypes[typ]
+        def check(value):
+            if isinstance(value, scalar_type):
+                return ()
+            return [message.format(repv=repr(value))]
+        return check
+    elif typ in _ListTypes:
+        item_type, not_list_message, item_message = _ListTypes[typ]
+        def check(value):
+            messages = []
+            if not isinstance(value, list):
+                messages.append(not_list_message.format(repv=repr(value)))
+            if not all(isinstance(x, item_type) for x in value):
+                messages.append(item_message.format(repv=repr(value)))
+            return messages
+        return check
+    return None
+
+def _value_checks(typ, definition):
+    # returns list of functions(value) -> error message or None
+    checks = []
+    if typ in ("boolean", "boolean[]", "list", "dict", "any"):
+        return checks
+    if "values" in definition:
+        contains = _membership(definition["values"])
+        def check_values(value):
+            if isinstance(value, list):
+                if not all(contains(x) for x in value): return f"value in {value} is not allowed"
+            elif not contains(value):
+                return f"value {value!r} is not allowed"
+        checks.append(check_values)
+        return checks
+    if "pattern" in definition and typ in ("text", "text[]"):
+        pattern = definition["pattern"]
+        match = re.compile(pattern).match
+        def check_pattern(value):
+            if isinstance(value, list):
+                if not all(match(v) is not None for v in value):
+                    return f"value in {value} does not match the pattern '{pattern}'"
+            elif match(value) is None:
+                return f"value {value} does not match the pattern '{pattern}'"
+        checks.append(check_pattern)
+    if "min" in definition:
+        vmin = definition["min"]
+        def check_min(value):
+            if isinstance(value, list):
+                if not all(x >= vmin for x in value):
+                    return f"value in {value} out of range (min:{vmin})"
+            elif value < vmin:
+                return f"value {value} out of range (min:{vmin})"
+        checks.append(check_min)
+    if "max" in definition:
+        vmax = definition["max"]
+        def check_max(value):
+            if isinstance(value, list):
+                if not all(x <= vmax for x in value):
+                    return f"value in {value} out of range (max:{vmax})"
+            elif value > vmax:
+                return f"value {value} out of range (max:{vmax})"
+        checks.append(check_max)
+    return checks
+
+def _compile_definition(definition):
+    # returns function(value) -> list of error messages, or None if any value is valid
+    typ = definition.get("type")
+    if typ == "any":
+        return None
+    type_check = _type_check(typ)
+    value_checks = _value_checks(typ, definition)
+    if type_check is None and not value_checks:
+        return None
+
+    def check(value):
+        if type_check is not None:
+            messages = type_check(value)
+            if messages:
+                return messages
+        messages = []
+        for value_check in value_checks:
+            message = value_check(value)
+            if message is not None:
+                messages.append(message)
+        return messages
+    return check
+
+class MetadataValidator(object):
+
+    def __init__(self, definitions, restricted):
+        definitions = definitions or {}
+        self.Restricted = restricted
+        self.Checks = {name: _compile_definition(definition) for name, definition in definitions.items()
+                        if definition is not None}
+        self.Required = [name for name, definition in definitions.items() if definition and definition.get("required")]
+
+    def validate(self, metadata={}, name=None, value=None):
+        # returns list of tuples (name, error), see validate_metadata()
+        metadata = metadata or {}
+        if name is not None:
+            metadata = metadata.copy()
+            metadata[name] = value
+
+        errors = []
+        checks = self.Checks
+        for name, value in metadata.items():
+            try:
+                check = checks[name]
+            except KeyError:
+                if self.Restricted:
+                    errors.append((name, "parameter not allowed in restricted category"))
                 continue
-        
-        
-            if typ == "int" and not isinstance(value, int): 
-                errors.append((name, f"scalar int value required instead of {repv}"))
-                type_mismatch = True
-            elif typ == "float" and not isinstance(value, float): 
-                errors.append((name, f"scalar float value required instead of {repv}"))
-                type_mismatch = True
-            elif typ == "text" and not isinstance(value, str): 
-                errors.append((name, f"scalar text value required instead of {repv}"))
-                type_mismatch = True
-            elif typ == "boolean" and not isinstance(value, bool): 
-                errors.append((name, f"scalar boolean value required instead of {repv}"))
-                type_mismatch = True
-            elif typ == "dict" and not isinstance(value, dict): 
-                errors.append((name, f"dict value required instead of {repv}"))
-                type_mismatch = True
-            elif typ == "list" and not isinstance(value, list): 
-                errors.append((name, f"list value required instead of {repv}"))
-                type_mismatch = True
-
-            elif typ == "int[]":
-                if not isinstance(value, list): 
-                    errors.append((name, f"list of ints required instead of {repv}"))
-                    type_mismatch = True
-                if not all(isinstance(x, int) for x in value): 
-                    errors.append((name, f"list of ints required instead of {repv}"))
-                    type_mismatch = True
-
-            elif typ == "float[]":
-                if not isinstance(value, list): 
-                    errors.append((name, f"list of floats required"))
-                    type_mismatch = True
-                if not all(isinstance(x, float) for x in value): 
-                    errors.append((name, f"list of floats required instead of {repv}"))
-                    type_mismatch = True
-            
-            elif typ == "text[]":
-                if not isinstance(value, list): 
-                    errors.append((name, f"list of strings required"))
-                    type_mismatch = True
-                if not all(isinstance(x, str) for x in value): 
-                    errors.append((name, f"list of strings required instead of {repv}"))
-                    type_mismatch = True
-            
-            elif typ == "boolean[]":
-                if not isinstance(value, list): 
-                    errors.append((name, f"list of booleans required"))
-                    type_mismatch = True
-                if not all(isinstance(x, bool) for x in value): 
-                    errors.append((name, f"list of booleans required instead of {repv}"))
-                    type_mismatch = True
-        
-        if not type_mismatch:
-            if not typ in ("boolean", "boolean[]", "list", "dict", "any"):
-                if "values" in definition:
-                    values = definition["values"]
-                    if isinstance(value, list):
-                        if not all(x in values for x in value): errors.append((name, f"value in {value} is not allowed"))
-                    else:
-                        if not value in values: errors.append((name, f"value {repv} is not allowed"))
-                else:
-                    if "pattern" in definition and typ in ("text", "text[]"):
-                        pattern = definition["pattern"]
-                        r = re.compile(pattern)
-                        if isinstance(value, list):
-                            if not all(r.match(v) is not None for v in value):  
-                                errors.append((name, f"value in {value} does not match the pattern '{pattern}'"))
-                        else:
-                            if r.match(value) is None:
-                                errors.append((name, f"value {value} does not match the pattern '{pattern}'"))
-                    if "min" in definition:
-                        vmin = definition["min"]
-                        if isinstance(value, list):
-                            if not all(x >= vmin for x in value):   
-                                errors.append((name, f"value in {value} out of range (min:{vmin})"))
-                        else:
-                            if value < vmin:    
-                                errors.append((name, f"value {value} out of range (min:{vmin})"))
-                    if "max" in definition:
-                        vmax = definition["max"]
-                        if isinstance(value, list):
-                            if not all(x <= vmax for x in value):   errors.append((name, f"value in {value} out of range (max:{vmax})"))
-                        else:
-                            if value > vmax:    errors.append((name, f"value {value} out of range (max:{vmax})"))
-
-    for dname, definition in definitions.items():
-        if definition.get("required") and dname not in metadata:
-            errors.append((dname, "required parameter is missing"))
-    
-    return errors
\ No newline at end of file
+            if check is not None:
+                for message in check(value):
+                    errors.append((name, message))
+
+        for name in self.Required:
+            if name not in metadata:
+                errors.append((name, "required parameter is missing"))
+        return errors
+
+    __call__ = validate
+
+class _ValidatorRegistry(object):
+    #
+    # Process-wide LRU cache of compiled validators keyed by the definitions content, so that a changed
+    # category or dataset definition gets its own validator
+    #
+
+    def __init__(self, capacity=1000):
+        self.Capacity = capacity
+        self.Validators = OrderedDict()
+        self.Lock = RLock()
+
+    def validator(self, definitions, restricted=False):
+        try:    key = (json.dumps(definitions or {}, sort_keys=True, default=str), bool(restricted))
+        except TypeError:
+            return MetadataValidator(definitions, restricted)
+        with self.Lock:
+            validator = self.Validators.get(key)
+            if validator is not None:
+                self.Validators.move_to_end(key)
+                return validator
+        validator = MetadataValidator(definitions, restricted)
+        with self.Lock:
+            self.Validators[key] = validator
+            while len(self.Validators) > self.Capacity:
+                self.Validators.popitem(last=False)
+        return validator
+
+_Registry = _ValidatorRegistry()
+
+def metadata_validator(definitions, restricted=False):
+    # compiled validator for the definitions from the process-wide registry
+    return _Registry.validator(definitions, restricted)
@@ -151,7 +151,7 @@ class HTTPClient(object):
         if headers:
             default_headers.update(headers)
         headers = default_headers
-        self.LastResponse = response = self.retry_request(method, url, headers=headers, **args)
+        self.LastResponse = response = self.retry_request(method, url, headers=headers, timeout=timeout, **args)
         self.LastStatusCode = response.status_code
         #print("webapi.send_request: status:", response.status_code)
         if response.status_code == INVALID_METADATA_ERROR_CODE:
@@ -759,7 +759,8 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
             info["auto_name"] = auto_name
         return self.declare_files(dataset_did, [info])[0]
 
-    def declare_files(self, dataset, files, namespace=None, dry_run=False, as_required=None):
+    def declare_files(self, dataset, files, namespace=None, dry_run=False, as_required=None, 
+                stream=False, chunk_size=10000, commit="all"):
         """Declare new files and add them to an existing dataset. Requires client authentication.
         
         Arguments
@@ -776,11 +777,25 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
             If true, run all the necessary checks but stop short of actual file declaraion or adding to a dataset. 
             If not all checks are successful, generate eirher InvalidMetadataError or WebApiError.
             Default: False = do declare
+        stream : boolean
+            If true, ``files`` can be any iterable, e.g. a generator. The files are uploaded as newline-delimited JSON
+            while they are generated, and the server declares them in chunks as they arrive. ``as_required`` is ignored.
+        chunk_size : int
+            Streaming mode only: number of files declared by the server at once
+        commit : str
+            Streaming mode only: "all" - declare all files or none, "chunk" - commit each chunk separately, so that
+            a failed chunk does not affect the others
 
         Returns
         -------
         list
             list of dictionaries, one dictionary per file with file ids: { "fid": "..." }
+        generator
+            in streaming mode, yields one dictionary per chunk:
+            { "chunk": ..., "first_index": ..., "items": ..., "status": "declared" | "failed" | "skipped", 
+            "files": [{"fid": ..., "namespace": ..., "name": ...}, ...], "errors": [...] }
+            and then the summary: { "summary": {"status": "committed" | "rolled back" | "dry run", 
+            "chunks": ..., "declared": ..., "failed": ...} }
         
         Notes
         -----
@@ -824,29 +839,10 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
         if isinstance(files, dict):
             files = [files]                     # convenience
 
-        lst = []
-
-        for i, item in enumerate(files):
-            f = item.copy()
-            namespace = f.get("namespace", default_namespace)
-            if "did" in f:
-                if "name" in f or "namespace" in f:
-                    raise ValueError(f"Both DID and namespace/name specified for {did}")
-                did = f.pop("did")
-                namespace, name = parse_name(did, default_namespace)
-                f["name"] = name
-            f["namespace"] = namespace
-            size = f.get("size")
-            if not isinstance(size, int) or size < 0:
-                raise ValueError(f"File size is unspecified or invalid for file #{i} in the list")
-
-            meta = item.get("metadata", {})
-            for k in meta.keys():
-                if '.' not in k:
-                    raise ValueError(f'Invalid metadata key "{k}" for file #{i} in the list: metadata key must contain dot (.)')
-
-            f["metadata"] = meta
-            lst.append(f)
+        if stream:
+            return self._declare_files_stream(dataset, files, default_namespace, dry_run, chunk_size, commit)
+
+        lst = [self._file_to_declare(i, item, default_namespace) for i, item in enumerate(files)]
 
         url = f"data/declare_files?dataset={dataset}"
         if dry_run: url += "&dry_run=yes"
@@ -874,6 +870,40 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
                 raise
         #print("webapi: declare_files: out:", out)
         return out
+
+    def _file_to_declare(self, i, item, default_namespace):
+        f = item.copy()
+        namespace = f.get("namespace", default_namespace)
+        if "did" in f:
+            if "name" in f or "namespace" in f:
+                raise ValueError(f"Both DID and namespace/name specified for {did}")
+            did = f.pop("did")
+            namespace, name = parse_name(did, default_namespace)
+            f["name"] = name
+        f["namespace"] = namespace
+        size = f.get("size")
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f"File size is unspecified or invalid for file #{i} in the list")
+
+        meta = item.get("metadata", {})
+        for k in meta.keys():
+            if '.' not in k:
+                raise ValueError(f'Invalid metadata key "{k}" for file #{i} in the list: metadata key must contain dot (.)')
+
+        f["metadata"] = meta
+        return f
+
+    def _declare_files_stream(self, dataset, files, default_namespace, dry_run, chunk_size, commit):
+        def lines():
+            for i, item in enumerate(files):
+                yield (json.dumps(self._file_to_declare(i, item, default_namespace)) + "\n").encode("utf-8")
+
+        url = f"data/declare_files?dataset={dataset}&chunk_size={chunk_size}&commit={commit}"
+        if dry_run: url += "&dry_run=yes"
+        # the generator body can be sent only once, so do not retry
+        response = self.send_request("post", url, data=lines(), stream=True, timeout=0,
+                    headers={"Content-Type": "application/x-ndjson", "Accept": "application/x-ndjson, text/plain"})
+        return self.unpack_json_seq(response)
         
     def move_files(self, namespace, file_list=None, query=None):
         """
@@ -1314,6 +1344,9 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
             "count" - return [{"count": n, "total_size": nbytes }]
             "keys" - return list of list of all top level metadata keys for the selected files
             ``summary`` can not be used together with ``save_as`` or ``add_to``
+        batch_size : int
+            if > 0, retrieve the results in pages of ``batch_size`` files using continuation tokens.
+            The files will be returned in the order of their creation time.
 
         Returns
         -------
@@ -1351,21 +1384,138 @@ class MetaCatClient(HTTPClient, TokenAuthClientMixin):
                 url += "&include_retired_files=yes"
             url += f"&trimquery={trimquery}"
             if batch_size > 0:
-                offset = 0
-                count = batch_size
-                while count == batch_size:
-                    batch_query = f"({query}) ordered skip {offset} limit {batch_size}"
-                    results = self.post_json(url, batch_query)
-                    count = 0
-                    for item in results:
-                        count = count + 1
-                        yield item
-                    offset = offset + batch_size
+                # keyset pagination: the server returns the files in (created_timestamp, id) order
+                # along with the continuation token for the next page
+                page_url = url + f"&page_size={batch_size}"
+                while page_url:
+                    page = self.post_json(page_url, query)
+                    yield from page["files"]
+                    next_token = page.get("next")
+                    page_url = None
+                    if next_token:
+                        page_url = url + f"&page_size={batch_size}&page_after={next_token}"
+                        if save_as:
+                            # the dataset was created with the first page
+                            page_url = page_url.replace(f"&save_as={save_as}", f"&add_to={save_as}")
             else:
                 results = self.post_json(url, query)
                 for item in results:
                     yield item
 
+    def explain_query(self, query, mode="plan", namespace=None, with_metadata=False, with_provenance=False,
+                        include_retired_files=False):
+        """Get diagnostic information about how the server executes a file query.
+
+        Arguments
+        ---------
+        query : str
+            Query in MQL
+        mode : str
+            "plan" - compile the query and show the execution plan without running it
+            "analyze" - run the query and collect row counts and timing for each query tree node
+        namespace : str
+            default namespace for the query
+        include_retired_files:
+            boolean, whether to include retired files into the query results, default=False
+        with_metadata : boolean
+            whether to query file metadata
+        with_provenance : boolean
+            whether to query parents and children list
+
+        Returns
+        -------
+        dict
+            "phases" - list of {"phase":..., "time":...} for parsing, optimizer passes, compilation and execution
+            "plan" - compiled query tree. Each node has "node" type, "rows", "time" and "children". SQL nodes
+            also have "sql", "params" and "explain" - Postgres EXPLAIN output in JSON format
+        """
+        assert mode in ("plan", "analyze")
+        url = "data/query?explain=%s&with_meta=%s&with_provenance=%s" % (mode,
+                "yes" if with_metadata else "no","yes" if with_provenance else "no")
+        if namespace:
+            url += f"&namespace={namespace}"
+        if include_retired_files:
+            url += "&include_retired_files=yes"
+        url += f"&trimquery={query[:255]}"
+        return self.post_json(url, query)
+
+    def query_arrow(self, query, columns=None, namespace=None, include_retired_files=False):
+        """Run file query and get the results as Arrow table. Requires pyarrow module.
+
+        Arguments
+        ---------
+        query : str
+            Query in MQL
+        columns : list of str
+            file attributes (fid, namespace, name, size, creator, created_timestamp, updated_by, updated_timestamp,
+            retired, retired_by, retired_timestamp, checksums) and metadata keys to return as columns.
+            Default: fid, namespace, name, size, created_timestamp
+        namespace : str
+            default namespace for the query
+        include_retired_files:
+            boolean, whether to include retired files into the query results, default=False
+
+        Returns
+        -------
+        pyarrow.Table
+            one row per file. The type of a metadata column is determined by the server from the first batch of
+            the results. Metadata values of other types are returned as nulls. Non-scalar values are returned as JSON strings
+        """
+        from metacat.util.arrow import import_pyarrow, ArrowStreamContentType
+        pa = import_pyarrow()
+        url = "data/query?format=arrow"
+        if columns:
+            url += "&columns=" + quote_plus(",".join(columns))
+        if namespace:
+            url += f"&namespace={namespace}"
+        if include_retired_files:
+            url += "&include_retired_files=yes"
+        url += f"&trimquery={query[:255]}"
+        response = self.send_request("post", url, data=query, stream=True,
+                    headers={"Accept": f"{ArrowStreamContentType}, text/plain"})
+        response.raw.decode_content = True
+        return pa.ipc.open_stream(response.raw).read_all()
+
+    def export_query(self, query, format="csv", metadata=None, namespace=None, include_retired_files=False,
+                        chunk_size=1024*1024):
+        """Export file query results in bulk. The query must not use filters.
+
+        Arguments
+        ---------
+        query : str
+            Query in MQL
+        format : str
+            "csv" - CSV with header line, one column per file attribute and per metadata key
+            "ndjson" - one JSON object per line, in the same format as returned by ``query()``
+        metadata : str or list or None
+            "all" - include all metadata, list of str - metadata keys to include, None - do not include metadata
+        namespace : str
+            default namespace for the query
+        include_retired_files:
+            boolean, whether to include retired files into the query results, default=False
+        chunk_size : int
+            size of the chunks to yield
+
+        Returns
+        -------
+        generator
+            yields the exported data as bytes in chunks
+        """
+        assert format in ("csv", "ndjson")
+        url = f"data/export?format={format}"
+        if metadata:
+            if not isinstance(metadata, str):
+                metadata = ",".join(metadata)
+            url += f"&metadata={quote_plus(metadata)}"
+        if namespace:
+            url += f"&namespace={namespace}"
+        if include_retired_files:
+            url += "&include_retired_files=yes"
+        url += f"&trimquery={query[:255]}"
+        response = self.send_request("post", url, data=query, stream=True,
+                    headers={"Accept": "text/csv, application/x-ndjson, text/plain"})
+        yield from response.iter_content(chunk_size)
+
     def async_query(self, query, data=None, **args):
         """Run the query asynchronously. Requires client authentication if save_as or add_to are used.
         
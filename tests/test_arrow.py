@@ -0,0 +1,19 @@
+from env import env
+import pytest
+
+from metacat.util.arrow import arrow_stream
+
+def test_arrow_stream():
+    pa = pytest.importorskip("pyarrow")
+    columns = ["fid", "size", "core.runs", "x.list"]
+    batches = [
+        [("f1", 10, 1, [1, 2]), ("f2", None, 2, None)],
+        [("f3", 30, "bad", [3])]
+    ]
+    data = b"".join(arrow_stream(columns, batches))
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.column_names == columns
+    assert table.column("core.runs").to_pylist() == [1, 2, None]
+    assert table.column("x.list").to_pylist() == ["[1, 2]", None, "[3]"]
+    empty = pa.ipc.open_stream(b"".join(arrow_stream(columns, []))).read_all()
+    assert empty.num_rows == 0
@@ -0,0 +1,50 @@
+from env import env
+
+import time
+from metacat.auth.auth_cache import AuthCache
+from metacat.auth import AuthenticationCore
+from metacat.common import SignedToken
+
+def test_ttl_and_expiration():
+    cache = AuthCache(capacity=10, ttl=0.2)
+    cache.put("a", 1)
+    cache.put("b", 2, expiration=time.time() + 0.05)       # entry expires before the TTL
+    assert cache.get("a") == 1 and cache.get("b") == 2
+    time.sleep(0.1)
+    assert cache.get("a") == 1 and cache.get("b") is None
+    time.sleep(0.15)
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["hits"] == 3 and stats["misses"] == 2 and stats["size"] == 0
+
+def test_capacity_and_invalidation():
+    cache = AuthCache(capacity=2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)                                       # "b" is least recently used
+    assert cache.get("b") is None and cache.get("a") == 1
+    cache.invalidate("a")
+    assert cache.get("a") is None and cache.get("c") == 3
+    cache.invalidate()
+    assert cache.get("c") is None
+
+def test_disabled():
+    cache = AuthCache(ttl=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+def test_verified_token_cache():
+    core = AuthenticationCore.__new__(AuthenticationCore)
+    core.TokenSecret = b"0123456789abcdef0123456789abcdef"
+    core.TokenCache = AuthCache()
+    encoded = SignedToken({}, subject="alice", expiration=3600).encode(core.TokenSecret)
+    token, error = core.verify_token(encoded)
+    assert error is None and token.subject == "alice"
+    assert core.verify_token(encoded)[0] is token
+    assert core.TokenCache.stats()["hits"] == 1
+
+    forged = encoded[:-4] + ("AAAA" if encoded[-4:] != "AAAA" else "BBBB")
+    token, error = core.verify_token(forged)
+    assert token is None and error
+    assert core.TokenCache.stats()["size"] == 1             # failed verifications are not cached
@@ -221,6 +221,13 @@ def test_metacat_query_mql_batch_size(auth, tst_file_md_list, tst_ds):
     for md in tst_file_md_list[:-1]:
         assert data.find(md["name"]) >= 0
 
+def test_metacat_query_mql_batch_size_1(auth, tst_file_md_list, tst_ds):
+    # every file must be returned exactly once across the pages
+    with os.popen(f"metacat query --batch_size=1 files from {tst_ds}", "r") as fin:
+        data = fin.read()
+    for md in tst_file_md_list[:-1]:
+        assert data.count(md["name"]) == 1
+
 def test_metacat_query_ds_1(auth, tst_file_md_list, tst_ds):
     with os.popen(f"metacat query datasets matching {tst_ds}", "r") as fin:
         data = fin.read()
@@ -0,0 +1,126 @@
+from env import env
+
+import time, threading, gc
+import pytest
+from metacat.common import DBConnectionPool, PoolTimeoutError
+
+class Cursor:
+    def __init__(self, conn):
+        self.Conn = conn
+
+    def execute(self, sql, args=()):
+        if self.Conn.Broken:
+            raise RuntimeError("connection broken")
+        self.Conn.Executed.append((sql, args))
+        self.Conn.Status = 0 if sql in ("commit", "rollback") else 2
+
+    def fetchone(self):
+        return (1,)
+
+class Connection:
+    def __init__(self, connstr):
+        self.closed = 0
+        self.Broken = False
+        self.Executed = []
+        self.Status = 0
+        self.Commits = 0
+        self.Rollbacks = 0
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.Commits += 1
+        self.Status = 0
+
+    def rollback(self):
+        self.Rollbacks += 1
+        self.Status = 0
+
+    def get_transaction_status(self):
+        return self.Status
+
+    def close(self):
+        self.closed = 1
+
+def test_lease_and_reuse():
+    pool = DBConnectionPool("dbname=test", min_connections=2, schema="s", session_settings={"work_mem": "64MB"},
+                connect=Connection)
+    assert pool.prewarm() == 2
+    raw = pool.Idle[-1][0]
+    assert raw.Executed == [("select set_config('search_path', %s, false)", ("s",)),
+                            ("select set_config(%s, %s, false)", ("work_mem", "64MB"))]
+    conn = pool.connect()
+    assert conn.Connection is raw
+    conn.cursor().execute("insert ...")
+    stats = pool.stats()
+    assert stats["leased"] == 1 and stats["idle"] == 1
+    del conn
+    gc.collect()
+    assert raw.Commits == 1 and raw.Rollbacks == 1      # uncommitted work is rolled back when the lease is released
+    stats = pool.stats()
+    assert stats["leased"] == 0 and stats["idle"] == 2 and stats["created"] == 2 and stats["leases"] == 1
+
+def test_many_to_many_commits():
+    # writes done outside of a transaction commit explicitly, because the pool rolls back on release
+    from metacat.common import DBManyToMany
+    pool = DBConnectionPool("dbname=test", connect=Connection)
+    conn = pool.connect()
+    raw = conn.Connection
+    DBManyToMany(conn, "users_roles", "role_name", username="u").add("r")
+    assert raw.Executed[-1] == ("commit", ())
+    conn.close()
+    assert raw.Rollbacks == 0
+
+def test_cursor_keeps_lease():
+    pool = DBConnectionPool("dbname=test", min_connections=0, connect=Connection)
+    c = pool.connect().cursor()
+    assert pool.stats()["leased"] == 1
+    c.execute("select ...")
+    del c
+    gc.collect()
+    assert pool.stats()["leased"] == 0
+
+def test_wait_and_timeout():
+    pool = DBConnectionPool("dbname=test", max_connections=1, max_wait=0.1, connect=Connection)
+    conn = pool.connect()
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    threading.Timer(0.1, conn.close).start()
+    pool.MaxWait = 5
+    conn2 = pool.connect()
+    stats = pool.stats()
+    assert stats["timeouts"] == 1 and stats["waits"] == 1 and stats["connections"] == 1
+    conn2.close()
+
+def test_health_check():
+    pool = DBConnectionPool("dbname=test", min_connections=1, health_check_interval=0, connect=Connection)
+    pool.prewarm()
+    broken = pool.Idle[-1][0]
+    broken.Broken = True
+    time.sleep(0.01)
+    conn = pool.connect()
+    assert conn.Connection is not broken and broken.closed
+    assert pool.stats()["health_check_failures"] == 1 and pool.stats()["connections"] == 1
+
+def test_idle_trimming():
+    pool = DBConnectionPool("dbname=test", min_connections=1, max_idle_connections=1, idle_timeout=0, connect=Connection)
+    leases = [pool.connect() for _ in range(3)]
+    for conn in leases:
+        conn.close()
+    stats = pool.stats()
+    assert stats["connections"] == 1 and stats["idle"] == 1 and stats["closed"] == 2
+
+def test_connection_per_request(monkeypatch):
+    pytest.importorskip("webpie")
+    from metacat.auth.server.base_server import BaseApp, WPApp
+    app = BaseApp.__new__(BaseApp)
+    app.DB = app.UserDB = DBConnectionPool("dbname=test", min_connections=0, connect=Connection)
+    app.RequestConnection = True
+    app.RequestScope = threading.local()
+    monkeypatch.setattr(WPApp, "__call__", lambda self, environ, start_response: (self.connect(), self.user_db()))
+    first, second = app({}, None)
+    assert first is second and app.DB.stats()["leased"] == 1
+    other, _ = app({}, None)
+    assert other is not first
+    assert app.connect() is not app.connect()           # outside of a request, each call leases a connection
@@ -0,0 +1,47 @@
+from env import env
+
+import json
+import pytest
+from metacat.webapi import MetaCatClient
+from metacat.common import SignedToken
+
+def make_client(tmp_path):
+    token = SignedToken({}, subject="alice", expiration=3600).encode(b"0123456789abcdef0123456789abcdef")
+    return MetaCatClient("http://localhost:8080/metacat", token=token, token_library=str(tmp_path / "tokens"))
+
+class Response:
+    def __init__(self, lines):
+        self.Lines = lines
+
+    def iter_lines(self):
+        return iter(self.Lines)
+
+def test_streaming_upload(monkeypatch, tmp_path):
+    client = make_client(tmp_path)
+    sent = {}
+    def send_request(method, uri_suffix, data=None, timeout=None, **args):
+        sent["timeout"] = timeout
+        sent["url"] = uri_suffix
+        sent["headers"] = args.get("headers")
+        sent["body"] = b"".join(data)
+        return Response([
+            json.dumps({"chunk": 0, "first_index": 0, "items": 2, "status": "declared", "files": []}).encode(),
+            json.dumps({"summary": {"status": "committed", "chunks": 1, "declared": 2, "failed": 0}}).encode()
+        ])
+    monkeypatch.setattr(client, "send_request", send_request)
+
+    files = ({"did": f"test:f{i}.dat", "size": i} for i in range(2))
+    reports = list(client.declare_files("test:ds", files, stream=True, chunk_size=100, commit="chunk"))
+
+    assert sent["url"] == "data/declare_files?dataset=test:ds&chunk_size=100&commit=chunk"
+    assert sent["headers"]["Content-Type"] == "application/x-ndjson"
+    assert sent["timeout"] == 0
+    lines = [json.loads(l) for l in sent["body"].decode().split("\n") if l]
+    assert lines == [{"size": 0, "name": "f0.dat", "namespace": "test", "metadata": {}},
+                     {"size": 1, "name": "f1.dat", "namespace": "test", "metadata": {}}]
+    assert reports[-1]["summary"]["declared"] == 2
+
+def test_streaming_item_validation(tmp_path):
+    client = make_client(tmp_path)
+    with pytest.raises(ValueError):
+        client._file_to_declare(0, {"name": "f.dat", "namespace": "test", "size": 1, "metadata": {"x": 1}}, None)
@@ -0,0 +1,20 @@
+from env import env
+
+from metacat.mql import MQLQuery, QueryProfile
+from metacat.mql.explain import _NodeStats
+from metacat.common.trees import Node
+
+def test_phases():
+    profile = QueryProfile()
+    q = MQLQuery.parse("files from test:explain_ds where x.y = 1 limit 10", profile=profile)
+    q.compile(profile=profile)
+    phases = [name for name, t in profile.Phases]
+    assert phases[:2] == ["parse", "convert"]
+    assert "optimize: MetaExpPusher" in phases and phases[-1] == "compile: SQLConverter"
+    assert all(t >= 0 for name, t in profile.Phases)
+
+def test_node_stats():
+    stats = _NodeStats(Node("filter", [], name="sample"))
+    assert list(stats.counted(iter(range(5)))) == list(range(5))
+    out = stats.as_jsonable()
+    assert out["rows"] == 5 and out["data"] == {"name": "sample"}
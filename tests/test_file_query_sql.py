@@ -0,0 +1,226 @@
+from env import env
+
+from metacat.mql import MQLQuery
+
+def compiled_sql(text, **options):
+    return MQLQuery.parse(text).compile(**options)["sql"]
+
+def test_dataset_semi_join():
+    sql = compiled_sql("files from test:a, matching test:b* with subsets recursively where x.y > 1", with_meta=True)
+    assert "select distinct f_" not in sql       # datasets are still deduplicated by name, but files are not
+    assert "exists" in sql
+
+def test_provenance_not_joined():
+    sql = compiled_sql("parents(files from test:a where x.y > 1)", with_provenance=True)
+    assert "files_with_provenance" not in sql
+
+def test_json_rows():
+    q = MQLQuery.parse("files from test:a where x.y > 1 limit 5")
+    compiled = q.compile(with_meta=True, as_json=True)
+    assert compiled.T == "sql" and compiled["as_json"]
+    assert "jsonb_build_object" in compiled["sql"] and "'metadata'" in compiled["sql"]
+    compiled = q.compile(with_meta=True, with_provenance=True, as_json=True)
+    assert compiled.T == "json_rows"            # provenance is loaded in batches, not per file in SQL
+    compiled = MQLQuery.parse("filter sample(1)(files from test:a)").compile(as_json=True)
+    assert compiled.T == "json_rows"            # Python filters produce DBFile objects
+
+def test_export_sql():
+    from metacat.db import DBFileSet
+    from metacat.util import SQLParams
+    compiled = MQLQuery.parse("files from test:a where x.y > 1").compile(with_meta=True)
+    params = SQLParams(compiled["params"])
+    copy_sql = DBFileSet.sql_for_export(compiled["sql"], params, "csv", ["core.runs", 'a"b'])
+    assert copy_sql.startswith("copy (") and copy_sql.endswith("to stdout with (format csv, header)")
+    assert '"core.runs"' in copy_sql and '"a""b"' in copy_sql
+    assert "core.runs" in params.values()
+    copy_sql = DBFileSet.sql_for_export(compiled["sql"], params, "ndjson", with_meta=True)
+    assert "jsonb_build_object" in copy_sql
+
+def test_project_columns():
+    compiled = MQLQuery.parse("files from test:a where x.y > 1").compile(columns=["fid", "size", "core.runs"])
+    assert compiled.T == "sql" and compiled["as_rows"]
+    assert "core.runs" in compiled["params"].values()
+    compiled = MQLQuery.parse("filter sample(1)(files from test:a)").compile(columns=["fid"])
+    assert compiled.T == "project"
+
+class MaterializingDB:
+    # records the SQL and COPY data sent to the database
+
+    class Cursor:
+        def __init__(self, log):
+            self.Log = log
+        def execute(self, sql, *params):
+            self.Log.append(sql)
+        def copy_from(self, f, table, columns=None):
+            self.Log.append((table, f.read()))
+
+    def __init__(self):
+        self.Log = []
+
+    def cursor(self):
+        return self.Cursor(self.Log)
+
+class ReplicaFilter:
+    # adds metadata to the files, like rucio_replicas
+
+    class File:
+        def __init__(self, fid):
+            self.FID = fid
+            self.Metadata = {"x.y": 2, "x.s": "a\\b", "rucio.rses": ["A"]}
+
+    def run(self, queries, params, kw, **options):
+        return [self.File("a1"), self.File("a2")]
+
+def materialized_sql(query):
+    from metacat.mql.query_executor import FileQueryExecutor
+    compiled = MQLQuery.parse(query).compile(with_meta=True)
+    assert compiled.T != "sql"
+    db = MaterializingDB()
+    result = FileQueryExecutor(db, {"replicas": ReplicaFilter()})(compiled)
+    return db.Log, result.SQL
+
+def test_filter_output_materialized():
+    log, sql = materialized_sql("join(filter replicas()(files from test:a), files from test:b)")
+    meta = '{"x.y": 2, "x.s": "a\\\\\\\\b", "rucio.rses": ["A"]}'
+    assert ("temp_filter_1", f"a1\t{meta}\na2\t{meta}\n") in log
+    assert "temp_filter_1" in sql
+
+def test_materialized_set_operations():
+    # the metadata in the temp table differs from the metadata in the files table,
+    # so the branches must be combined by file id, not by the whole row
+    log, sql = materialized_sql("join(filter replicas()(files from test:a), files from test:b)")
+    assert "intersect" not in sql and "distinct on" in sql
+    assert sql.index("temp_filter_1") < sql.index(".id in (")       # the modified metadata is taken from the filter branch
+
+    log, sql = materialized_sql("union(files from test:b, filter replicas()(files from test:a))")
+    assert "union all" in sql and "distinct on" in sql
+    assert "\nunion\n" not in sql
+
+    log, sql = materialized_sql("filter replicas()(files from test:a) - files from test:b")
+    assert "except" not in sql and "not exists" in sql
+
+def test_filter_pushdown():
+    from metacat.filters import standard_filters
+    for query, fragment in [
+                ("filter sample(0.01)(files from test:a)", "row_number() over ()"),
+                ("filter stride(10, 3)(files from test:a) limit 5", "row_number() over ()"),
+                ("filter hash(10, 3)(files from test:a where x.y > 1)", "get_byte("),
+                ("filter randomize(seed=5)(files from test:a)", "order by md5("),
+            ]:
+        compiled = MQLQuery.parse(query).compile(filters=standard_filters)
+        assert compiled.T == "sql" and fragment in compiled["sql"]
+    compiled = MQLQuery.parse("filter mix(1, 2)(files from test:a, files from test:b)").compile(filters=standard_filters)
+    assert compiled.T == "filter"
+
+def test_sample_sql_matches_filter():
+    # the rows selected by the SQL rewrite of sample(), run with SQLite, are the rows selected by the filter
+    import re, sqlite3
+    from metacat.db import DBFile
+    from metacat.filters.filters import Sample
+    from metacat.util import SQLParams
+    class File:
+        def __init__(self, fid):
+            self.FID = fid
+    columns = ["id", "namespace", "name", "metadata"] + DBFile.AttrColumnNames + ["parents", "children"]
+    db = sqlite3.connect(":memory:")
+    db.execute("create table input_files (seq, %s)" % (", ".join(columns),))
+    db.executemany("insert into input_files(seq, id) values(?, ?)", [(i, f"f{i}") for i in range(1000)])
+    for fraction in (0.1, 0.3, 1/3, 0.7, 0.01, 1.0):
+        params = SQLParams()
+        sql = Sample().sql(["select * from input_files order by seq"], params, fraction)
+        sql = re.sub(r"%\((\w+)\)s::[a-z ]+", r":\1", sql)
+        selected = [fid for fid, *_ in db.execute(sql, params)]
+        files = (File(f"f{i}") for i in range(1000))
+        assert selected == [f.FID for f in Sample().filter([files], fraction)]
+        assert len(selected) == int(1000*fraction + 1e-9)
+
+def test_hash_filter():
+    from zlib import adler32
+    from metacat.filters.filters import Hash
+    class File:
+        def __init__(self, fid):
+            self.FID = fid
+    files = [File(f"f{i}") for i in range(100)]
+    assert [f.FID for f in Hash().filter([files], 7, 3)] == [f.FID for f in files if adler32(f.FID.encode()) % 7 == 3]
+
+def test_lineage():
+    sql = compiled_sql("ancestors(files from test:a where x.y > 1)")
+    assert "file_lineage" in sql and "depth <=" not in sql and "parent_child" not in sql
+    compiled = MQLQuery.parse("descendants(fids 1, 2, depth=3) where x.y = 2").compile(with_meta=True)
+    assert ".ancestor_id" in compiled["sql"] and "depth <= %(param_" in compiled["sql"]
+    assert 3 in compiled["params"].values()
+    compiled = MQLQuery.parse("union(files a:b, ancestors(files c:d, e:f, depth = 2))").compile()
+    assert "depth <= %(param_" in compiled["sql"] and 2 in compiled["params"].values()
+
+class RecordingTransaction:
+    def __init__(self, rows=[("test", "a", "test", "b")]):
+        self.Log = []
+        self.Rows = rows
+    def execute(self, sql, *params):
+        self.Log.append(sql)
+    def executemany(self, sql, params):
+        self.Log.append(sql)
+    def fetchall(self):
+        return self.Rows
+
+def test_lineage_lock():
+    from metacat.db import DBFile
+
+    class Transaction(RecordingTransaction):
+        # the lineage grows while waiting for the first lock
+        def __init__(self):
+            RecordingTransaction.__init__(self)
+            self.Stripes = [[(1,), (5,)], [(1,), (5,), (3,)], [(1,), (3,), (5,)]]
+            self.Locked = []
+        def execute(self, sql, *params):
+            RecordingTransaction.execute(self, sql, *params)
+            if sql == DBFile.LineageStripesSQL:
+                self.Rows = self.Stripes.pop(0)
+            elif "pg_advisory_xact_lock" in sql:
+                self.Locked.append(params[0][0])
+
+    t = Transaction()
+    DBFile.add_edges(t, [])
+    assert t.Log == []
+    DBFile.add_edges(t, [("a", "b"), ("a", "c")])
+    assert t.Locked == [[1, 5], [3]] and t.Log[-1] == DBFile.AddEdgesSQL
+    assert sum(sql == DBFile.AddEdgesSQL for sql in t.Log) == 1          # one statement for all the edges
+
+    t = Transaction()
+    t.Stripes = [[(2,)], [(2,)]]
+    DBFile.remove_edges(t, [("b", "c")])
+    assert t.Locked == [[2]] and t.Log[-1] == DBFile.RemoveEdgesSQL
+
+def test_dataset_closure():
+    sql = compiled_sql("files from matching test:b* with subsets recursively")
+    assert "datasets_closure" in sql and "recursive" not in sql
+    sql = compiled_sql("files from matching test:b* with subsets")
+    assert "datasets_parent_child" in sql and "datasets_closure" not in sql
+
+def test_dataset_closure_lock():
+    from metacat.db import DBDataset
+    for operation in (lambda ds, t: ds.remove_child(DBDataset(None, "test", "c"), transaction=t),
+                      lambda ds, t: ds.delete(transaction=t)):
+        t = RecordingTransaction()
+        operation(DBDataset(None, "test", "b"), t)
+        assert t.Log[0] == "lock table datasets_parent_child in share row exclusive mode"
+        assert DBDataset.RemoveEdgeSQL in t.Log
+
+def test_page_null_timestamp():
+    from datetime import datetime, timezone
+    from metacat.db import DBFileSet
+    from metacat.util import SQLParams
+
+    class File:
+        def __init__(self, fid, ts):
+            self.FID = fid
+            self.CreatedTimestamp = None if ts is None else datetime.fromtimestamp(ts, timezone.utc)
+
+    files = [File("c", 200), File("b", None), File("a", 100), File("d", None)]
+    page = list(DBFileSet(None, files).page(limit=2))
+    assert [f.FID for f in page] == ["b", "d"]              # files without created_timestamp come first
+    after = DBFileSet.parse_continuation_token(DBFileSet.continuation_token(page[-1]))
+    assert [f.FID for f in DBFileSet(None, files).page(after=after)] == ["a", "c"]
+
+    sql = DBFileSet.sql_for_page("select * from files", SQLParams(), after=after, limit=2)
+    assert "order by coalesce(t_" in sql and "created_timestamp, 'epoch'::timestamptz)" in sql
@@ -0,0 +1,76 @@
+from env import env
+
+import time
+from metacat.filters import MetaCatFilter, FilterCache, SQLiteFilterCache, filter_cache
+
+class Lookup:
+    def __init__(self, known):
+        self.Known = known
+        self.Calls = []
+
+    def __call__(self, keys):
+        self.Calls.append(list(keys))
+        return {k: self.Known[k] for k in keys if k in self.Known}
+
+def check_cached_lookup(cache):
+    f = MetaCatFilter(cache=cache)
+    lookup = Lookup({"a": 1, "b": 2})
+    assert f.cached_lookup(["a", "b", "x"], lookup) == {"a": 1, "b": 2}
+    assert f.cached_lookup(["a", "x", "c"], lookup) == {"a": 1}
+    assert lookup.Calls == [["a", "b", "x"], ["c"]]           # "x" not found is cached too
+    stats = f.cache_stats()
+    assert stats["hits"] == 2 and stats["misses"] == 4 and stats["size"] == 4
+
+def test_memory_cache():
+    check_cached_lookup(FilterCache())
+
+def test_sqlite_cache(tmp_path):
+    check_cached_lookup(SQLiteFilterCache(str(tmp_path / "cache.sqlite")))
+
+def test_sqlite_batches_and_closes(tmp_path):
+    import sqlite3
+
+    class Connection(sqlite3.Connection):
+        Opened = Closed = 0
+        def __init__(self, *params, **args):
+            Connection.Opened += 1
+            sqlite3.Connection.__init__(self, *params, **args)
+        def close(self):
+            Connection.Closed += 1
+            sqlite3.Connection.close(self)
+
+    class Cache(SQLiteFilterCache):
+        LookupChunkSize = 7
+        def connect(self):
+            return sqlite3.connect(self.Path, timeout=10.0, factory=Connection)
+
+    cache = Cache(str(tmp_path / "cache.sqlite"))
+    cache.put_many({i: i*i for i in range(20)})
+    found, missing = cache.get_many(range(-5, 25))
+    assert found == {i: i*i for i in range(20)}
+    assert missing == list(range(-5, 0)) + list(range(20, 25))
+    assert Connection.Opened == Connection.Closed == 3
+
+def test_no_cache():
+    f = MetaCatFilter()
+    lookup = Lookup({"a": 1})
+    assert f.cached_lookup(["a", "b"], lookup) == {"a": 1}
+    assert f.cached_lookup(["a", "b"], lookup) == {"a": 1}
+    assert len(lookup.Calls) == 2
+    assert f.cache_stats() is None
+
+def test_capacity_and_ttl():
+    cache = FilterCache(capacity=2, ttl=0.1)
+    cache.put_many({"a": 1, "b": 2})
+    cache.get_many(["a"])
+    cache.put_many({"c": 3})                                  # "b" is least recently used
+    found, missing = cache.get_many(["a", "b", "c"])
+    assert found == {"a": 1, "c": 3} and missing == ["b"]
+    time.sleep(0.2)
+    found, missing = cache.get_many(["a", "c"])
+    assert not found and missing == ["a", "c"]
+
+def test_config(tmp_path):
+    assert filter_cache(None) is None
+    assert isinstance(filter_cache({"ttl": 10}), FilterCache)
+    assert isinstance(filter_cache({"sqlite": str(tmp_path / "cache.sqlite")}), SQLiteFilterCache)
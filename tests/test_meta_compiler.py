@@ -0,0 +1,43 @@
+from env import env
+
+from metacat.mql.meta_evaluator import MetaEvaluator
+from metacat.mql.mql10 import MQLQuery
+
+class mock_file:
+    def __init__(self, md, name="f.dat", size=100):
+        self.md = md
+        self.Name = name
+        self.Namespace = "test"
+        self.Size = size
+    def metadata(self):
+        return self.md
+
+Files = [
+    mock_file({}),
+    mock_file({"c.n": 10, "c.s": "abc", "c.l": [1, 2, 3], "c.d": {"a": 5}}, name="a.dat", size=10),
+    mock_file({"c.n": 20, "c.s": "xyz", "c.l": [5], "c.f": 1.5}, size=1000),
+    mock_file({"c.n": "text", "c.s": 3, "c.l": "not a list", "c.d": [7, 8]}),
+]
+
+Expressions = [
+    "c.n = 10", "c.n != 10", "c.n > 15", "c.n <= 10", "c.s ~ 'b'", "c.s !~* 'B'",
+    "c.n in 5:15", "c.n not in 5:15", "c.n in (10, 20)", "c.n not in (10, 20)",
+    "c.l[any] = 5", "c.l[all] > 0", "c.l[0] = 1", "c.l[2] in (3, 4)", "len(c.l) = 3", "len(c.l) in 2:4",
+    "c.d[any] = 5", "c.l[any] in 2:4", "c.l[any] in (1, 5)", "3 in c.l", "'x' in c.s", "5 not in c.l",
+    "c.f present", "c.f not present", "!(c.n = 10 or c.s = xyz)", "c.n = 10 and size < 50",
+    "name = a.dat or namespace = other", "!(c.l[any] = 5)",
+]
+
+def test_compiled_same_as_interpreted():
+    evaluator = MetaEvaluator()
+    for e in Expressions:
+        exp = MQLQuery.parse(f"files where {e}").Tree.D['query'].Wheres
+        predicate = evaluator.compile(exp)
+        for f in Files:
+            assert predicate(f) == bool(evaluator(f, exp)), (e, f.md)
+
+def test_object_attribute_range():
+    # not supported by evaluate_meta_expression
+    exp = MQLQuery.parse("files where size in 50:500").Tree.D['query'].Wheres
+    predicate = MetaEvaluator().compile(exp)
+    assert [predicate(f) for f in Files] == [True, False, False, True]
@@ -0,0 +1,30 @@
+from env import env
+
+from metacat.mql.mql10 import _Parser, MQLQuery
+
+def test_large_in_set():
+    values = list(range(1000))
+    q = MQLQuery.parse("files from test:ds where x.y in (%s)" % ", ".join(map(str, values)))
+    sql = q.compile()
+    jsonpath = [v for v in sql["params"].values() if isinstance(v, str) and v.startswith("$")][0]
+    assert "@ == 0 ||" in jsonpath and "@ == 999)" in jsonpath
+
+def test_postfix_operators():
+    tree = _Parser.parse("files from a:b limit 5 where x.y = 1")
+    assert tree.children[0].data == "meta_filter"
+    assert tree.children[0].children[0].data == "limit"
+    tree = _Parser.parse("files from a:b - files from c:d where x.y = 1")
+    assert tree.children[0].data == "minus"
+    assert tree.children[0].children[1].data == "meta_filter"
+
+def test_constants():
+    tree = _Parser.parse("files where x.a = 123abc and x.b = 12.5.6 and x.c = TRUE and x.d = 1e5 and x.e = -3")
+    constants = [t.children[-1] for t in tree.find_data("cmp_op")]
+    assert [c.data for c in constants] == ["string_constant", "string_constant", "bool_constant", "float_constant", "int_constant"]
+
+def test_lists():
+    tree = _Parser.parse("[files a:b, c:d, files from x:y, z:w, fids 1, 2]")
+    assert [t.data for t in tree.children[0].children[0].children] == ["file_query_term", "basic_file_query", "file_query_term"]
+    tree = _Parser.parse("filter f(a, b, c=1, d=2)(files from x:y, files from z:w)")
+    assert len(list(tree.find_data("param_def"))) == 2
+    assert len(list(tree.find_data("basic_file_query"))) == 2
@@ -0,0 +1,49 @@
+from env import env
+
+import pytest
+from metacat.db import DBNamespace, NamespaceAuthorizationIndex
+
+class User:
+    def __init__(self, username, admin=False):
+        self.Username = username
+        self.Admin = admin
+
+    def is_admin(self):
+        return self.Admin
+
+Owned = {"alice": {"a", "shared"}, "bob": {"shared"}}
+Existing = {"a", "shared", "other"}
+
+@pytest.fixture
+def queries(monkeypatch):
+    calls = []
+    def names_owned_by_user(db, username):
+        calls.append(username)
+        return Owned.get(username, set())
+    monkeypatch.setattr(DBNamespace, "names_owned_by_user", staticmethod(names_owned_by_user))
+    monkeypatch.setattr(DBNamespace, "exists", staticmethod(lambda db, name: name in Existing))
+    return calls
+
+def test_authorized(queries):
+    index = NamespaceAuthorizationIndex()
+    alice = User("alice")
+    assert all(index.authorized(None, alice, "a") for _ in range(100))
+    assert index.authorized(None, alice, "shared")
+    assert not index.authorized(None, alice, "other")
+    assert index.authorized(None, User("root", admin=True), "other")
+    with pytest.raises(KeyError):
+        index.authorized(None, alice, "missing")
+    assert queries == ["alice", "root"]                 # one query per user
+
+def test_invalidate(queries):
+    index = NamespaceAuthorizationIndex()
+    bob = User("bob")
+    assert not index.authorized(None, bob, "a")
+    Owned["bob"].add("a")
+    try:
+        assert not index.authorized(None, bob, "a")
+        index.invalidate()
+        assert index.authorized(None, bob, "a")
+    finally:
+        Owned["bob"].discard("a")
+    assert queries == ["bob", "bob"]
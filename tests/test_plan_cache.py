@@ -0,0 +1,36 @@
+from env import env
+
+from metacat.mql import MQLQuery, PlanCache, plan_cache
+
+def test_normalize():
+    assert PlanCache.normalize("  files from a:b  # comment\n\n   where x.y = 1 ") == "files from a:b\nwhere x.y = 1"
+
+def test_lru():
+    cache = PlanCache(capacity=2, ttl=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)           # "b" is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 1 and stats["size"] == 2
+
+def test_invalidate():
+    cache = PlanCache()
+    cache.put("q", 1, [("query", "ns", "nq")])
+    cache.put("d", 2, [("dataset", "ns")])
+    assert cache.invalidate("dataset", "ns", "ds") == 1
+    assert cache.get("d") is None
+    assert cache.get("q") == 1
+    assert cache.invalidate("query", "ns", "nq") == 1
+    assert cache.get("q") is None
+
+def test_parse_cached():
+    plan_cache.invalidate()
+    q1 = MQLQuery.parse_cached("files from test:plan_cache_ds where x.y = 1")
+    hits = plan_cache.stats()["hits"]
+    q2 = MQLQuery.parse_cached("  files from test:plan_cache_ds where x.y = 1   # same query")
+    assert plan_cache.stats()["hits"] == hits + 1
+    assert q2.compile()["sql"] == q1.compile()["sql"]
+    assert plan_cache.invalidate("dataset", "test", "plan_cache_ds") == 1
@@ -0,0 +1,176 @@
+from env import env
+
+import time, threading, gc, re
+from metacat.mql import MQLQuery, query_executor
+from metacat.mql.query_executor import FileQueryExecutor
+
+class File:
+    def __init__(self, fid):
+        self.FID = fid
+        self.DB = None
+
+class SlowFilter:
+    def run(self, queries, params, kw, **options):
+        time.sleep(0.3)
+        return [File(fid) for fid in params]
+
+class OverlappingFilter:
+    # each call waits until all n branches are running it, so the branches must be executed concurrently
+    def __init__(self, n):
+        self.Barrier = threading.Barrier(n, timeout=10)
+
+    def run(self, queries, params, kw, **options):
+        self.Barrier.wait()
+        return [File(fid) for fid in params]
+
+class DB:
+    Lock = threading.Lock()
+    Open = MaxOpen = 0
+
+    def __init__(self):
+        with DB.Lock:
+            DB.Open += 1
+            DB.MaxOpen = max(DB.MaxOpen, DB.Open)
+
+    def close(self):
+        with DB.Lock:
+            DB.Open -= 1
+
+def run(query, parallelism, slow_filter=None, **options):
+    compiled = MQLQuery.parse(query).compile()
+    db = DB()
+    executor = FileQueryExecutor(db, {"slow": slow_filter or SlowFilter()}, connect=DB, parallelism=parallelism, **options)
+    files = list(executor(compiled))
+    if parallelism > 1:
+        assert all(f.DB is db for f in files)       # files are re-attached to the main connection
+    return sorted(f.FID for f in files)
+
+def test_parallel_union():
+    fids = run("union(filter slow(a, b)(files from test:a), filter slow(b, c)(files from test:b))", 2,
+                OverlappingFilter(2))
+    assert fids == ["a", "b", "c"]
+
+def test_parallel_join():
+    fids = run("join(filter slow(a, b, c)(files from test:a), filter slow(b, c, d)(files from test:b), filter slow(c, b)(files from test:c))", 3,
+                OverlappingFilter(3))
+    assert fids == ["b", "c"]
+
+def test_branch_connections(monkeypatch):
+    monkeypatch.setattr(query_executor, "BranchSlots", threading.BoundedSemaphore(1))
+    main = DB()
+    DB.MaxOpen = n = DB.Open
+    compiled = MQLQuery.parse("union(filter slow(a)(files from test:a), filter slow(b)(files from test:b), filter slow(c)(files from test:c))").compile()
+    files = FileQueryExecutor(main, {"slow": SlowFilter()}, connect=DB, parallelism=3)(compiled)
+    assert sorted(f.FID for f in files) == ["a", "b", "c"]
+    assert DB.MaxOpen == n + 1 and DB.Open == n             # the branches used one connection at a time and closed it
+
+def test_early_stop():
+    main = DB()
+    n = DB.Open
+    compiled = MQLQuery.parse("union(filter slow(a, b)(files from test:a), filter slow(c, d)(files from test:b))").compile()
+    files = iter(FileQueryExecutor(main, {"slow": SlowFilter()}, connect=DB, parallelism=2)(compiled))
+    next(files)
+    del files
+    gc.collect()
+    t1 = time.time() + 2
+    while DB.Open > n and time.time() < t1:
+        time.sleep(0.01)
+    assert DB.Open == n                                     # the branch connections were closed
+
+def test_join_keeps_first_branch():
+    class MetaFilter:
+        def run(self, queries, params, kw, **options):
+            files = [File(fid) for fid in params[1:]]
+            for f in files:
+                f.Metadata = {"branch": params[0]}
+            return files
+    compiled = MQLQuery.parse("join(filter meta(0, a, b)(files from test:a), filter meta(1, b)(files from test:b))").compile()
+    files = list(FileQueryExecutor(DB(), {"meta": MetaFilter()}, connect=DB, parallelism=2)(compiled))
+    assert [(f.FID, f.Metadata) for f in files] == [("b", {"branch": 0})]
+
+class SessionDB(DB):
+    # connection with its own temp tables, like a Postgres session
+
+    class Cursor:
+        rowcount = 0
+
+        def __init__(self, db):
+            self.DB = self.connection = db
+
+        def execute(self, sql, params=None):
+            self.DB.TempTables.update(re.findall(r"create temp table if not exists (\w+)", sql))
+            missing = set(re.findall(r"temp_filter_\d+", sql)) - self.DB.TempTables
+            if missing:
+                raise RuntimeError("relation %s does not exist" % (missing.pop(),))
+
+        def copy_from(self, f, table, columns=None):
+            pass
+
+        def fetchone(self):
+            return None
+
+    def __init__(self):
+        DB.__init__(self)
+        self.TempTables = set()
+
+    def cursor(self, **args):
+        return self.Cursor(self)
+
+def test_materialized_filter_in_branch():
+    class MetaFilter:
+        def run(self, queries, params, kw, **options):
+            files = [File(fid) for fid in params]
+            for f in files:
+                f.Metadata = {}
+            return files
+        def sql(self, inputs, sql_params, *params, **kw):
+            return None
+
+    for query in ("union(parents(filter meta(a)(files from test:a)), filter meta(b)(files from test:b))",
+                  "union(filter meta(a)(files from test:a) - files from test:c, filter meta(b)(files from test:b))"):
+        compiled = MQLQuery.parse(query).compile()
+        files = FileQueryExecutor(SessionDB(), {"meta": MetaFilter()}, connect=SessionDB, parallelism=2)(compiled)
+        assert [f.FID for f in files] == ["b"]      # the temp table was created in the branch's own session
+
+def test_serial():
+    fids = run("join(filter slow(a, b)(files from test:a), filter slow(b)(files from test:b))", 1, materialize_filters=False)
+    assert fids == ["b"]
+
+def test_batch_filter():
+    from metacat.filters import MetaCatBatchFilter
+
+    class Lookup(MetaCatBatchFilter):
+        # processing of the first batch waits for the release event,
+        # which is set by the test or by the batch starting with the release_by file
+        def __init__(self, release, release_by=None, **args):
+            MetaCatBatchFilter.__init__(self, **args)
+            self.Release = release
+            self.ReleaseBy = release_by
+
+        def filter_batch(self, batch, **ignore):
+            if batch[0].FID == "0":
+                assert self.Release.wait(5)
+            out = [f for f in batch if int(f.FID) % 2 == 0]
+            if batch[0].FID == self.ReleaseBy:
+                self.Release.set()
+            return out
+
+    files = [File(str(i)) for i in range(100)]
+    expected = [f.FID for f in files if int(f.FID) % 2 == 0]
+
+    # the output is in input order although the first batch finishes after the following ones
+    out = Lookup(threading.Event(), release_by="40", batch_size=10, concurrency=5).run([files], [], {}, ordered=True)
+    assert [f.FID for f in out] == expected
+
+    # unordered output starts while the first batch is still being processed
+    release = threading.Event()
+    out = iter(Lookup(release, batch_size=7, concurrency=5).run([files], [], {}))
+    first = next(out)
+    assert int(first.FID) >= 7
+    release.set()
+    assert sorted([first.FID] + [f.FID for f in out]) == sorted(expected)
+
+    release = threading.Event()
+    release.set()
+    out = Lookup(release, batch_size=7).run([files], [], {}, limit=3)
+    assert [f.FID for f in out] == expected[:3]
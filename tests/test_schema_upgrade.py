@@ -0,0 +1,22 @@
+from env import env
+
+import os, re
+
+DBDir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "metacat", "db")
+
+def read(name):
+    return open(os.path.join(DBDir, name), "r").read()
+
+def functions(sql):
+    return {name: body for name, body in
+        re.findall(r"create (?:or replace )?function (\w+)\(\) returns trigger language plpgsql as \$\$(.*?)\$\$;", sql, re.S)}
+
+def triggers(sql):
+    return set(re.findall(r"create trigger (\w+) (\w+ \w+ on \w+)", sql))
+
+def test_upgrade_matches_schema():
+    schema, upgrade = read("schema.sql"), read("upgrade_4.1.sql")
+    assert functions(upgrade) == functions(schema)
+    assert triggers(upgrade) == triggers(schema) and triggers(schema)
+    for table in ("file_lineage", "datasets_closure", "file_count_deltas"):
+        assert f"create table if not exists {table}" in upgrade
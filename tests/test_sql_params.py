@@ -0,0 +1,83 @@
+from env import env
+
+from metacat.mql import MQLQuery
+from metacat.util import SQLParams
+from metacat.util.sql_params import prepared_statement
+
+def compiled(text):
+    return MQLQuery.parse(text).compile()
+
+def test_bind():
+    params = SQLParams()
+    placeholder = params.bind("x'y")
+    assert placeholder.endswith("::text")
+    assert list(params.values()) == ["x'y"]
+    assert params.bind([1, 2.5]).endswith("::double precision[]")
+
+def test_literals_are_bound():
+    c = compiled("files from test:ds_one where x.y = 'abc' and size > 100 and name in ('a', 'b') limit 10")
+    sql, params = c["sql"], c["params"]
+    for literal in ("abc", "100", "ds_one", "'a'"):
+        assert literal not in sql
+    values = list(params.values())
+    assert 100 in values and ["a", "b"] in values
+    assert any(t == "jsonpath" for t in params.Types.values())
+
+def test_same_shape_same_statement():
+    c1 = compiled("files from test:ds_one where x.y = 1 limit 10")
+    c2 = compiled("files from test:ds_two where x.z = 2 limit 20")
+    name1, text1, names1 = prepared_statement(c1["sql"], c1["params"])
+    name2, text2, names2 = prepared_statement(c2["sql"], c2["params"])
+    assert name1 == name2 and text1 == text2
+    assert [c1["params"][n] for n in names1] != [c2["params"][n] for n in names2]
+
+def test_object_attribute_types():
+    from datetime import datetime, timezone
+    c = compiled("files from test:a where created_timestamp > '2020-01-01 00:00:00' and updated_timestamp < date(2021-01-01) "
+                "and size in (1, 2) and retired = false")
+    sql, params = c["sql"], c["params"]
+    def placeholder(value):
+        name = next(n for n, v in params.items() if type(v) == type(value) and v == value)
+        return f"%({name})s::{params.Types[name]}"
+    assert placeholder("2020-01-01 00:00:00").endswith("::timestamptz")
+    assert f"created_timestamp > {placeholder('2020-01-01 00:00:00')}" in sql
+    assert f"updated_timestamp < {placeholder(datetime(2021, 1, 1, tzinfo=timezone.utc))}" in sql
+    assert placeholder([1, 2]).endswith("::bigint[]") and placeholder(False).endswith("::boolean")
+
+def test_alias_scope():
+    from metacat.db import alias, alias_scope
+    with alias_scope("q"):
+        assert (alias("t"), alias("t"), alias("f")) == ("t_q1", "t_q2", "f_q1")
+        with alias_scope("q"):
+            assert alias("t") == "t_q3"
+        with alias_scope("p"):
+            assert alias("t") == "t_p1"
+    with alias_scope("q"):
+        assert alias("t") == "t_q1"
+    assert not alias("t").startswith(("t_q", "t_p"))
+
+def test_stable_sql_text():
+    text = "files from test:ds_one where x.y = 1 limit 10"
+    q1, q2 = MQLQuery.parse(text), MQLQuery.parse(text)
+    q1.compile(), q2.compile()
+    paged = q2.compile(page_size=5)             # wraps the plan compiled before
+    name1, text1, _ = prepared_statement(q1.compile()["sql"], q1.compile()["params"])
+    name2, text2, _ = prepared_statement(q2.compile()["sql"], q2.compile()["params"])
+    assert text1 == text2 and "_q1" in text1
+    assert "_q1" in paged["sql"] and "_p1" in paged["sql"]
+
+def test_bounded_query_not_streamed(monkeypatch):
+    from metacat.mql import mql10
+    itersizes = []
+    class Executor(object):
+        def __init__(self, db, filters, itersize=None, **args):
+            itersizes.append(itersize)
+        def __call__(self, tree):
+            return mql10.DBFileSet(None)
+    monkeypatch.setattr(mql10, "FileQueryExecutor", Executor)
+    query = MQLQuery.parse("files from test:ds_one")
+    query.run(None, itersize=100)
+    query.run(None, itersize=100, limit=1000)
+    query.run(None, itersize=100, limit=100)
+    query.run(None, itersize=100, page_size=10)
+    assert itersizes == [100, 100, None, None]
@@ -0,0 +1,63 @@
+from env import env
+
+from metacat.util import metadata_validator
+from metacat.db import DBParamCategory
+
+Definitions = {
+    "run":      {"type": "int", "min": 1, "required": True},
+    "mode":     {"type": "text", "values": ["physics", "cosmics"]},
+    "tags":     {"type": "text[]", "pattern": "[a-z]+$"},
+    "weights":  {"type": "float[]", "max": 1.0},
+    "extra":    {"type": "any"}
+}
+
+def test_validator():
+    v = metadata_validator(Definitions, True)
+    assert v.validate({"run": 3, "mode": "physics", "tags": ["a", "b"], "weights": [0.5], "extra": [1]}) == []
+    assert v.validate({"run": 0, "mode": "test", "tags": ["A"], "weights": [2.0], "other": 1}) == [
+        ("run", "value 0 out of range (min:1)"),
+        ("mode", "value 'test' is not allowed"),
+        ("tags", "value in ['A'] does not match the pattern '[a-z]+$'"),
+        ("weights", "value in [2.0] out of range (max:1.0)"),
+        ("other", "parameter not allowed in restricted category")
+    ]
+    assert v.validate({"run": "x", "weights": [1]}) == [
+        ("run", "scalar int value required instead of 'x'"),
+        ("weights", "list of floats required instead of [1]")
+    ]
+    assert v.validate({"mode": "physics"}) == [("run", "required parameter is missing")]
+
+def test_registry():
+    assert metadata_validator(dict(Definitions), False) is metadata_validator(Definitions, False)
+    assert metadata_validator(Definitions, False) is not metadata_validator(Definitions, True)
+    changed = dict(Definitions, mode={"type": "text"})
+    assert metadata_validator(changed, False).validate({"run": 1, "mode": "test"}) == []
+
+def test_category_validators(monkeypatch):
+    queries = []
+    categories = {
+        ".":        DBParamCategory(None, ".", definitions={}),
+        "core":     DBParamCategory(None, "core", restricted=True, definitions={"run": {"type": "int"}}),
+    }
+    def get_many(db, paths):
+        queries.append(sorted(paths))
+        return [categories[p] for p in paths if p in categories]
+    monkeypatch.setattr(DBParamCategory, "get_many", staticmethod(get_many))
+    DBParamCategory.invalidate_validators()
+
+    errors = DBParamCategory.validate_metadata_bulk(None, [
+        {"core.run": 1, "core.x": 1, "user.note": "a"},
+        {"core.run": "1", "core.sub.y": 2}
+    ])
+    assert errors == [
+        (0, [{"name": "core.x", "reason": "parameter not allowed in restricted category", "value": 1}]),
+        (1, [{"name": "core.run", "reason": "scalar int value required instead of '1'", "value": "1"},
+             {"name": "core.sub.y", "reason": "parameter not allowed in restricted category", "value": 2}])
+    ]
+    assert queries == [[".", "core", "core.sub", "user"]]           # one query for all category paths
+
+    DBParamCategory.validate_metadata_bulk(None, [{"core.run": 1}])
+    assert len(queries) == 1
+    DBParamCategory.invalidate_validators()
+    DBParamCategory.validate_metadata_bulk(None, [{"core.run": 1}])
+    assert len(queries) == 2
@@ -0,0 +1,25 @@
+import sys
+from metacat.common.connection_pool import DBConnectionPool
+from metacat.db import DBFile, DBDataset
+
+Usage = """
+python build_lineage.py <postgres connection string>
+
+Rebuilds file_lineage table from parent_child and datasets_closure table from datasets_parent_child.
+Run once after creating file_lineage and datasets_closure tables in an existing database.
+"""
+
+if len(sys.argv) != 2:
+    print(Usage)
+    sys.exit(2)
+
+db = DBConnectionPool(sys.argv[1], max_connections=1).connect()
+DBFile.rebuild_lineage(db)
+c = db.cursor()
+c.execute("select count(*) from file_lineage")
+print("file_lineage rows:", c.fetchone()[0])
+
+for parent, child in DBDataset.rebuild_closure(db):
+    print(f"removed circular parent/child connection: {parent.did()} -> {child.did()}")
+c.execute("select count(*) from datasets_closure")
+print("datasets_closure rows:", c.fetchone()[0])
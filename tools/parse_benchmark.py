@@ -0,0 +1,30 @@
+#
+# Compares MQL parsing time of the LALR parser used by metacat with the Earley parser built from the same grammar
+#
+# Usage: python parse_benchmark.py [<set size>] [<repeat>]
+#
+
+import sys, time
+from lark import Lark
+from metacat.mql.grammar import MQL_Grammar
+from metacat.mql.mql10 import _Parser
+
+size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+queries = [
+    ("simple", "files from test:dataset where x.y = 1 and x.z in (a, b, c) limit 10"),
+    (f"in set of {size}", "files from test:dataset where x.run in (%s)" % ", ".join(str(i) for i in range(size))),
+    (f"file list of {size}", "files " + ", ".join(f"test:file_{i}.dat" for i in range(size)))
+]
+
+t0 = time.time()
+earley = Lark(MQL_Grammar, start="query")
+print("Earley parser construction: %.3f sec" % (time.time() - t0,))
+
+for title, query in queries:
+    for name, parser in [("LALR", _Parser), ("Earley", earley)]:
+        t0 = time.time()
+        for _ in range(repeat):
+            parser.parse(query)
+        print("%-20s %-8s %.4f sec/query" % (title, name, (time.time() - t0)/repeat))
@@ -2,8 +2,9 @@ import yaml, os, getopt, sys
 
 from webpie import WPApp, WPHandler, Response, WPStaticHandler
 from pythreader import schedule_task, Primitive, synchronized
-from metacat.db import DBUser, DBRole, DBDataset
+from metacat.db import DBUser, DBRole, DBDataset, NamespaceAuthorizationIndex
 from metacat.filters import standard_filters
+from metacat.mql import plan_cache, query_executor
 
 from datetime import datetime, timezone
 #import webpie
@@ -12,7 +13,7 @@ from datetime import datetime, timezone
 import json, time, secrets, traceback, hashlib, pprint
 from urllib.parse import quote_plus, unquote_plus
 
-from metacat.util import to_str, to_bytes
+from metacat.util import to_str, to_bytes, sql_params
 from metacat.common import SignedToken, SignedTokenExpiredError, SignedTokenImmatureError, SignedTokenUnacceptedAlgorithmError, SignedTokenSignatureVerificationError
 from metacat.logs import Logged, Logger
 
@@ -88,6 +89,33 @@ class App(BaseApp, Primitive):
         
         self.StaticLocation = static_location
 
+        # number of rows to fetch at a time when streaming file query results with a server-side cursor
+        # 0 or null - load the whole query result at once.
+        # Streamed queries can not use prepared statements, only the queries with limit or page size not larger
+        # than query_itersize do. Setting it to 0 makes all queries use prepared statements at the cost of holding
+        # whole query results in memory
+        self.QueryItersize = cfg.get("query_itersize", 10000) or None
+
+        # build JSON representation of query results in the database and stream it to the client without decoding
+        self.QueryRawJSON = cfg.get("query_raw_json", True)
+
+        # max number of union/join branches of a file query executed concurrently, each using its own DB connection
+        self.QueryParallelism = cfg.get("query_parallelism", 4) or 1
+        # max number of connections used by the branches of all queries together, default: half of the pool
+        query_executor.configure(cfg.get("query_branch_connections") or max(1, self.DB.MaxConnections // 2))
+
+        # run parameterized queries as server-side prepared statements, cached per connection.
+        # Must be disabled if the database is accessed through a transaction-pooling proxy
+        sql_params.UsePreparedStatements = cfg.get("prepared_statements", True)
+
+        plan_cache_cfg = cfg.get("query_plan_cache", {})
+        plan_cache.configure(capacity=plan_cache_cfg.get("capacity"), ttl=plan_cache_cfg.get("ttl"))
+
+        # namespaces writable by each user, used for permission checks
+        ns_auth_cfg = cfg.get("namespace_authorization_cache", {})
+        self.NamespaceAuthorizations = NamespaceAuthorizationIndex(capacity=ns_auth_cfg.get("capacity", 10000),
+                                                        ttl=ns_auth_cfg.get("ttl", 60))
+
         config_name = os.environ.get("METACAT_SERVER_CFG")
         instance_name = config_name.split("/")[-1].split(".")[0]
         log_file = "logs/%s.log" % instance_name
@@ -106,7 +106,6 @@ class MetaCatHandler(BaseHandler, Logged):
     
     def __init__(self, *params, **args):
         BaseHandler.__init__(self, *params, **args)
-        self.NamespaceAuthorizations = {}
         Logged.__init__(self, debug=True, logger=self.App.Logger)
         
     SafePatterns = {
@@ -130,21 +129,15 @@ class MetaCatHandler(BaseHandler, Logged):
         username, error = self.authenticated_username()
         if username is None:
             return None, error
-        user = DBUser.get(self.App.connect(), username)
+        user = DBUser.from_base_user(self.AuthCore.cached_user(username, self.App.connect()))
         if user is not None:
             return user, None
         else:
             return None, "user not found"
 
     def _namespace_authorized(self, db, namespace, user):
-        authorized = self.NamespaceAuthorizations.get(namespace)
-        if authorized is None:
-            ns = DBNamespace.get(db, namespace)
-            if ns is None:
-                raise KeyError("Namespace %s does not exist" % (namespace) )
-            authorized = ns.owned_by_user(user) or user.is_admin() 
-            self.NamespaceAuthorizations[namespace] = authorized
-        return authorized
+        # raises KeyError if the namespace does not exist
+        return self.App.NamespaceAuthorizations.authorized(db, user, namespace)
 
     def _handle_request(self, request, path, path_down, args):
         response = super()._handle_request(request, path, path_down, args)
@@ -227,6 +220,7 @@ class MetaCatHandler(BaseHandler, Logged):
         ns = DBNamespace(db, name, owner_user=owner_user, owner_role = owner_role, description=description)
         ns.Creator = current_user.Username
         ns.create()
+        self.App.NamespaceAuthorizations.invalidate()
 
         return 200, ns
 
@@ -2,18 +2,32 @@ from webpie import WPApp, WPHandler, Response, WPStaticHandler
 import psycopg2, json, time, secrets, traceback, hashlib, pprint, uuid, random
 import re
 from metacat.db import DBFile, DBDataset, DBFileSet, DBNamedQuery, DBUser, DBNamespace, DBRole, \
-    DBParamCategory, parse_name, AlreadyExistsError, IntegrityError, MetaValidationError
+    DBParamCategory, parse_name, AlreadyExistsError, IntegrityError, MetaValidationError, DatasetCircularDependencyDetected
 from wsdbtools import ConnectionPool
 from urllib.parse import quote_plus, unquote_plus
-from metacat.util import to_str, to_bytes, ObjectSpec
-from metacat.mql import MQLQuery, MQLSyntaxError, MQLExecutionError, MQLCompilationError, MQLError
+from metacat.util import to_str, to_bytes, ObjectSpec, SQLParams
+from metacat.util.arrow import arrow_stream, import_pyarrow, ArrowStreamContentType, DefaultColumns
+from metacat.mql import MQLQuery, MQLSyntaxError, MQLExecutionError, MQLCompilationError, MQLError, plan_cache, QueryProfile
 from metacat import Version
 from datetime import datetime, timezone
 
-from common_handler import MetaCatHandler, sanitized
+from common_handler import MetaCatHandler, sanitized, SanitizeException
 
 METADATA_ERROR_CODE = 488
 
+def read_lines(body_file, block_size=1024*1024):
+    # reads request body by blocks and yields lines as bytes
+    tail = b""
+    while True:
+        block = body_file.read(block_size)
+        if not block:
+            break
+        lines = (tail + block).split(b"\n")
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
 def parse_name(name, default_namespace=None):
     words = (name or "").split(":", 1)
     if len(words) < 2:
@@ -80,9 +94,12 @@ class DataHandler(MetaCatHandler):
     RS = '\x1E'
     LF = '\n'    
 
-    def json_stream(self, iterable, chunk=100000):
+    def json_stream(self, iterable, chunk=100000, raw=False):
         # iterable is an iterable, returning jsonable items, one item at a time
-        return self.text_chunks(("%s%s%s" % (self.RS, json.dumps(item), self.LF) for item in iterable), chunk)
+        # raw: the items are already JSON texts
+        if not raw:
+            iterable = (json.dumps(item) for item in iterable)
+        return self.text_chunks(("%s%s%s" % (self.RS, item, self.LF) for item in iterable), chunk)
 
     def realm(self, request, relpath, **args):
         return self.App.Realm           # realm used for the digest password authentication
@@ -274,8 +291,8 @@ class DataHandler(MetaCatHandler):
 
             if files is not None:
                 dataset.FileCount = dataset.add_files(files, transaction=transaction)
-                dataset.save(transaction=transaction)
-        
+
+        plan_cache.invalidate("dataset", namespace, name)
         return dataset.to_json(), "application/json"
     
     @sanitized
@@ -322,6 +339,7 @@ class DataHandler(MetaCatHandler):
             ds.Description = request_data["description"]
         
         ds.save(updated_by=user.Username)
+        plan_cache.invalidate("dataset", namespace, name)
         return json.dumps(ds.to_jsonable()), "application/json"
 
     @sanitized
@@ -348,12 +366,13 @@ class DataHandler(MetaCatHandler):
         if child_ds is None:
             return 404, "Child dataset not found", "text/plain"
         
-        if any(a.Namespace == child_namespace and a.Name == child_name for a in parent_ds.ancestors()):
-            return 400, "Circular connection detected - child dataset is already an ancestor of the parent"
-        
         if not any(c.Namespace == child_namespace and c.Name == child_name for c in parent_ds.children()):
             #print("Adding ", child_ds, " to ", parent_ds)
-            parent_ds.add_child(child_ds)
+            try:
+                parent_ds.add_child(child_ds)
+            except DatasetCircularDependencyDetected:
+                return 400, "Circular connection detected - child dataset is already an ancestor of the parent"
+            plan_cache.invalidate("dataset", parent_namespace, parent_name)
         return "OK"
 
     @sanitized
@@ -473,8 +492,6 @@ class DataHandler(MetaCatHandler):
             try:
                 with db.transaction() as transaction:
                     nadded = ds.add_files(files, transaction=transaction)
-                    ds.FileCount += nadded
-                    ds.save(transaction=transaction)
             except MetaValidationError as e:
                 return 400, e.as_json(), "application/json"
         return json.dumps({"files_added": nadded}), "application/json"
@@ -563,6 +580,7 @@ class DataHandler(MetaCatHandler):
         if not self._namespace_authorized(db, ds_namespace, user):
             return 403, f"Permission denied", "text/plain"
         ds.delete()
+        plan_cache.invalidate("dataset", ds_namespace, ds_name)
         return "OK"
 
     @sanitized
@@ -622,8 +640,278 @@ class DataHandler(MetaCatHandler):
                     invalid.append({"name":k, "value":v, "reason":reason})
         return invalid
         
+    def file_to_declare(self, db, ds, user, inx, file_item, default_namespace, errors):
+        # converts one item of the declare_files request into a DBFile object with parents as file ids or
+        # (namespace, name) tuples. Appends errors to the list and returns None if the file can not be declared
+        namespace = file_item.get("namespace", default_namespace)
+        name = file_item.get("name")
+        fid = file_item.get("fid")
+        
+        self.sanitize(namespace=namespace, name=name, fid=fid)
+        
+        size = file_item.get("size")
+        if size is None:
+            errors.append({
+                "message": "Missing file size",
+                "fid": fid,
+                "index": inx
+            })
+            return None
+
+        if name is None:
+            did = file_item.get("did")
+            if did is not None:
+                namespace, name = parse_name(did, namespace)
+                
+        if name is None and "auto_name" not in file_item:
+            errors.append({
+                "message":"Missing name and auto_name",
+                "index": inx,
+                "fid":fid
+            })
+            return None
+
+        if not namespace:
+            errors.append({
+                "message":"Missing namespace",
+                "index": inx,
+                "fid":fid
+            })
+            return None
+
+        try:
+            if not self._namespace_authorized(db, namespace, user):
+                errors.append({
+                    "index": inx,
+                    "fid":fid,
+                    "message":f"Permission to declare files in namespace {namespace} denied"
+                })
+                return None
+        except KeyError:
+                errors.append({
+                    "index": inx,
+                    "fid":fid,
+                    "message":f"Namespace {namespace} does not exist"
+                })
+                return None
+
+        meta = file_item.get("metadata", {})
+        
+        for k in meta.keys():
+            if '.' not in k:
+                errors.append({
+                    "index": inx,
+                    "message":f"Metadata parameter without a category: {k}"
+                })
+
+        ds_validation_errors = ds.validate_file_metadata(meta)
+        if ds_validation_errors:
+            #print("validation errors:", ds_validation_errors)
+            errors.append({
+                "index": inx,
+                "message":f"Dataset metadata validation errors",
+                "metadata_errors":ds_validation_errors
+            })
+            return None
+
+        fid = file_item.get("fid") or DBFile.generate_id()
+        if name is None:
+            pattern = file_item.get("auto_name", "$fid")
+            clock = int(time.time() * 1000)
+            clock3 = "%03d" % (clock%1000,)
+            clock6 = "%06d" % (clock%1000000,)
+            clock9 = "%09d" % (clock%1000000000,)
+            clock = str(clock)
+            u = uuid.uuid4().hex
+            u8 = u[-8:]
+            u16 = u[-16:]
+            name = pattern.replace("$clock3", clock3).replace("$clock6", clock6).replace("$clock9", clock9)\
+                .replace("$clock", clock)\
+                .replace("$uuid8", u8).replace("$uuid16", u16).replace("$uuid", u)\
+                .replace("$fid", fid)
+
+        # allow admins to use creation info if present for migration.
+        # default it if not passed, or not admin.
+        if user.is_admin():
+            creator = file_item.get("creator", user.Username)
+            created_timestamp = file_item.get("created_timestamp", None)
+        else:
+            creator = user.Username
+            created_timestamp = None
+
+        f = DBFile(db, namespace=namespace, name=name, fid=fid, metadata=meta, size=size, creator=creator, created_timestamp=created_timestamp)
+        f.Checksums = file_item.get("checksums")
+
+        parents = []
+        for item in file_item.get("parents") or []:
+            if isinstance(item, str):
+                parents.append(item)
+            elif isinstance(item, dict):
+                if "fid" in item:
+                    parents.append(item["fid"])
+                else:
+                    if "did" in item:
+                        pns, pn = parse_name(item["did"], default_namespace)
+                    elif "name" in item:
+                        pn = item["name"]
+                        pns = item.get("namespace", default_namespace)
+                        if not pns:
+                            errors.append({
+                                "index": inx,
+                                "message": "Parent specification error: no namespace: %s" % (item,)
+                            })
+                            return None
+                    else:
+                        errors.append({
+                            "index": inx,
+                            "message": "Parent specification error: %s" % (item,)
+                        })
+                        return None
+                    parents.append((pns, pn))
+            else:
+                errors.append({
+                    "index": inx,
+                    "message": "Parent specification error: %s" % (item,)
+                })
+                return None
+
+        f.Parents = parents
+        return f
+
+    def declare_files_stream(self, request, db, ds, user, default_namespace, dry_run, chunk_size, commit):
+        #
+        # Streaming declaration. Request body: newline-delimited JSON, one file per line, in the same format as the
+        # items of the JSON list accepted by declare_files. Files are parsed and validated in chunks of chunk_size
+        # lines and declared through staging tables, see DBFile.declare_staged()
+        #
+        # commit:   "all" - all or nothing, one transaction for all the chunks. After a chunk fails, the following
+        #                   chunks are validated only
+        #           "chunk" - each chunk is declared in its own transaction, failed chunks do not affect others
+        #
+        # Response: newline-delimited JSON, one report per chunk:
+        #   {"chunk": <n>, "first_index": <index of the first line>, "items": <number of lines>,
+        #       "status": "declared" | "failed" | "skipped", 
+        #       "files": [{"fid":..., "namespace":..., "name":...}, ...],      # declared files
+        #       "errors": [{"index":..., "message":..., ...}, ...]
+        #   }
+        # followed by the summary:
+        #   {"summary": {"status": "committed" | "rolled back" | "dry run", "chunks":..., "declared":..., "failed":...}}
+        # With commit="all", files reported as declared are committed only if the summary status is "committed"
+        #
+        def chunks():
+            chunk = []
+            inx = 0
+            for line in read_lines(request.body_file):
+                line = line.strip()
+                if line:
+                    chunk.append((inx, line))
+                    inx += 1
+                    if len(chunk) >= chunk_size:
+                        yield chunk
+                        chunk = []
+            if chunk:
+                yield chunk
+
+        def validate_chunk(chunk):
+            # returns list of DBFile objects, list of errors and dictionary fid -> line index
+            files = []
+            errors = []
+            items = []
+            indexes = {}
+            for inx, line in chunk:
+                try:    item = json.loads(line)
+                except ValueError as e:
+                    errors.append({"index": inx, "message": f"Invalid JSON: {e}"})
+                    continue
+                if not isinstance(item, dict):
+                    errors.append({"index": inx, "message": "File item must be a dictionary"})
+                    continue
+                items.append((inx, item))
+
+            for i, item_errors in DBParamCategory.validate_metadata_bulk(db, [item.get("metadata") or {} for _, item in items]):
+                errors.append({
+                    "index": items[i][0],
+                    "message":"Metadata category validation errors",
+                    "metadata_errors":item_errors
+                })
+
+            for inx, item in items:
+                item_errors = []
+                self.validate_checksums(item, item_errors)
+                if item_errors:
+                    errors.append({
+                        "index": inx,
+                        "message":"Metadata checksum validation errors",
+                        "metadata_errors": item_errors
+                    })
+                try:
+                    f = self.file_to_declare(db, ds, user, inx, item, default_namespace, errors)
+                except (SanitizeException, AssertionError) as e:
+                    errors.append({"index": inx, "message": str(e)})
+                    continue
+                if f is not None:
+                    files.append(f)
+                    indexes[f.FID] = inx
+            return files, errors, indexes
+
+        def declare():
+            transaction = None
+            failed = False
+            ndeclared = nfailed = nchunks = 0
+            for ichunk, chunk in enumerate(chunks()):
+                nchunks += 1
+                report = {"chunk": ichunk, "first_index": chunk[0][0], "items": len(chunk), "files": []}
+                files, errors, indexes = validate_chunk(chunk)
+                if not errors and not (failed and commit == "all"):
+                    if transaction is None:
+                        transaction = db.transaction(on_delete="rollback")
+                        transaction.begin()
+                    try:
+                        db_errors = DBFile.declare_staged(db, files, user.Username, dataset=ds, transaction=transaction)
+                    except Exception as e:
+                        # the transaction was rolled back
+                        transaction = None
+                        errors.append({"message": str(e)})
+                    else:
+                        errors = [{"index": indexes.get(fid), "fid": fid, "message": message} for fid, message in db_errors]
+                    if errors and transaction is not None:
+                        transaction.rollback()
+                        transaction = None
+                    elif commit != "all":
+                        if dry_run: transaction.rollback()
+                        else:       transaction.commit()
+                        transaction = None
+
+                if errors:
+                    failed = True
+                    nfailed += 1
+                    report["status"] = "failed"
+                    report["errors"] = errors
+                elif failed and commit == "all":
+                    report["status"] = "skipped"
+                else:
+                    report["status"] = "declared"
+                    report["files"] = [{"fid": f.FID, "namespace": f.Namespace, "name": f.Name} for f in files]
+                    ndeclared += len(files)
+                yield json.dumps(report) + "\n"
+
+            if transaction is not None:
+                if failed or dry_run:   transaction.rollback()
+                else:                   transaction.commit()
+            if dry_run:
+                status = "dry run"
+            elif commit == "all":
+                status = "rolled back" if failed else "committed"
+                if failed:  ndeclared = 0
+            else:
+                status = "committed"
+            yield json.dumps({"summary": {"status": status, "chunks": nchunks, "declared": ndeclared, "failed": nfailed}}) + "\n"
+
+        return declare(), "application/x-ndjson"
+
     @sanitized
-    def declare_files(self, request, relpath, namespace=None, dataset=None, dry_run="no", **args):
+    def declare_files(self, request, relpath, namespace=None, dataset=None, dry_run="no", 
+                chunk_size="10000", commit="all", **args):
         # Declare new files, add to the dataset
         # request body: JSON with list:
         #
@@ -645,6 +933,9 @@ class DataHandler(MetaCatHandler):
         #       {"namespace":"...", "name":"..."}
         #               
         #   Dry run - do all the steps and checks, including metadata validation up to actual declaration
+        #
+        #   With Content-Type: application/x-ndjson, the request body is one file per line and the files are
+        #   declared in chunks of chunk_size files as they are read, see declare_files_stream()
         default_namespace = namespace
         dry_run = dry_run == "yes"
         user, error = self.authenticated_user()
@@ -668,6 +959,14 @@ class DataHandler(MetaCatHandler):
         if ds is None:
             return 400, f"Dataset {ds_namespace}:{ds_name} does not exist"
 
+        if request.content_type == "application/x-ndjson":
+            if commit not in ("all", "chunk"):
+                return 400, f"Invalid commit mode: {commit}"
+            try:    chunk_size = int(chunk_size)
+            except ValueError:
+                return 400, f"Invalid chunk size: {chunk_size}"
+            return self.declare_files_stream(request, db, ds, user, default_namespace, dry_run, max(chunk_size, 1), commit)
+
         file_list = json.loads(request.body) if request.body else []
         if not file_list:
             return 400, "Empty file list"
@@ -705,143 +1004,11 @@ class DataHandler(MetaCatHandler):
         
         for inx, file_item in enumerate(file_list):
             #print("data_handler.declare_files: file_item:", inx, file_item)
-            namespace = file_item.get("namespace", default_namespace)
-            name = file_item.get("name")
-            fid = file_item.get("fid")
-            
-            self.sanitize(namespace=namespace, name=name, fid=fid)
-            
-            size = file_item.get("size")
-            if size is None:
-                errors.append({
-                    "message": "Missing file size",
-                    "fid": fid,
-                    "index": inx
-                })
-                continue
-
-            if name is None:
-                did = file_item.get("did")
-                if did is not None:
-                    namespace, name = parse_name(did, namespace)
-                    
-            if name is None and "auto_name" not in file_item:
-                errors.append({
-                    "message":"Missing name and auto_name",
-                    "index": inx,
-                    "fid":fid
-                })
-                continue
-
-            if not namespace:
-                errors.append({
-                    "message":"Missing namespace",
-                    "index": inx,
-                    "fid":fid
-                })
-                continue
-
-            try:
-                if not self._namespace_authorized(db, namespace, user):
-                    errors.append({
-                        "index": inx,
-                        "fid":fid,
-                        "message":f"Permission to declare files in namespace {namespace} denied"
-                    })
-                    continue
-            except KeyError:
-                    errors.append({
-                        "index": inx,
-                        "fid":fid,
-                        "message":f"Namespace {namespace} does not exist"
-                    })
-                    continue
-
-            meta = file_item.get("metadata", {})
-            
-            for k in meta.keys():
-                if '.' not in k:
-                    errors.append({
-                        "index": inx,
-                        "message":f"Metadata parameter without a category: {k}"
-                    })
-
-            ds_validation_errors = ds.validate_file_metadata(meta)
-            if ds_validation_errors:
-                #print("validation errors:", ds_validation_errors)
-                errors.append({
-                    "index": inx,
-                    "message":f"Dataset metadata validation errors",
-                    "metadata_errors":ds_validation_errors
-                })
-                continue
-
-            fid = file_item.get("fid") or DBFile.generate_id()
-            if name is None:
-                pattern = file_item.get("auto_name", "$fid")
-                clock = int(time.time() * 1000)
-                clock3 = "%03d" % (clock%1000,)
-                clock6 = "%06d" % (clock%1000000,)
-                clock9 = "%09d" % (clock%1000000000,)
-                clock = str(clock)
-                u = uuid.uuid4().hex
-                u8 = u[-8:]
-                u16 = u[-16:]
-                name = pattern.replace("$clock3", clock3).replace("$clock6", clock6).replace("$clock9", clock9)\
-                    .replace("$clock", clock)\
-                    .replace("$uuid8", u8).replace("$uuid16", u16).replace("$uuid", u)\
-                    .replace("$fid", fid)
-                print("")
-
-            # allow admins to use creation info if present for migration.
-            # default it if not passed, or not admin.
-            if user.is_admin():
-                creator = file_item.get("creator", user.Username)
-                created_timestamp = file_item.get("created_timestamp", None)
-            else:
-                creator = user.Username
-                created_timestamp = None
-
-            f = DBFile(db, namespace=namespace, name=name, fid=fid, metadata=meta, size=size, creator=creator, created_timestamp=created_timestamp)
-            f.Checksums = file_item.get("checksums")
-
-            parents = []
-            for item in file_item.get("parents") or []:
-                if isinstance(item, str):
-                    parents.append(item)
-                elif isinstance(item, dict):
-                    if "fid" in item:
-                        parents.append(item["fid"])
-                    else:
-                        if "did" in item:
-                            pns, pn = parse_name(item["did"], default_namespace)
-                        elif "name" in item:
-                            pn = item["name"]
-                            pns = item.get("namespace", default_namespace)
-                            if not pns:
-                                errors.append({
-                                    "index": inx,
-                                    "message": "Parent specification error: no namespace: %s" % (item,)
-                                })
-                                error = True
-                                break
-                        else:
-                            errors.append({
-                                "index": inx,
-                                "message": "Parent specification error: %s" % (item,)
-                            })
-                            break
-                        parents.append((pns, pn))
-                        parents_to_resolve.add((pns, pn))
-                else:
-                    errors.append({
-                        "index": inx,
-                        "message": "Parent specification error: %s" % (item,)
-                    })
-                    
-            f.Parents = parents
-            files.append(f)
-            #print("data_handler.declare_files: file appended:", f)
+            f = self.file_to_declare(db, ds, user, inx, file_item, default_namespace, errors)
+            if f is not None:
+                parents_to_resolve.update(p for p in f.Parents if isinstance(p, tuple))
+                files.append(f)
+                #print("data_handler.declare_files: file appended:", f)
         
         if not errors and parents_to_resolve:
             resolved = DBFile.get_files(db, ({"namespace":ns, "name":n} for ns, n in parents_to_resolve))
@@ -1302,7 +1469,9 @@ class DataHandler(MetaCatHandler):
             lookup_lst.append(spec.as_dict())
 
         db = self.App.connect()
-        files = list(DBFile.get_files(db, lookup_lst))
+        files = DBFile.get_files(db, lookup_lst)
+        if with_provenance:
+            files = files.load_provenance()
         out = [f.to_jsonable(with_metadata = with_metadata, with_provenance = with_provenance) 
                 for f in files
         ]
@@ -1311,12 +1480,54 @@ class DataHandler(MetaCatHandler):
     @sanitized
     def query(self, request, relpath, query=None, namespace=None, 
                     with_meta="no", with_provenance="no", debug="no", include_retired_files="no",
-                    add_to=None, save_as=None, summary=None,
-                    **args):
+                    add_to=None, save_as=None, summary=None, page_size=None, page_after=None, explain=None,
+                    format="json", columns=None, **args):
 
         if summary not in ("count", "keys", None):
             return 400, f"Unsupported summary type: {summary}"
 
+        # format=arrow: the response is Arrow IPC stream with one column per item in the comma separated columns list.
+        # The items are file attributes (see DBFileSet.ColumnAttributes) or metadata keys
+        if format not in ("json", "arrow"):
+            return 400, f"Unsupported format: {format}"
+        if format == "arrow":
+            if summary or explain or save_as or add_to or page_size is not None or page_after is not None:
+                return 400, "Arrow format can not be used with summary, explain, pagination, save_as or add_to"
+            try:    import_pyarrow()
+            except ModuleNotFoundError as e:
+                return 400, f"Arrow format is not supported by the server: {e}"
+            columns = [c for c in unquote_plus(columns or "").split(",") if c] or DefaultColumns
+            with_meta = "yes" if any(c not in DBFileSet.ColumnAttributes for c in columns) else "no"
+            with_provenance = "no"
+        else:
+            columns = None
+
+        # explain=plan|analyze: the response is JSON with the query phase timings and the compiled query tree
+        # with row counts and times per node and Postgres EXPLAIN output per SQL node, see QueryExplainer
+        if explain not in ("plan", "analyze", None):
+            return 400, f"Unsupported explain mode: {explain}"
+        if explain and (summary or save_as or add_to or page_size is not None or page_after is not None):
+            return 400, "Explain can not be used with summary, pagination, save_as or add_to"
+
+        # keyset pagination: the response is {"files": [...], "next": <continuation token or null>}
+        # and the "next" token is to be sent back as page_after to get the next page
+        paged = page_size is not None or page_after is not None
+        if paged:
+            if summary:
+                return 400, "Pagination can not be used with summary"
+            try:    
+                page_size = int(page_size) if page_size is not None else None
+                if page_size is not None and page_size <= 0:
+                    raise ValueError()
+            except ValueError:
+                return 400, f"Invalid page size: {page_size}"
+            if page_after:
+                try:    page_after = DBFileSet.parse_continuation_token(page_after)
+                except ValueError as e:
+                    return 400, str(e)
+            else:
+                page_after = None
+
         with_meta = with_meta == "yes"
         with_provenance = with_provenance == "yes"
         include_retired_files = include_retired_files == "yes"
@@ -1384,17 +1595,45 @@ class DataHandler(MetaCatHandler):
 
         t0 = time.time()
         if not query_text:
+            if columns:
+                return arrow_stream(columns, []), ArrowStreamContentType
             return "[]", "application/json"
+
+        if explain:
+            try:
+                profile = QueryProfile()
+                query = MQLQuery.parse(query_text, db=db, default_namespace=namespace or None,
+                            include_retired_files=include_retired_files, profile=profile)
+                if query.Type != "file":
+                    return 400, "Explain is supported for file queries only"
+                out = query.explain(db, filters=self.App.filters(), analyze = explain == "analyze",
+                            with_meta=with_meta, with_provenance=with_provenance, profile=profile)
+            except (AssertionError, ValueError, MQLError) as e:
+                return 400, e.__class__.__name__ + ": " + str(e)
+            out["query"] = query_text
+            out["total_time"] = time.time() - t0
+            return json.dumps(out, default=str), "application/json"
             
         try:
-            query = MQLQuery.parse(query_text, 
+            query = MQLQuery.parse_cached(query_text, 
                         db=db, 
                         default_namespace=namespace or None, 
-                        include_retired_files=include_retired_files
+                        include_retired_files=include_retired_files,
+                        with_meta=with_meta, with_provenance=with_provenance,
+                        filters=self.App.filters()
             )
             query_type = query.Type
+            if paged and query_type != "file":
+                return 400, "Pagination is supported for file queries only"
+            # let the database build the JSON for the files if they are just to be streamed to the client
+            if columns and query_type != "file":
+                return 400, "Arrow format is supported for file queries only"
+            as_json = query_type == "file" and self.App.QueryRawJSON \
+                and not summary and not paged and add_to_dataset is None and not columns
             results = query.run(db, filters=self.App.filters(), with_meta=with_meta, with_provenance=with_provenance,
-                debug = debug == "yes"
+                debug = debug == "yes", itersize = self.App.QueryItersize,
+                page_size = page_size, page_after = page_after, as_json = as_json, columns = columns,
+                connect = self.App.connect, parallelism = self.App.QueryParallelism
             )
         except (AssertionError, ValueError, MQLError) as e:
             #traceback.print_exc()
@@ -1405,15 +1644,32 @@ class DataHandler(MetaCatHandler):
 
         if query_type == "file":
 
+            if as_json:
+                return self.json_stream(results, raw=True), "application/json-seq"
+            elif columns:
+                return arrow_stream(columns, results), ArrowStreamContentType
+
             if summary == "count":
                 count, size = results.counts()
                 return json.dumps({"count":count, "total_size":size}), "application/json"
             elif summary == "keys":
                 return json.dumps(list(results.metadata_keys())), "application/json"
 
-            if add_to_dataset is not None:
+            if with_provenance:
+                results = results.load_provenance()
+            if add_to_dataset is not None or paged:
                 results = list(results)
+            if add_to_dataset is not None:
                 nfiles = add_to_dataset.add_files(results)
+            if paged:
+                next_token = None
+                if results and (page_size is None or len(results) >= page_size):
+                    next_token = DBFileSet.continuation_token(results[-1])
+                out = dict(
+                    files = [f.to_jsonable(with_metadata=with_meta, with_provenance=with_provenance) for f in results],
+                    next = next_token
+                )
+                return json.dumps(out), "application/json"
             data = (f.to_jsonable(with_metadata=with_meta, with_provenance=with_provenance) for f in results)
             return self.json_stream(data), "application/json-seq"
 
@@ -1423,6 +1679,78 @@ class DataHandler(MetaCatHandler):
 
         return self.json_stream(data), "application/json-seq"
         
+    @sanitized
+    def export(self, request, relpath, query=None, namespace=None, format="csv", metadata=None,
+                    include_retired_files="no", **args):
+        # bulk export of file query results using COPY ... TO STDOUT
+        # metadata: "all" or comma separated list of metadata keys to include
+        # the query must be converted to SQL entirely, i.e. it must not use filters
+        if format not in ("csv", "ndjson"):
+            return 400, f"Unsupported export format: {format}"
+        include_retired_files = include_retired_files == "yes"
+        metadata_keys = None
+        with_meta = metadata == "all"
+        if metadata and not with_meta:
+            metadata_keys = [k for k in unquote_plus(metadata).split(",") if k]
+            with_meta = True
+
+        self.sanitize(namespace=namespace)
+
+        if query is not None:
+            query_text = unquote_plus(query)
+        elif "query" in request.POST:
+            query_text = request.POST["query"]
+        else:
+            query_text = request.body
+        query_text = to_str(query_text or "")
+        if not query_text:
+            return 400, "Query is not specified"
+
+        db = self.App.connect()
+        try:
+            query = MQLQuery.parse(query_text, db=db, default_namespace=namespace or None,
+                        include_retired_files=include_retired_files)
+            if query.Type != "file":
+                return 400, "Only file queries can be exported"
+            compiled = query.compile(db=db, with_meta=with_meta, with_provenance=False)
+        except (AssertionError, ValueError, MQLError) as e:
+            return 400, e.__class__.__name__ + ": " + str(e)
+
+        content_type = "text/csv" if format == "csv" else "application/x-ndjson"
+        params = SQLParams(compiled.get("params"))
+        if compiled.T == "sql":
+            sql = compiled["sql"]
+        elif compiled.T == "empty":
+            sql = DBFileSet.sql_for_file_list("fid", [], with_meta, False, None, 0, params)
+        else:
+            return 400, "The query can not be exported because it can not be converted to SQL entirely. Use data/query instead"
+        copy_sql = DBFileSet.sql_for_export(sql, params, format, metadata_keys, with_meta)
+        return DBFileSet.export(db, copy_sql, params), content_type
+
+    def query_plan_cache(self, request, relpath, **args):
+        # compiled query plan cache statistics for this server process
+        return json.dumps(plan_cache.stats()), "application/json"
+
+    def filter_caches(self, request, relpath, **args):
+        # external lookup cache statistics of the filters, which have caches configured, for this server process
+        return json.dumps({name: f.cache_stats() for name, f in self.App.filters().items()
+                            if f.cache_stats() is not None}), "application/json"
+
+    def db_pool(self, request, relpath, **args):
+        # database connection pool statistics for this server process
+        stats = {"database": self.App.DB.stats()}
+        if self.App.UserDB is not self.App.DB:
+            stats["user_database"] = self.App.UserDB.stats()
+        return json.dumps(stats), "application/json"
+
+    def auth_cache(self, request, relpath, **args):
+        # verified token and user cache statistics for this server process
+        return json.dumps(self.AuthCore.cache_stats()), "application/json"
+
+    def namespace_authorizations(self, request, relpath, **args):
+        # namespace authorization index statistics for this server process
+        return json.dumps(self.App.NamespaceAuthorizations.stats()), "application/json"
+
     @sanitized
     def search_queries(self, request, relpath, query=None,**args):
         if query is not None:
@@ -1496,6 +1824,7 @@ class DataHandler(MetaCatHandler):
             existing.Creator = user.Username
             existing.CreatedTimestamp = datetime.now()
             existing.save()
+            plan_cache.invalidate("query", namespace, name)
             q = existing
         else:
             q = DBNamedQuery(db, namespace, name, data["source"], data.get("parameters", []))
@@ -1,7 +1,7 @@
 from webpie import WPApp, WPHandler, Response, WPStaticHandler, sanitize
 import psycopg2, json, time, secrets, traceback, hashlib, pprint
 from metacat.db import DBFile, DBDataset, DBFileSet, DBNamedQuery, DBUser, DBNamespace, DBRole, DBParamCategory, \
-        parse_name, AlreadyExistsError, IntegrityError
+        parse_name, AlreadyExistsError, IntegrityError, DatasetCircularDependencyDetected
 from wsdbtools import ConnectionPool
 from urllib.parse import quote_plus, unquote_plus, unquote, quote
 from metacat.util import to_str, to_bytes
@@ -691,6 +691,7 @@ class GUIHandler(MetaCatHandler):
                         if v == "on":
                             new_roles.add(r)
                 u.roles.set(new_roles)
+                self.App.NamespaceAuthorizations.invalidate()
         elif "add_dn" in request.POST:
             dn = request.POST.get("new_dn")
             if dn:
@@ -712,6 +713,7 @@ class GUIHandler(MetaCatHandler):
                     dn_list.remove(dn_to_remove)
                 u.set_dns(dn_list)
                 u.save()
+        self.AuthCore.invalidate_user(username)
         self.redirect(f"./user?username={username}")
 
     def generate_token(self, request, relpath, **args):
@@ -812,6 +814,7 @@ class GUIHandler(MetaCatHandler):
                 ns.OwnerUser = owner_user
                 ns.OwnerRole = owner_role
             ns.save()
+            self.App.NamespaceAuthorizations.invalidate()
         self.redirect("./namespaces")
         
     def make_page_links(self, npages, page, page_size, all_page_links, window=2):
@@ -1050,15 +1053,14 @@ class GUIHandler(MetaCatHandler):
                 child = DBDataset.get(db, child_namespace, child_name)
                 if child is None:
                     self.redirect("./datasets?error=%s" % (quote_plus(f"Child dataset {child_namespace}:{child_name} not found"),))
-                ancestors = list(ds.ancestors())
-                #print("Ancestors: of", ds, ":", *ancestors)
                 subsets = list(ds.subsets())
                 #print("Subsets:", *subsets)
-                if any(a.Namespace == child_namespace and a.Name == child_name for a in ancestors):
-                    self.redirect("./datasets?error=%s" % (quote_plus(f"Circular dependency detected"),))
                 if any(a.Namespace == child_namespace and a.Name == child_name for a in subsets):
                     warning = f"Dataset {child_namespace}:{child_name} is already a subset of {namespace}:{name}"
-                ds.add_child(child)
+                try:
+                    ds.add_child(child)
+                except DatasetCircularDependencyDetected:
+                    self.redirect("./datasets?error=%s" % (quote_plus(f"Circular dependency detected"),))
         elif mode == "create":
             ds.create()
         elif mode == "edit":
@@ -1146,4 +1148,6 @@ class GUIHandler(MetaCatHandler):
         #print("save_role: members:", members)
         role.save()
         role.set_members(members)
+        self.AuthCore.invalidate_user()
+        self.App.NamespaceAuthorizations.invalidate()
         self.redirect("./role?name=%s&message=Role+saved" % (rname,))